@@ -0,0 +1,152 @@
+"""Queue latency per workspace under overload: the admission (priority + fair-share) vs a plain FIFO queue.
+
+A simulated clock is used, no process is launched.
+Every minute the `busy` workspace fires --busy-jobs jobs, `light` fires --light-jobs jobs,
+and `critical` (another venv, priority 10) fires --critical-jobs jobs, each job runs --duration seconds.
+
+> python benchmarks/bench_fair_share.py --workers 8 --minutes 10
+"""
+
+import heapq
+import json
+import random
+import statistics
+import sys
+import tempfile
+from argparse import ArgumentParser
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from taska.admission import Admission  # noqa: E402
+
+
+def make_jobs(root_dir: Path, busy: int, light: int, critical: int):
+    "[(job_dir, workspace, priority)]"
+    jobs = []
+    for venv, workspace, count, priority in [
+        ("venv1", "busy", busy, 0),
+        ("venv1", "light", light, 0),
+        ("venv2", "critical", critical, 10),
+    ]:
+        for i in range(count):
+            job_dir = root_dir.joinpath(
+                "python", venv, "workspaces", workspace, "jobs", f"job{i}"
+            )
+            jobs.append((job_dir, workspace, priority))
+    return jobs
+
+
+class FifoQueue:
+    "The baseline: whichever run comes first wins the free slot."
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.running = 0
+        self.queue: deque = deque()
+        self.queued: set = set()
+
+    def push(self, job_dir: Path, priority: int = 0, now: float = 0) -> bool:
+        if job_dir in self.queued:
+            return False
+        self.queue.append((job_dir, now))
+        self.queued.add(job_dir)
+        return True
+
+    def release(self, job_dir: Path):
+        self.running -= 1
+
+    def pop_ready(self, now: float):
+        ready = []
+        while self.queue and self.running < self.workers:
+            job_dir, queued_at = self.queue.popleft()
+            self.queued.discard(job_dir)
+            self.running += 1
+            ready.append((job_dir, now - queued_at))
+        return ready
+
+
+def simulate(queue, jobs, minutes: int, duration: float):
+    "Return {workspace: [wait_seconds]}"
+    workspaces = {job_dir: workspace for job_dir, workspace, _ in jobs}
+    waits: dict = {workspace: [] for workspace in workspaces.values()}
+    skipped = 0
+    # (end_at, seq, job_dir)
+    running: list = []
+    seq = 0
+
+    def start(now: float):
+        nonlocal seq
+        for job_dir, wait in queue.pop_ready(now=now):
+            waits[workspaces[job_dir]].append(wait)
+            seq += 1
+            end_at = now + duration * random.uniform(0.5, 1.5)
+            heapq.heappush(running, (end_at, seq, job_dir))
+
+    for minute in range(minutes + 1):
+        now = minute * 60.0
+        while running and running[0][0] <= now:
+            end_at, _, job_dir = heapq.heappop(running)
+            queue.release(job_dir)
+            start(end_at)
+        if minute == minutes:
+            break
+        order = list(jobs)
+        random.shuffle(order)
+        for job_dir, _, priority in order:
+            if not queue.push(job_dir, priority=priority, now=now):
+                skipped += 1
+        start(now)
+    return waits, skipped
+
+
+def summary(waits: dict, skipped: int):
+    result = {}
+    for workspace, items in sorted(waits.items()):
+        items.sort()
+        result[workspace] = {
+            "runs": len(items),
+            "p50_s": round(statistics.median(items), 2) if items else None,
+            "p99_s": round(items[int(len(items) * 0.99)], 2) if items else None,
+            "max_s": round(items[-1], 2) if items else None,
+        }
+    result["skipped"] = skipped
+    return result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--minutes", type=int, default=10)
+    parser.add_argument("--busy-jobs", type=int, default=500)
+    parser.add_argument("--light-jobs", type=int, default=5)
+    parser.add_argument("--critical-jobs", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp)
+        root_dir.joinpath("max_workers").write_text(str(args.workers))
+        jobs = make_jobs(root_dir, args.busy_jobs, args.light_jobs, args.critical_jobs)
+        for name, queue in [
+            ("fifo", FifoQueue(args.workers)),
+            ("admission", Admission(root_dir, max_length=len(jobs))),
+        ]:
+            random.seed(args.seed)
+            results[name] = summary(*simulate(queue, jobs, args.minutes, args.duration))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(f"{name}: skipped={result.pop('skipped')}")
+        for workspace, item in result.items():
+            print(
+                f"  {workspace:<10} runs={item['runs']:<6} p50={item['p50_s']}s p99={item['p99_s']}s max={item['max_s']}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Fire drift of the Scheduler: the delay between the scheduled fire time and the pop time.
+
+No process is launched, so it measures the scheduler loop only.
+
+> python benchmarks/bench_fire_drift.py --jobs 1000 10000 --seconds 20
+"""
+
+import json
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from taska.scheduler import Scheduler  # noqa: E402
+
+
+def run(jobs: int, seconds: float, max_interval: int):
+    now = datetime.now()
+    scheduler = Scheduler(now)
+    for i in range(jobs):
+        job_dir = Path(f"job{i}")
+        job = {"crontab": "", "interval": random.randint(1, max_interval), "enable": 1}
+        scheduler.update(job_dir, job, now)
+    drifts = []
+    end_at = time.time() + seconds
+    while True:
+        ts = time.time()
+        if ts > end_at:
+            break
+        wake_at = scheduler.next_fire_at()
+        if wake_at is not None and wake_at > ts:
+            time.sleep(min(wake_at, end_at) - ts)
+        now = datetime.now()
+        popped_at = now.timestamp()
+        for job_dir, fire_at in scheduler.pop_due(now):
+            drifts.append((popped_at - fire_at) * 1000)
+    drifts.sort()
+    return {
+        "jobs": jobs,
+        "seconds": seconds,
+        "fires": len(drifts),
+        "p50_ms": round(statistics.median(drifts), 3) if drifts else None,
+        "p99_ms": round(drifts[int(len(drifts) * 0.99)], 3) if drifts else None,
+        "max_ms": round(drifts[-1], 3) if drifts else None,
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--max-interval", type=int, default=10, dest="max_interval")
+    parser.add_argument("--json", action="store_true", dest="as_json")
+    args = parser.parse_args()
+    for jobs in args.jobs:
+        result = run(jobs, args.seconds, args.max_interval)
+        if args.as_json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                "jobs={jobs:>6} fires={fires:>7} p50={p50_ms}ms p99={p99_ms}ms max={max_ms}ms".format(
+                    **result
+                ),
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Load test of the web apps: the bottle app on waitress vs the asgi app on uvicorn.
+
+Each app is started as `python -m taska --app {app}` on a synthetic root, then --clients keep-alive clients request a
+mix of pages for --duration seconds, while --streams clients hold the /stream log followers open (the tail -F pages),
+which park one waitress thread each.
+
+The mix: dir listing, file view, tail=100 of a big log, grep, 1MB download, console, metrics.
+
+> python benchmarks/bench_http_load.py --apps bottle asgi --clients 50 200 400 --streams 50 --output bench_http.jsonl
+"""
+
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from urllib.parse import quote_plus
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from taska import __version__  # noqa: E402
+from taska.core import RootDir  # noqa: E402
+
+PASSWORD = "bench"
+PATHS = [
+    "/view//",
+    "/view/files",
+    "/view/files/file1.txt?action=view",
+    "/view/logs/big.log?tail=100",
+    "/view/logs/big.log?action=view&grep=%s&max=100" % quote_plus("line 99"),
+    "/view/files/blob.bin?action=download",
+    "/console",
+    "/metrics",
+]
+
+
+def build_root(base: Path) -> Path:
+    root_dir = RootDir.prepare_dir(base, "root")
+    files = root_dir / "files"
+    files.mkdir()
+    for i in range(200):
+        files.joinpath(f"file{i}.txt").write_text(f"file {i}\n" * 100)
+    files.joinpath("blob.bin").write_bytes(os.urandom(1024 * 1024))
+    logs = root_dir / "logs"
+    logs.mkdir()
+    with logs.joinpath("big.log").open("w") as f:
+        for i in range(100000):
+            f.write(f"2024-01-01 00:00:00 | INFO | line {i} {'x' * 40}\n")
+    return root_dir
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app: str, root_dir: Path, port: int, timeout=30) -> subprocess.Popen:
+    cmd = [
+        sys.executable,
+        "-m",
+        "taska",
+        "--root",
+        root_dir.as_posix(),
+        "--app",
+        app,
+        "--port",
+        str(port),
+        "--no-stream-log",
+        "--ignore-default",
+    ]
+    proc = subprocess.Popen(
+        cmd,
+        cwd=Path(__file__).resolve().parent.parent,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            stderr = proc.stderr.read().decode(errors="replace") if proc.stderr else ""
+            raise RuntimeError(f"{app} server exited: {stderr[-2000:]}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{app} server not ready in {timeout}s")
+
+
+async def read_response(reader: asyncio.StreamReader):
+    "(status, headers, body size) of a HTTP/1.1 response."
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            k, _, v = line.partition(":")
+            headers[k.strip().lower()] = v.strip()
+    size = 0
+    if "content-length" in headers:
+        size = len(await reader.readexactly(int(headers["content-length"])))
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            chunk_size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(chunk_size + 2)
+            size += chunk_size
+            if not chunk_size:
+                break
+    elif status not in {204, 304}:
+        size = len(await reader.read())
+        headers["connection"] = "close"
+    return status, headers, size
+
+
+def build_request(method: str, path: str, cookie="", body=b"", headers=()) -> bytes:
+    lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1"]
+    if cookie:
+        lines.append(f"Cookie: {cookie}")
+    lines.extend(headers)
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+async def login(port: int) -> str:
+    "The sign cookie, the first POST sets the password."
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        body = f"pwd={PASSWORD}".encode()
+        writer.write(
+            build_request(
+                "POST",
+                "/login",
+                body=body,
+                headers=["Content-Type: application/x-www-form-urlencoded"],
+            )
+        )
+        status, headers, _ = await read_response(reader)
+        cookie = headers.get("set-cookie", "").split(";")[0]
+        if not cookie.startswith("sign="):
+            raise RuntimeError(f"login failed: {status} {headers}")
+        return cookie
+    finally:
+        writer.close()
+
+
+async def client(port: int, cookie: str, deadline: float, stats: dict):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        path = random.choice(PATHS)
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            start = time.perf_counter()
+            writer.write(build_request("GET", path, cookie))
+            status, headers, size = await read_response(reader)
+            stats["latency"].append(time.perf_counter() - start)
+            stats["bytes"] += size
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            stats["errors"][type(e).__name__] = stats["errors"].get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+async def follower(port: int, cookie: str, deadline: float, stats: dict):
+    "Hold a /stream follower of the big log open until the deadline."
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        stats["stream_errors"] += 1
+        return
+    try:
+        writer.write(build_request("GET", "/stream/logs/big.log?lines=10", cookie))
+        head = await asyncio.wait_for(
+            reader.readuntil(b"\r\n\r\n"), deadline - time.perf_counter()
+        )
+        if b" 200 " in head.split(b"\r\n")[0]:
+            stats["streams_open"] += 1
+        while time.perf_counter() < deadline:
+            data = await asyncio.wait_for(reader.read(65536), deadline - time.perf_counter())
+            if not data:
+                break
+    except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_load(port: int, clients: int, streams: int, duration: float) -> dict:
+    cookie = await login(port)
+    stats: dict = {
+        "latency": [],
+        "bytes": 0,
+        "status": {},
+        "errors": {},
+        "streams_open": 0,
+        "stream_errors": 0,
+    }
+    start = time.perf_counter()
+    deadline = start + duration
+    tasks = [follower(port, cookie, deadline, stats) for _ in range(streams)]
+    tasks += [client(port, cookie, deadline, stats) for _ in range(clients)]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    latency = sorted(stats["latency"])
+    return {
+        "requests": len(latency),
+        "rps": round(len(latency) / elapsed, 1),
+        "mb_per_s": round(stats["bytes"] / elapsed / 1024 / 1024, 2),
+        "p50_ms": round(statistics.median(latency) * 1000, 2) if latency else None,
+        "p99_ms": round(latency[min(int(len(latency) * 0.99), len(latency) - 1)] * 1000, 2)
+        if latency
+        else None,
+        "max_ms": round(latency[-1] * 1000, 2) if latency else None,
+        "status": {str(k): v for k, v in sorted(stats["status"].items())},
+        "errors": stats["errors"],
+        "streams_open": stats["streams_open"],
+        "stream_errors": stats["stream_errors"],
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--apps", nargs="+", default=["bottle", "asgi"])
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200, 400])
+    parser.add_argument("--streams", type=int, default=50, help="log followers held open")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="", help="append the JSON lines to this file")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = build_root(Path(tmp)).resolve()
+        for app in args.apps:
+            port = get_free_port()
+            try:
+                proc = start_server(app, root_dir, port)
+            except RuntimeError as e:
+                print(json.dumps({"app": app, "skipped": str(e)}), flush=True)
+                continue
+            try:
+                for clients in args.clients:
+                    random.seed(args.seed)
+                    result = {
+                        "version": __version__,
+                        "python": platform.python_version(),
+                        "platform": sys.platform,
+                        "cpu_count": os.cpu_count(),
+                        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "app": app,
+                        "clients": clients,
+                        "streams": args.streams,
+                        "duration": args.duration,
+                    }
+                    result.update(
+                        asyncio.run(
+                            run_load(port, clients, args.streams, args.duration)
+                        )
+                    )
+                    line = json.dumps(result)
+                    print(line, flush=True)
+                    if args.output:
+                        with open(args.output, "a", encoding="utf-8") as f:
+                            f.write(line + "\n")
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+if __name__ == "__main__":
+    main()
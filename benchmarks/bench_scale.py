@@ -0,0 +1,254 @@
+"""Scale of the scheduler / launcher / console on a synthetic root dir.
+
+The root has --pythons PythonDirs, --venvs VenvDirs per python and --workspaces WorkspaceDirs per venv, the jobs are
+spread over the workspaces with varied crontabs / intervals. The venvs are stubs (bin/python links to sys.executable,
+empty requirements), so no pip is needed.
+
+Timed:
+- init: Taska() on a cold index (walk + load meta + fill the scheduler), then init_dir_tree on the warm index
+- get_todos: --ticks scheduler ticks, one simulated second each
+- launch: --launches real runs through the admission + launcher, spawn rate and wall time
+- get_pids_info / get_end_at / console: on the launched runs
+
+Each size prints one JSON line (or appends to --output), to compare between the releases.
+
+> python benchmarks/bench_scale.py --jobs 1000 10000 100000 --output bench_scale.jsonl
+"""
+
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from hashlib import md5
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from taska import __version__  # noqa: E402
+from taska.core import JobDir, RootDir, Taska  # noqa: E402
+
+CRONTABS = [
+    "* * * * *",
+    "*/5 * * * *",
+    "0 * * * *",
+    "15,45 * * * *",
+    "0 0 * * *",
+    "*/10 * * * * *",
+    "0 9-18 * * 1-5",
+]
+INTERVALS = [1, 5, 30, 300]
+BENCH_CODE = "import time\n\ndef main(seconds=0):\n    time.sleep(seconds)\n    return 1\n"
+
+
+def prepare_venv(venv_dir: Path):
+    "A venv stub: valid VenvDir with the current python, nothing to install."
+    venv_dir.joinpath("workspaces").mkdir(parents=True)
+    venv_dir.joinpath("requirements.txt").write_text("")
+    venv_dir.joinpath("requirements.md5").write_text(md5(b"").hexdigest())
+    venv_dir.joinpath("pip.conf").write_text("[global]\ntimeout = 60")
+    if sys.platform == "win32":
+        bin_dir = venv_dir / "Scripts"
+        bin_dir.mkdir()
+        os.link(sys.executable, bin_dir / "python.exe")
+    else:
+        bin_dir = venv_dir / "bin"
+        bin_dir.mkdir()
+        bin_dir.joinpath("python").symlink_to(sys.executable)
+
+
+def build_root(
+    base: Path, pythons: int, venvs: int, workspaces: int, jobs: int, enable_ratio: float
+) -> Path:
+    root_dir = RootDir.prepare_dir(base, "root")
+    # no limit, the launches are timed
+    root_dir.joinpath("max_workers").write_text("0")
+    workspace_dirs = []
+    for p in range(pythons):
+        python_dir = root_dir / f"python{p}"
+        python_dir.mkdir()
+        python_dir.joinpath("python_path").write_text(Path(sys.executable).as_posix())
+        for v in range(venvs):
+            venv_dir = python_dir / f"venv{v}"
+            prepare_venv(venv_dir)
+            for w in range(workspaces):
+                workspace_dir = venv_dir / "workspaces" / f"workspace{w}"
+                workspace_dir.joinpath("jobs").mkdir(parents=True)
+                workspace_dir.joinpath("bench.py").write_text(BENCH_CODE)
+                workspace_dirs.append(workspace_dir)
+    for i in range(jobs):
+        job_dir = workspace_dirs[i % len(workspace_dirs)] / "jobs" / f"job{i}"
+        job_dir.mkdir()
+        meta = dict(JobDir.default_meta)
+        meta["name"] = job_dir.name
+        meta["entrypoint"] = "bench:main"
+        meta["enable"] = int(random.random() < enable_ratio)
+        if random.random() < 0.2:
+            meta["interval"] = random.choice(INTERVALS)
+        else:
+            meta["crontab"] = random.choice(CRONTABS)
+        job_dir.joinpath("meta.json").write_text(json.dumps(meta))
+    return root_dir
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def percentile(items: list, p: float):
+    items = sorted(items)
+    return items[min(int(len(items) * p), len(items) - 1)] if items else None
+
+
+def bench_todos(ta: Taska, ticks: int):
+    "Ticks of one simulated second from now, [seconds of each tick], fires"
+    costs = []
+    fires = 0
+    now = datetime.now()
+    for i in range(1, ticks + 1):
+        todos, cost = timed(lambda: list(ta.get_todos(now + timedelta(seconds=i))))
+        costs.append(cost)
+        fires += len(todos)
+    return costs, fires
+
+
+def bench_launch(job_dirs: list, seconds: float):
+    "Launch the jobs (sleep `seconds`) through the admission, return (runs, spawn seconds, start, pids)"
+    for job_dir in job_dirs:
+        meta_path = job_dir / "meta.json"
+        meta = json.loads(meta_path.read_text())
+        meta["params"] = {"seconds": seconds}
+        meta_path.write_text(json.dumps(meta))
+    Taska.get_index().refresh()
+    admission = Taska.get_admission()
+    start = time.perf_counter()
+    for job_dir in job_dirs:
+        admission.push(job_dir)
+    futures = [Taska.submit_job(job_dir) for job_dir, _ in admission.pop_ready()]
+    runs = [future.result() for future in futures]
+    for run in runs:
+        run.started.wait(30)
+    spawned = time.perf_counter() - start
+    pids = [run.pid for run in runs if run.pid]
+    return runs, spawned, start, pids
+
+
+def run(args, jobs: int) -> dict:
+    random.seed(args.seed)
+    result: dict = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "jobs": jobs,
+        "pythons": args.pythons,
+        "venvs": args.venvs,
+        "workspaces": args.workspaces,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        _, cost = timed(
+            build_root,
+            Path(tmp),
+            args.pythons,
+            args.venvs,
+            args.workspaces,
+            jobs,
+            args.enable_ratio,
+        )
+        root_dir = Path(tmp, "root").resolve()
+        result["build_s"] = round(cost, 3)
+        Taska.ROOT_PATH = root_dir
+        ta, cost = timed(Taska)
+        result["init_cold_s"] = round(cost, 4)
+        result["indexed_jobs"] = len(ta.index.jobs)
+        _, cost = timed(ta.init_dir_tree)
+        result["init_warm_s"] = round(cost, 4)
+
+        costs, fires = bench_todos(ta, args.ticks)
+        result["todos_fires"] = fires
+        result["todos_p50_ms"] = round(statistics.median(costs) * 1000, 3)
+        result["todos_p99_ms"] = round(percentile(costs, 0.99) * 1000, 3)
+        result["todos_max_ms"] = round(max(costs) * 1000, 3)
+
+        job_dirs = sorted(ta.index.jobs)[: args.launches]
+        runs, spawned, start, pids = bench_launch(job_dirs, args.run_seconds)
+        result["launches"] = len(runs)
+        result["launch_spawn_s"] = round(spawned, 3)
+        result["launch_per_s"] = round(len(runs) / spawned, 1) if spawned else None
+
+        # the runs are sleeping
+        items, cost = timed(Taska.get_pids_info, pids)
+        result["pids_info_ms"] = round(cost * 1000, 3)
+        result["pids_info_per_pid_us"] = round(cost / len(pids) * 1e6, 1) if pids else None
+        _, cost = timed(Taska.sample_processes)
+        result["sample_processes_ms"] = round(cost * 1000, 3)
+
+        for run_ in runs:
+            run_.wait(args.run_seconds + 30)
+        result["launch_wall_s"] = round(time.perf_counter() - start, 3)
+        result["launch_failed"] = sum(1 for run_ in runs if run_.returncode)
+
+        ended = [dict(item, status="dead") for item in items.values()]
+        costs = []
+        for item in ended:
+            _, cost = timed(Taska.get_end_at, item)
+            costs.append(cost)
+        if costs:
+            result["end_at_p50_ms"] = round(statistics.median(costs) * 1000, 3)
+            result["end_at_max_ms"] = round(max(costs) * 1000, 3)
+        result.update(bench_console())
+        Taska.shutdown()
+        Taska.get_store().close()
+        Taska.get_launcher().shutdown(wait=True)
+        Taska.LAUNCHER = Taska.SAMPLER = None
+        Taska.LATEST_PROC_CACHE.clear()
+        Taska.SHUTDOWN = False
+    return result
+
+
+def bench_console() -> dict:
+    "Render the console page from a fresh snapshot, skipped without the web dependencies."
+    try:
+        from taska.bottle_app.app import Config, render_console
+        from taska.sampler import ProcessSampler
+    except ImportError as e:
+        return {"console_skipped": repr(e)}
+    sampler = ProcessSampler(Taska.sample_processes)
+    sampler.refresh()
+    Config.console_cache = ()
+    _, cost = timed(render_console, sampler.snapshot)
+    return {"console_render_ms": round(cost * 1000, 3)}
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--pythons", type=int, default=2)
+    parser.add_argument("--venvs", type=int, default=4, help="per python")
+    parser.add_argument("--workspaces", type=int, default=8, help="per venv")
+    parser.add_argument("--enable-ratio", type=float, default=0.9, dest="enable_ratio")
+    parser.add_argument("--ticks", type=int, default=120)
+    parser.add_argument("--launches", type=int, default=50)
+    parser.add_argument("--run-seconds", type=float, default=5.0, dest="run_seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="", help="append the JSON lines to this file")
+    args = parser.parse_args()
+    for jobs in args.jobs:
+        result = run(args, jobs)
+        line = json.dumps(result)
+        print(line, flush=True)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
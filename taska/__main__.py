@@ -1,3 +1,4 @@
+import os
 from argparse import ArgumentParser
 from pathlib import Path
 
@@ -5,21 +6,32 @@ from taska.config import Config
 from taska.core import Taska
 
 
-def start_bottle_app(root_path, host="127.0.0.1", port=8021, debug=False):
+def start_web_app(app_main, root_path, host="127.0.0.1", port=8021, debug=False):
+    "Serve the web app, with the scheduler in a thread."
     from threading import Thread
 
-    from taska.bottle_app.app import main
-
     taska = Taska()
     thread = Thread(target=taska.run_forever)
     thread.start()
     try:
-        return main(root_path, host=host, port=port, debug=debug)
+        return app_main(root_path, host=host, port=port, debug=debug)
     finally:
-        Taska.SHUTDOWN = True
+        Taska.shutdown()
         thread.join()
 
 
+def start_bottle_app(root_path, host="127.0.0.1", port=8021, debug=False):
+    from taska.bottle_app.app import main
+
+    return start_web_app(main, root_path, host, port, debug)
+
+
+def start_asgi_app(root_path, host="127.0.0.1", port=8021, debug=False):
+    from taska.asgi_app.app import main
+
+    return start_web_app(main, root_path, host, port, debug)
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument("--root", default="", dest="root")
@@ -34,11 +46,24 @@ def main():
         "--app-handler",
         default="bottle",
         dest="app_handler",
-        help="default/bottle",
+        help="default/bottle/asgi(fastapi)",
     )
     parser.add_argument("--host", default="127.0.0.1", dest="host")
     parser.add_argument("--port", default=8021, type=int, dest="port")
     parser.add_argument("--debug", action="store_true", dest="debug")
+    parser.add_argument(
+        "--metrics-token",
+        default=os.environ.get("TASKA_METRICS_TOKEN", ""),
+        dest="metrics_token",
+        help="bearer token of the /metrics scrapes (env TASKA_METRICS_TOKEN)",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        default=Taska.SAMPLE_INTERVAL,
+        type=float,
+        dest="sample_interval",
+        help="seconds between the process stats samples of the console",
+    )
     args, extra = parser.parse_known_args()
     if args.root:
         root_path = Path(args.root).resolve()
@@ -48,7 +73,9 @@ def main():
     else:
         raise ValueError("--root is required")
     Taska.ROOT_PATH = root_path
+    Taska.SAMPLE_INTERVAL = args.sample_interval
     Config.LOG_STREAM = args.stream_log
+    Config.METRICS_TOKEN = args.metrics_token
     Config.LOG_DIR = root_path.joinpath("logs")
     Config.init_logger()
     if args.rm_dir:
@@ -65,9 +92,8 @@ def main():
             return Taska().run_forever()
         elif args.app_handler == "bottle":
             return start_bottle_app(root_path, args.host, args.port, args.debug)
-        elif args.app_handler == "fastapi":
-            raise NotImplementedError("fastapi not implemented yet")
-
+        elif args.app_handler in {"asgi", "fastapi"}:
+            return start_asgi_app(root_path, args.host, args.port, args.debug)
         else:
             raise ValueError("--app-handler is required")
 
@@ -0,0 +1,234 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import typing
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger("taska")
+
+
+class Pending(typing.NamedTuple):
+    job_dir: Path
+    queued_at: float
+    priority: int = 0
+
+
+class Admission:
+    """Central admission of the runs: the global `root/max_workers`, and the optional `max_workers` files of the VenvDir
+    and WorkspaceDir (missing or 0 means unlimited).
+
+    The over-limit runs wait in a bounded queue, and start once a slot is released by an exited run.
+    The slots are counted in memory, so two runs can not both see N-1.
+
+    Free slots go to the highest job `priority` first. Within the same priority the slots are shared by weighted fair
+    queuing, between the venvs and then between the workspaces of the venv: each admitted run adds `1 / weight` to the
+    virtual time of its groups, and the group with the least virtual time goes next.
+    The weight is read from the optional `weight` file of the VenvDir / WorkspaceDir, default 1.
+    The runs of the same workspace and priority are FIFO.
+    The runs of a held venv (such as installing) stay queued until it is released."""
+
+    LIMIT_FILE = "max_workers"
+    WEIGHT_FILE = "weight"
+
+    def __init__(self, root_dir: Path, max_length: int = 1000):
+        self.root_dir = root_dir
+        self.max_length = max_length
+        # workspace_dir => heap of (-priority, seq, Pending)
+        self.queues: typing.Dict[Path, list] = {}
+        self.queued: typing.Set[Path] = set()
+        self.length = 0
+        # root / venv / workspace dir => running count
+        self.running: typing.Dict[Path, int] = {}
+        # venv / workspace dir => virtual time
+        self.vtimes: typing.Dict[Path, float] = {}
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.dropped = 0
+        # wait seconds of the latest admitted runs
+        self.waits: typing.Deque[float] = deque(maxlen=100)
+        self._seq = itertools.count()
+        # venv dirs which can not run, such as installing
+        self.held: typing.Set[Path] = set()
+        # path => (mtime, value)
+        self._files: typing.Dict[Path, typing.Tuple[int, float]] = {}
+
+    def read_number(self, path: Path, default: float = 0) -> float:
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return default
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            value = float(path.read_text().strip() or default)
+        except (OSError, ValueError):
+            value = default
+        self._files[path] = (mtime, value)
+        return value
+
+    def get_limit(self, dir_path: Path) -> int:
+        return int(self.read_number(dir_path / self.LIMIT_FILE))
+
+    def get_weight(self, dir_path: Path) -> float:
+        weight = self.read_number(dir_path / self.WEIGHT_FILE, 1)
+        return weight if weight > 0 else 1
+
+    def get_groups(self, job_dir: Path) -> typing.Tuple[Path, Path, Path]:
+        # job_dir => jobs => workspace => workspaces => venv => python => root
+        workspace_dir = job_dir.parents[1]
+        venv_dir = workspace_dir.parents[1]
+        return self.root_dir, venv_dir, workspace_dir
+
+    def hold(self, venv_dir: Path):
+        with self.lock:
+            self.held.add(venv_dir)
+
+    def unhold(self, venv_dir: Path):
+        with self.lock:
+            self.held.discard(venv_dir)
+
+    def can_run(self, job_dir: Path) -> bool:
+        if self.held and job_dir.parents[3] in self.held:
+            return False
+        for group in self.get_groups(job_dir):
+            limit = self.get_limit(group)
+            if limit > 0 and self.running.get(group, 0) >= limit:
+                return False
+        return True
+
+    def acquire(self, job_dir: Path, force=False) -> bool:
+        "Take a slot if not over limit, `force` for the manual launches."
+        with self.lock:
+            if not force and not self.can_run(job_dir):
+                return False
+            self._acquire(job_dir)
+            return True
+
+    def _acquire(self, job_dir: Path):
+        for group in self.get_groups(job_dir):
+            self.running[group] = self.running.get(group, 0) + 1
+
+    def release(self, job_dir: Path):
+        with self.lock:
+            for group in self.get_groups(job_dir):
+                count = self.running.get(group, 0) - 1
+                if count > 0:
+                    self.running[group] = count
+                else:
+                    self.running.pop(group, None)
+
+    def _activate(self, group: Path, peers: typing.Iterable[Path]):
+        # an idle group starts from the least virtual time of the active peers, so it can not save up credits
+        vtimes = [self.vtimes.get(peer, 0.0) for peer in peers]
+        if vtimes:
+            self.vtimes[group] = max(self.vtimes.get(group, 0.0), min(vtimes))
+
+    def push(
+        self, job_dir: Path, priority: int = 0, now: typing.Optional[float] = None
+    ) -> bool:
+        "Queue the run, return False if already queued or the queue is full."
+        with self.lock:
+            if job_dir in self.queued:
+                logger.info(f"[Admission] Already queued: {job_dir.as_posix()}")
+                return False
+            if self.length >= self.max_length:
+                self.dropped += 1
+                logger.error(
+                    f"[Admission] Queue is full ({self.max_length}), dropped: {job_dir.as_posix()}"
+                )
+                return False
+            _, venv_dir, workspace_dir = self.get_groups(job_dir)
+            if workspace_dir not in self.queues:
+                active_venvs = {i.parents[1] for i in self.queues}
+                if venv_dir not in active_venvs:
+                    self._activate(venv_dir, active_venvs)
+                self._activate(
+                    workspace_dir, [i for i in self.queues if i.parents[1] == venv_dir]
+                )
+                self.queues[workspace_dir] = []
+            item = Pending(job_dir, time.time() if now is None else now, priority)
+            heapq.heappush(
+                self.queues[workspace_dir], (-priority, next(self._seq), item)
+            )
+            self.queued.add(job_dir)
+            self.length += 1
+            return True
+
+    def _choose(self) -> typing.Optional[Path]:
+        "The workspace to run next: the highest priority, then the least virtual time of the venv and the workspace."
+        best = None
+        best_key = None
+        for workspace_dir, queue in self.queues.items():
+            neg_priority, seq, item = queue[0]
+            if not self.can_run(item.job_dir):
+                continue
+            key = (
+                neg_priority,
+                self.vtimes.get(workspace_dir.parents[1], 0.0),
+                self.vtimes.get(workspace_dir, 0.0),
+                seq,
+            )
+            if best_key is None or key < best_key:
+                best, best_key = workspace_dir, key
+        return best
+
+    def pop_ready(
+        self, now: typing.Optional[float] = None
+    ) -> typing.List[typing.Tuple[Path, float]]:
+        """Take slots for the queued runs, return [(job_dir, wait_seconds)].
+
+        A run blocked by its venv/workspace limit does not block the runs of other groups."""
+        now = time.time() if now is None else now
+        ready: typing.List[typing.Tuple[Path, float]] = []
+        with self.lock:
+            root_limit = self.get_limit(self.root_dir)
+            while self.queues:
+                if root_limit > 0 and self.running.get(self.root_dir, 0) >= root_limit:
+                    break
+                workspace_dir = self._choose()
+                if workspace_dir is None:
+                    break
+                queue = self.queues[workspace_dir]
+                item: Pending = heapq.heappop(queue)[2]
+                if not queue:
+                    self.queues.pop(workspace_dir)
+                self.length -= 1
+                self.queued.discard(item.job_dir)
+                self._acquire(item.job_dir)
+                venv_dir = workspace_dir.parents[1]
+                for group in (venv_dir, workspace_dir):
+                    self.vtimes[group] = self.vtimes.get(group, 0.0) + 1 / self.get_weight(group)
+                wait = now - item.queued_at
+                self.waits.append(wait)
+                self.admitted += 1
+                ready.append((item.job_dir, wait))
+        return ready
+
+    def pending(self) -> typing.List[Pending]:
+        "Queued runs, sorted by priority and queued time."
+        with self.lock:
+            items = [i[2] for queue in self.queues.values() for i in queue]
+        return sorted(items, key=lambda i: (-i.priority, i.queued_at))
+
+    def stats(self, now: typing.Optional[float] = None) -> dict:
+        now = time.time() if now is None else now
+        with self.lock:
+            waits = list(self.waits)
+            oldest = min(
+                (i[2].queued_at for queue in self.queues.values() for i in queue),
+                default=None,
+            )
+            return {
+                "running": self.running.get(self.root_dir, 0),
+                "max_workers": self.get_limit(self.root_dir),
+                "queued": self.length,
+                "oldest_wait": round(now - oldest, 3) if oldest is not None else 0,
+                "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0,
+                "max_wait": round(max(waits), 3) if waits else 0,
+                "admitted": self.admitted,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,770 @@
+import asyncio
+import codecs
+import json
+import mimetypes
+import re
+import time
+import typing
+from email.parser import BytesParser
+from email.policy import HTTP
+from functools import partial
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import parse_qsl, quote
+
+from ..bottle_app.app import (
+    FAVICON,
+    LOGIN_HTML,
+    AuthError,
+    AuthPlugin,
+    Config,
+    get_follow_html,
+    get_grep_args,
+    get_list_html,
+    get_list_json,
+    get_usage_by_job,
+    index,
+    iter_grep_html,
+    kill_run,
+    render_console,
+    render_usage,
+    sse_event,
+)
+from ..config import Config as MConfig
+from ..core import JobDir, PythonDir, Taska, VenvDir, WorkspaceDir
+from .. import metrics
+from ..fileserve import FileReply, iter_file_range, prepare_file
+from ..logstream import LogHub
+from ..utils import grep_lines, tail_lines
+
+logger = MConfig.init_logger()
+Body = typing.Union[bytes, str, typing.AsyncIterator[typing.Union[bytes, str]]]
+Handler = typing.Callable[..., typing.Awaitable["Response"]]
+
+
+async def run_sync(function: typing.Callable, *args, **kwargs):
+    "Run the blocking call in the default executor, the event loop keeps serving meanwhile."
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(function, *args, **kwargs))
+
+
+async def iterate_sync(iterator: typing.Iterator) -> typing.AsyncIterator:
+    "Pull the items of a blocking iterator (file reading, grep) in the executor one by one."
+    end = object()
+    while True:
+        item = await run_sync(next, iterator, end)
+        if item is end:
+            return
+        yield item
+
+
+def parse_multipart(content_type: str, body: bytes):
+    "(fields, files) of a multipart/form-data body, files are {name: (filename, content)}."
+    head = f"Content-Type: {content_type}\r\n\r\n".encode("latin-1")
+    message = BytesParser(policy=HTTP).parsebytes(head + body)
+    fields: typing.Dict[str, str] = {}
+    files: typing.Dict[str, typing.Tuple[str, bytes]] = {}
+    if not message.is_multipart():
+        return fields, files
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if not name:
+            continue
+        payload = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        if filename is None:
+            fields[name] = payload.decode("utf-8", errors="replace")
+        else:
+            files[name] = (filename, payload)
+    return fields, files
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: str = ""):
+        super().__init__(status, body)
+        self.status = status
+        self.body = body
+
+
+class HTTPRedirect(Exception):
+    def __init__(self, url: str):
+        super().__init__(url)
+        self.url = url
+
+
+class Request:
+    def __init__(self, scope: dict, receive: typing.Callable):
+        self.scope = scope
+        self.receive = receive
+        self.method: str = scope["method"]
+        self.path: str = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.query = dict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {
+            k.decode("latin-1").lower(): v.decode("latin-1")
+            for k, v in scope["headers"]
+        }
+        cookie: SimpleCookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.get("cookie", ""))
+        except Exception:
+            pass
+        self.cookies = {k: v.value for k, v in cookie.items()}
+        self._body: typing.Optional[bytes] = None
+
+    @property
+    def url(self) -> str:
+        host = self.headers.get("host") or "%s:%s" % tuple(self.scope["server"])
+        url = f"{self.scope.get('scheme', 'http')}://{host}{quote(self.path)}"
+        if self.query_string:
+            url += f"?{self.query_string}"
+        return url
+
+    @property
+    def client_ip(self) -> str:
+        client = self.scope.get("client")
+        return self.headers.get("x-forwarded-for") or (client[0] if client else "")
+
+    async def body(self) -> bytes:
+        if self._body is None:
+            chunks = []
+            more_body = True
+            while more_body:
+                message = await self.receive()
+                chunks.append(message.get("body", b""))
+                more_body = message.get("more_body", False)
+            self._body = b"".join(chunks)
+        return self._body
+
+    async def form(self):
+        "(fields, files) of the urlencoded or multipart body."
+        body = await self.body()
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            return await run_sync(parse_multipart, content_type, body)
+        return dict(parse_qsl(body.decode("utf-8", errors="replace"))), {}
+
+
+class Response:
+    """The body is bytes / str, or an async iterator streamed to the client, which is closed when the client is
+    disconnected."""
+
+    def __init__(
+        self,
+        body: Body = b"",
+        status=200,
+        content_type="text/html; charset=utf-8",
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ):
+        self.body = body
+        self.status = status
+        self.headers: typing.List[typing.Tuple[str, str]] = []
+        if content_type:
+            self.headers.append(("content-type", content_type))
+        for k, v in (headers or {}).items():
+            self.headers.append((k.lower(), str(v)))
+
+    def set_header(self, name: str, value: str):
+        name = name.lower()
+        self.headers = [i for i in self.headers if i[0] != name]
+        self.headers.append((name, value))
+
+    def set_cookie(self, name: str, value: str, path="/", max_age=None):
+        cookie: SimpleCookie = SimpleCookie()
+        cookie[name] = value
+        cookie[name]["path"] = path
+        if max_age is not None:
+            cookie[name]["max-age"] = int(max_age)
+        self.headers.append(("set-cookie", cookie[name].OutputString()))
+
+    async def start(self, send, content_length: typing.Optional[int] = None):
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in self.headers]
+        if content_length is not None and self.status != 304:
+            headers.append((b"content-length", str(content_length).encode()))
+        await send(
+            {"type": "http.response.start", "status": self.status, "headers": headers}
+        )
+
+    async def __call__(self, send, receive, head=False):
+        body = self.body
+        if isinstance(body, (bytes, str)):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            await self.start(send, len(body))
+            await send({"type": "http.response.body", "body": b"" if head else body})
+            return
+        await self.start(send)
+        if head or await self.stream(body, send, receive):
+            await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def stream(body: typing.AsyncIterator, send, receive) -> bool:
+        "Send the chunks until the end of the body (True) or the client is disconnected (False)."
+        async def wait_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+
+        disconnected = asyncio.ensure_future(wait_disconnect())
+        iterator = body.__aiter__()
+        try:
+            while True:
+                chunk_task = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait(
+                    {chunk_task, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not chunk_task.done():
+                    # the waiting generator gets the CancelledError and runs its finally
+                    chunk_task.cancel()
+                    await asyncio.wait({chunk_task})
+                    return False
+                try:
+                    chunk = chunk_task.result()
+                except StopAsyncIteration:
+                    return True
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+        finally:
+            disconnected.cancel()
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+
+class FileResponse(Response):
+    """The reply of prepare_file, sent by the zero-copy extension (os.sendfile) if the server supports it, or read
+    (and gzipped) by chunks in the executor."""
+
+    def __init__(self, path: Path, reply: FileReply, zero_copy=False):
+        super().__init__(b"", reply.status, content_type="", headers=reply.headers)
+        self.path = path
+        self.reply = reply
+        self.zero_copy = zero_copy
+
+    async def __call__(self, send, receive, head=False):
+        await self.start(send)
+        reply = self.reply
+        if head:
+            await send({"type": "http.response.body", "body": b""})
+        elif self.zero_copy and not reply.gzip:
+            f = await run_sync(open, self.path, "rb")
+            try:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": f,
+                        "offset": reply.start,
+                        "count": reply.length,
+                    }
+                )
+            finally:
+                f.close()
+        else:
+            chunks = iter_file_range(
+                self.path, reply.start, reply.length, gzip=reply.gzip
+            )
+            if await self.stream(iterate_sync(chunks), send, receive):
+                await send({"type": "http.response.body", "body": b""})
+
+
+def redirect(url: str, status=303) -> Response:
+    return Response(b"", status=status, content_type="", headers={"Location": url})
+
+
+def error(status: int, body: str) -> Response:
+    return Response(body, status=status)
+
+
+class App:
+    "A minimal ASGI app: bottle-like rules (/view/<path:path>), async handlers, the auth of the bottle app."
+
+    def __init__(self):
+        # [(methods, regex, rule, handler)]
+        self.routes: typing.List[typing.Tuple[set, typing.Pattern, str, Handler]] = []
+        self.auth = AuthPlugin()
+
+    def route(self, rule: str, methods=("GET",)):
+        pattern = re.sub(
+            r"<(path:)?(\w+)>",
+            lambda m: f"(?P<{m[2]}>{'.+' if m[1] else '[^/]+'})",
+            rule,
+        )
+
+        def decorator(handler: Handler):
+            self.routes.append((set(methods), re.compile(f"^{pattern}$"), rule, handler))
+            return handler
+
+        return decorator
+
+    def get(self, rule: str):
+        return self.route(rule, ("GET",))
+
+    def post(self, rule: str):
+        return self.route(rule, ("POST",))
+
+    def match(self, method: str, path: str):
+        allowed = False
+        for methods, regex, rule, handler in self.routes:
+            m = regex.match(path)
+            if m:
+                if method in methods:
+                    return rule, handler, m.groupdict()
+                allowed = True
+        raise HTTPError(405 if allowed else 404, "Method Not Allowed" if allowed else "Not Found")
+
+    def resolve(self, method: str, path: str, cookie_ok: bool):
+        "Match the route after the auth: the unauthenticated clients get /login for the unknown paths too."
+        try:
+            return self.match(method, path)
+        except HTTPError:
+            if not cookie_ok:
+                raise HTTPRedirect("/login")
+            raise
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.handle_lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        request = Request(scope, receive)
+        method = "GET" if request.method == "HEAD" else request.method
+        rule = ""
+        start = time.perf_counter()
+        try:
+            cookie_ok, now = self.auth.authenticate(
+                request.client_ip, request.cookies.get("sign")
+            )
+            request.scope["cookie_ok"] = cookie_ok
+            rule, handler, kwargs = self.resolve(method, request.path, cookie_ok)
+            response = await self.check_auth(request, rule, cookie_ok, now)
+            if response is None:
+                response = await handler(request, **kwargs)
+                if request.scope.get("cookie_ok"):
+                    response.set_header("s", self.auth.get_params_s(rule))
+        except HTTPRedirect as e:
+            response = redirect(e.url)
+        except AuthError as e:
+            response = error(e.status_code, e.body)
+        except HTTPError as e:
+            response = error(e.status, e.body)
+        except Exception as e:
+            logger.exception(f"[ASGI] {request.method} {request.path} failed")
+            response = error(500, f"Internal Server Error: {e!r}")
+        finally:
+            if rule:
+                metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method, rule)
+        await response(send, receive, head=request.method == "HEAD")
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def check_auth(
+        self, request: Request, rule: str, cookie_ok: bool, now: int
+    ) -> typing.Optional[Response]:
+        "The AuthPlugin checks of the bottle app, return the response instead of the handler's if not passed."
+        if rule == "/login":
+            if request.method == "POST":
+                fields, _ = await request.form()
+                sign = self.auth.login(fields.get("pwd"), request.client_ip, cookie_ok, now)
+                response = redirect(request.cookies.get("from_url") or "/")
+                response.set_cookie(
+                    "sign", sign, path="/", max_age=self.auth.cookie_max_age * 0.95
+                )
+                return response
+            return None
+        if self.auth.is_allowed(
+            rule,
+            cookie_ok,
+            request.query.get("s"),
+            request.headers.get("authorization", ""),
+        ):
+            return None
+        response = redirect("/login")
+        if rule != "/favicon.ico":
+            response.set_cookie("from_url", request.url, path="/", max_age=3600)
+        return response
+
+
+app = App()
+
+
+def get_real_path(path: str) -> typing.Optional[Path]:
+    "The resolved path under the root dir, None if not found or out of the root."
+    root = Config.root_path
+    real_path = root.joinpath(path).resolve()
+    if real_path.exists() and real_path.is_relative_to(root):
+        return real_path
+    return None
+
+
+@app.get("/")
+async def home(request: Request):
+    return Response(index())
+
+
+@app.get("/favicon.ico")
+async def favicon(request: Request):
+    return Response(
+        FAVICON,
+        content_type="image/svg+xml",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
+@app.get("/login")
+async def login(request: Request):
+    if Config.pwd and not request.scope.get("cookie_ok"):
+        placeholder = "Input the password"
+    else:
+        placeholder = "Reset the password"
+    return Response(LOGIN_HTML.format(placeholder=placeholder))
+
+
+@app.post("/login")
+async def post_login(request: Request):
+    # handled by App.check_auth
+    return redirect("/")
+
+
+def init_dir(dir_type: str, target_dir: Path, name, python=""):
+    c = {i.__name__: i for i in [JobDir, PythonDir, VenvDir, WorkspaceDir]}[dir_type]
+    if c is PythonDir:
+        c.prepare_dir(target_dir, name, python=python)
+    else:
+        c.prepare_dir(target_dir, name)
+
+
+@app.get("/init/<dir_type>")
+async def init(request: Request, dir_type: str):
+    referer = request.query["referer"]
+    target_dir = await run_sync(get_real_path, referer)
+    if target_dir is None:
+        return Response("path not found")
+    if dir_type == "requirements":
+        if not VenvDir.is_valid(target_dir):
+            return error(400, "not a venv dir")
+        task, _ = Taska.install_venv(target_dir)
+        # follow the installer output
+        log_path = task.log_path.relative_to(Config.root_path).as_posix()
+        return redirect(f"/view/{log_path}?tail=0&lines=1000")
+    # venv creation runs a subprocess
+    await run_sync(
+        init_dir,
+        dir_type,
+        target_dir,
+        request.query.get("name"),
+        python=request.query.get("python", ""),
+    )
+    return redirect(f"/view/{referer or '/'}")
+
+
+@app.get("/rename")
+async def rename(request: Request):
+    old_path = request.query["old_path"].lstrip("/")
+    path = await run_sync(get_real_path, old_path)
+    if path is not None:
+        await run_sync(path.rename, path.with_name(request.query["name"]))
+    return redirect(f"/view/{'/'.join(old_path.split('/')[:-1]) or '/'}")
+
+
+@app.get("/launch/<path:path>")
+async def launch(request: Request, path: str):
+    _path = await run_sync(get_real_path, path)
+    if _path is None:
+        return Response("path not found")
+    timeout = int(request.query.get("timeout", 0))
+    # waits the run for `timeout or 1` seconds
+    job_dir = await run_sync(Taska.launch_job, _path, timeout)
+    parts = job_dir.relative_to(Config.root_path.parent).parts
+    return redirect(f"/view/{'/'.join(parts[1:])}")
+
+
+@app.get("/view")
+@app.get("/view/")
+async def redirect_view_root(request: Request):
+    return redirect("/view//")
+
+
+def delete_path(real_path: Path):
+    if real_path.is_dir():
+        Taska.safe_rm_dir(real_path)
+    else:
+        real_path.unlink()
+
+
+@app.get("/view/<path:path>")
+async def list_dir(request: Request, path: str):
+    if path == "/":
+        path = ""
+    real_path = await run_sync(get_real_path, path)
+    action = request.query.get("action")
+    if real_path is None:
+        return Response("path not found")
+    elif action == "delete":
+        if not real_path.parent.is_relative_to(Config.root_path):
+            return Response("path not found")
+        await run_sync(delete_path, real_path)
+        back = "/".join(request.path.split("/")[:-1])
+        return redirect("/view//" if back == "/view" else back)
+    elif action == "download":
+        if real_path.is_dir():
+            return error(400, "not support download dir")
+        return await file_response(
+            request, real_path, "application/octet-stream", filename=real_path.name
+        )
+    elif action == "view":
+        if not real_path.is_file():
+            return Response("not a file")
+        if request.query.get("grep"):
+            return handle_grep(request, real_path)
+        content_type = mimetypes.guess_type(real_path.as_posix())[0]
+        return await file_response(
+            request, real_path, content_type or "text/html; charset=utf-8"
+        )
+    elif "tail" in request.query:
+        return await handle_tail(request, real_path)
+    elif request.query.get("format") == "json":
+        if not real_path.is_dir():
+            return error(400, "not a dir")
+        data = await run_sync(get_list_json, real_path, request.query)
+        return Response(
+            json.dumps(data, ensure_ascii=False),
+            content_type="application/json; charset=utf-8",
+        )
+    else:
+        html = await run_sync(get_list_html, real_path, request.url, request.query)
+        return Response(html)
+
+
+async def file_response(
+    request: Request, path: Path, content_type: str, filename=""
+) -> Response:
+    "Range / If-Range, ETag / 304 and gzip for the text types, see fileserve.prepare_file."
+    stat = await run_sync(path.stat)
+    reply = prepare_file(stat, request.headers, content_type, filename=filename)
+    if reply.status not in {200, 206}:
+        return Response(b"", reply.status, content_type="", headers=reply.headers)
+    extensions = request.scope.get("extensions") or {}
+    return FileResponse(
+        path, reply, zero_copy="http.response.zerocopysend" in extensions
+    )
+
+
+@app.get("/grep/<path:path>")
+async def grep_log(request: Request, path: str):
+    real_path = await run_sync(get_real_path, path)
+    if real_path is None or not real_path.is_file():
+        return error(404, "path not found")
+    return handle_grep(request, real_path)
+
+
+def handle_grep(request: Request, path: Path) -> Response:
+    try:
+        regex, kwargs = get_grep_args(request.query)
+    except ValueError as e:
+        return error(400, str(e))
+    items = iter_grep_html(
+        grep_lines(path, regex, **kwargs), request.query.get("encoding") or "utf-8"
+    )
+    return Response(iterate_sync(items))
+
+
+async def handle_tail(request: Request, path: Path) -> Response:
+    if not path.is_file():
+        return error(400, "not a file")
+    tail = int(request.query["tail"])
+    encoding = request.query.get("encoding", "utf-8")
+    if not tail:
+        return Response(get_follow_html(path, encoding, request.query.get("lines", 0)))
+    lines = await run_sync(tail_lines, path, tail)
+    text = b"".join(lines).decode(encoding, errors="replace")
+    return Response(f"<pre style='font-size: 1.5em;'>{text}</pre>")
+
+
+@app.get("/stream/<path:path>")
+async def stream_log(request: Request, path: str):
+    """Follow the appended data of a log file as Server-Sent Events, shared by LogHub.
+
+    lines: send the last N lines first, skipped on reconnection (Last-Event-ID)."""
+    real_path = await run_sync(get_real_path, path)
+    if real_path is None or not real_path.is_file():
+        return error(404, "path not found")
+    encoding = request.query.get("encoding") or "utf-8"
+    if request.headers.get("last-event-id"):
+        lines = 0
+    else:
+        lines = int(request.query.get("lines") or 0)
+    return Response(
+        iter_log_events(real_path, lines, encoding),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def iter_log_events(path: Path, lines: int, encoding: str):
+    # no thread for each viewer: the LogHub thread hands the data over to the event loop
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue(maxsize=1000)
+    overflow = asyncio.Event()
+
+    def put(item):
+        try:
+            events.put_nowait(item)
+        except asyncio.QueueFull:
+            overflow.set()
+
+    def callback(kind: str, data: bytes):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(put, (kind, data))
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    hub = LogHub.get_instance()
+    # reads the tail lines
+    token = await run_sync(hub.subscribe, path, callback, tail=lines)
+    try:
+        yield "retry: 3000\n" + sse_event("open", "", event_id="1")
+        while not overflow.is_set():
+            try:
+                kind, data = await asyncio.wait_for(events.get(), 15)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if kind == "data":
+                text = decoder.decode(data)
+                if text:
+                    yield sse_event("message", text)
+            else:
+                decoder.reset()
+                yield sse_event(kind, "")
+        # too slow to consume, the client reconnects
+        yield sse_event("overflow", "")
+    finally:
+        hub.unsubscribe(token)
+
+
+def save_upload(target_dir: Path, file_name: str, content: typing.Union[bytes, str]):
+    target_file = target_dir.joinpath(file_name).resolve()
+    if not target_file.is_relative_to(Config.root_path):
+        raise HTTPError(400, "bad path")
+    if isinstance(content, bytes):
+        target_file.write_bytes(content)
+    elif file_name.endswith("/"):
+        target_file.mkdir(parents=True, exist_ok=True)
+    else:
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+        target_file.write_text(content, encoding="utf-8", newline="")
+
+
+@app.post("/upload")
+async def upload(request: Request):
+    fields, files = await request.form()
+    file_name = fields.get("file_name")
+    path = fields.get("path", "")
+    target_dir = Config.root_path.joinpath(path)
+    if target_dir.is_file() and target_dir.name == file_name:
+        target_dir = target_dir.parent
+    if not target_dir.is_dir() or not target_dir.is_relative_to(Config.root_path):
+        return error(400, "bad path")
+    raw_filename, content = files.get("upload_file") or ("", b"")
+    if raw_filename:
+        await run_sync(save_upload, target_dir, file_name or raw_filename, content)
+    else:
+        if not file_name:
+            return error(400, "file_name must be set if text is not null")
+        await run_sync(save_upload, target_dir, file_name, fields.get("text", ""))
+    return redirect(f"/view/{path}")
+
+
+@app.get("/console")
+async def console(request: Request):
+    kill = request.query.get("kill")
+    if kill:
+        # waits for the exit
+        await run_sync(kill_run, int(kill), int(request.query.get("signal") or 2))
+        return redirect(request.headers.get("referer") or "/console")
+    snapshot = Taska.get_sampler().get()
+    if snapshot is None:
+        return error(503, "process sampler is not ready")
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status=304, content_type="", headers={"ETag": snapshot.etag})
+    return Response(render_console(snapshot), headers={"ETag": snapshot.etag})
+
+
+@app.get("/console/usage")
+async def console_usage(request: Request):
+    "Per-job aggregates of the recorded run usage in the last `hours`."
+    hours = float(request.query.get("hours") or 24)
+    rows = await run_sync(get_usage_by_job, hours)
+    if request.query.get("format") == "json":
+        return Response(
+            json.dumps(rows, ensure_ascii=False),
+            content_type="application/json; charset=utf-8",
+        )
+    return Response(render_usage(rows, hours))
+
+
+@app.get("/api/install")
+@app.get("/api/install/<path:path>")
+async def api_install(request: Request, path=""):
+    "Status of the background installs, all the venvs or one."
+    if path:
+        task = Taska.get_installer().get(Config.root_path.joinpath(path).resolve())
+        if task is None:
+            return error(404, "no install task")
+        data: typing.Any = task.to_dict()
+    else:
+        data = [task.to_dict() for task in Taska.get_installer().all()]
+    return Response(
+        json.dumps(data, ensure_ascii=False),
+        content_type="application/json; charset=utf-8",
+    )
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    return Response(
+        metrics.REGISTRY.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.get("/api/processes")
+async def api_processes(request: Request):
+    "The latest snapshot of the sampler as JSON, supports If-None-Match."
+    snapshot = Taska.get_sampler().get()
+    if snapshot is None:
+        return error(503, "process sampler is not ready")
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status=304, content_type="", headers=headers)
+    return Response(
+        snapshot.body, content_type="application/json; charset=utf-8", headers=headers
+    )
+
+
+def main(root_path, host="127.0.0.1", port=8021, debug=False):
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("the asgi app runs on uvicorn: pip install taska[asgi]")
+    Config.root_path = Path(root_path).resolve()
+    logger.warning(
+        f"start server: root_path: {Config.root_path}, debug={debug}, http://{host}:{port}"
+    )
+    uvicorn.run(
+        app,
+        host=host,
+        port=port,
+        log_level="debug" if debug else "warning",
+        lifespan="on",
+    )
@@ -1,13 +1,21 @@
+import codecs
+import hmac
+import html
+import json
 import mimetypes
+import queue
+import re
 import signal
+import sqlite3
 import sys
+import threading
 import time
 import typing
 from collections import defaultdict
 from hashlib import md5
 from pathlib import Path
 from string import Template
-from urllib.parse import quote_plus
+from urllib.parse import quote, quote_plus, urlencode
 
 from bottle import (
     Bottle,
@@ -16,7 +24,6 @@ from bottle import (
     redirect,
     request,
     response,
-    static_file,
 )
 from morebuiltins.functools import lru_cache_ttl
 from morebuiltins.utils import get_hash, is_running, read_size, read_time, ttime
@@ -24,11 +31,14 @@ from psutil import Process
 
 from ..config import Config as MConfig
 from ..core import JobDir, PythonDir, Taska, VenvDir, WorkspaceDir
+from .. import metrics
+from ..fileserve import CHUNK_SIZE, iter_file_range, prepare_file
+from ..logstream import LogHub
+from ..sampler import Snapshot
+from ..utils import grep_lines, scan_dir, tail_lines
 from .console_template import console_template
 
 app = Bottle()
-keepalive_timeout = 60
-keepalives = {}
 # import sys
 
 # sys.path.append("../../")
@@ -42,10 +52,36 @@ class Config:
     root_path = Path.cwd()
     # file size limit
     max_file_size = 1024 * 100
+    # items of a dir listing page
+    page_size = 500
+    max_page_size = 5000
     console_template = Template(console_template)
+    # (etag, html) of the latest snapshot
+    console_cache: tuple = ()
+
+
+FAVICON = '<svg xmlns="http://www.w3.org/2000/svg"  viewBox="0 0 128 128" width="64px" height="64px"><path fill="#F7F7FB" d="M64 9A55 55 0 1 0 64 119A55 55 0 1 0 64 9Z"/><path fill="#DEDFE6" d="M64,9C33.6,9,9,33.6,9,64s24.6,55,55,55s55-24.6,55-55S94.4,9,64,9z M64,105.2c-22.8,0-41.2-18.5-41.2-41.2S41.2,22.8,64,22.8s41.2,18.5,41.2,41.2S86.8,105.2,64,105.2z"/><path fill="#D8D7D5" d="M64 59.4A4.6 4.6 0 1 0 64 68.6A4.6 4.6 0 1 0 64 59.4Z"/><path fill="#464C55" d="M64,122C32,122,6,96,6,64S32,6,64,6s58,26,58,58S96,122,64,122z M64,12c-28.7,0-52,23.3-52,52s23.3,52,52,52s52-23.3,52-52S92.7,12,64,12z"/><path fill="#464C55" d="M64.1,67.1c-0.8,0-1.5-0.3-2.1-0.9s-0.9-1.3-0.9-2.1L61,36.5c0-1.7,1.3-3,3-3l0,0c1.7,0,3,1.3,3,3l0.1,24.6L82.3,61l0,0c1.6,0,3,1.3,3,3c0,1.7-1.3,3-3,3L64.1,67.1L64.1,67.1z"/><path fill="#464C55" d="M64,71.6c-4.2,0-7.6-3.4-7.6-7.6s3.4-7.6,7.6-7.6s7.6,3.4,7.6,7.6S68.2,71.6,64,71.6z M64,62.4c-0.9,0-1.6,0.7-1.6,1.6c0,0.9,0.7,1.6,1.6,1.6c0.9,0,1.6-0.7,1.6-1.6S64.9,62.4,64,62.4z"/></svg>'
+LOGIN_HTML = r"""
+    <form style="width: 100%;height: 100%;" action="/login" method="post">
+    <input autofocus style="text-align: center;font-size: 5em;width: 100%;height: 100%;" type="password" name="pwd" placeholder="{placeholder}">
+    </form>"""
+
+
+class AuthError(HTTPError):
+    "Raised by the shared checks of AuthPlugin, the asgi app turns it into its own response."
 
 
 class AuthPlugin(object):
+    """Cookie `sign` (or the `?s=` param signed by the route rule) auth, shared by the bottle and the asgi apps:
+    `authenticate` / `login` / `is_allowed` know nothing about the framework.
+
+    The unauthenticated requests to the unknown paths are redirected to /login like the known ones, so the routes can
+    not be probed without the password."""
+
+    # context of apply is the Route (bottle >= 0.12)
+    api = 2
+    # the rules accept `Authorization: Bearer <METRICS_TOKEN>`, for the scrapers which can not sign in
+    bearer_rules = {"/metrics"}
     # avoid tries too many times
     blacklist: typing.Dict[str, int] = defaultdict(lambda: 0)
     cookie_max_age = 7 * 86400
@@ -66,7 +102,7 @@ class AuthPlugin(object):
             if b > now:
                 self.blacklist[client_ip] = b + 5
                 timeleft = self.blacklist[client_ip] - now
-                raise HTTPError(429, f"Too many tries, retry at {timeleft}s later.")
+                raise AuthError(429, f"Too many tries, retry at {timeleft}s later.")
             else:
                 self.blacklist.pop(client_ip, None)
 
@@ -84,65 +120,111 @@ class AuthPlugin(object):
         else:
             return False
 
-    def is_valid(self, rule):
-        client_ip = request.environ.get("HTTP_X_FORWARDED_FOR") or request.environ.get(
-            "REMOTE_ADDR"
-        )
+    def authenticate(self, client_ip: str, sign: str) -> typing.Tuple[bool, int]:
+        "(cookie_ok, now) of the request, raise AuthError if no client ip or blacklisted."
         if not client_ip:
-            raise HTTPError(401, "No client ip")
+            raise AuthError(401, "No client ip")
         now = int(time.time())
-        if self.check_blacklist(client_ip, now):
+        self.check_blacklist(client_ip, now)
+        return self.check_cookie(sign, client_ip, now), now
+
+    def login(self, pwd: str, client_ip: str, cookie_ok: bool, now: int) -> str:
+        "Check (or set / modify) the password, return the new `sign` cookie, raise AuthError if wrong."
+        if not pwd:
+            raise AuthError(401, "No password?")
+        if cookie_ok or not Config.pwd:
+            # modify pwd
+            Config.pwd = pwd
+            self.check_cookie.cache.clear()
+        if pwd != Config.pwd:
+            # wrong password
+            self.blacklist[client_ip] = now + 5
+            raise AuthError(401, "Invalid password")
+        return self.get_sign(now, client_ip)
+
+    def is_allowed(
+        self, rule: str, cookie_ok: bool, s: typing.Optional[str], authorization=""
+    ) -> bool:
+        "Signed in, or the `s` param of the rule, or the bearer token of the bearer_rules (401 if wrong)."
+        if cookie_ok or s == self.get_params_s(rule):
             return True
-        sign = request.cookies.get("sign")
-        cookie_ok = self.check_cookie(sign, client_ip, now)
+        if rule in self.bearer_rules and authorization:
+            scheme, _, token = authorization.partition(" ")
+            if (
+                scheme.lower() == "bearer"
+                and MConfig.METRICS_TOKEN
+                and hmac.compare_digest(token.strip(), MConfig.METRICS_TOKEN)
+            ):
+                return True
+            raise AuthError(401, "Invalid token")
+        return False
+
+    def get_client_ip(self):
+        return request.environ.get("HTTP_X_FORWARDED_FOR") or request.environ.get(
+            "REMOTE_ADDR"
+        )
+
+    def is_valid(self, rule):
+        cookie_ok, now = self.authenticate(
+            self.get_client_ip(), request.cookies.get("sign")
+        )
         if rule == "/login":
             if request.method == "GET":
                 request.environ["cookie_ok"] = cookie_ok
                 return True
             else:
                 # POST
-                self.handle_post_pwd(rule, client_ip, cookie_ok, now)
-        s = self.get_params_s(rule)
+                self.handle_post_pwd(rule, cookie_ok, now)
         if cookie_ok:
-            response.set_header("s", s)
+            response.set_header("s", self.get_params_s(rule))
             return True
         else:
             # params s auth
-            params = request.params
-            s_valid = "s" in params and params["s"] == s
-            return s_valid
+            return self.is_allowed(
+                rule,
+                cookie_ok,
+                request.params.get("s"),
+                request.get_header("Authorization", ""),
+            )
 
-    def handle_post_pwd(self, rule, client_ip, cookie_ok, now):
-        pwd = request.forms.get("pwd")
-        if not pwd:
-            raise HTTPError(401, "No password?")
-        if cookie_ok or not Config.pwd:
-            # modify pwd
-            Config.pwd = pwd
-            self.check_cookie.cache.clear()
-        if pwd == Config.pwd:
-            # correct password
-            from_url = request.cookies.get("from_url")
-            res = response.copy(cls=HTTPResponse)
-            res.status = 303
-            res.set_cookie(
-                "sign",
-                self.get_sign(now, client_ip),
-                path="/",
-                max_age=self.cookie_max_age * 0.95,
+    def handle_post_pwd(self, rule, cookie_ok, now):
+        sign = self.login(
+            request.forms.get("pwd"), self.get_client_ip(), cookie_ok, now
+        )
+        # correct password
+        from_url = request.cookies.get("from_url")
+        res = response.copy(cls=HTTPResponse)
+        res.status = 303
+        res.set_cookie(
+            "sign",
+            sign,
+            path="/",
+            max_age=self.cookie_max_age * 0.95,
+        )
+        if from_url and rule != "/login":
+            res.delete_cookie("from_url")
+        res.body = ""
+        res.set_header("Location", from_url or "/")
+        raise res
+
+    def handle_unknown(self, error: HTTPError):
+        "404 / 405 only for the signed in clients, the others are redirected to /login."
+        try:
+            cookie_ok, _ = self.authenticate(
+                self.get_client_ip(), request.cookies.get("sign")
             )
-            if from_url and rule != "/login":
-                res.delete_cookie("from_url")
-            res.body = ""
-            res.set_header("Location", from_url or "/")
-            raise res
-        else:
-            # wrong password
-            self.blacklist[client_ip] = now + 5
-            raise HTTPError(401, "Invalid password")
+        except AuthError as e:
+            return e
+        if not cookie_ok:
+            return HTTPResponse(status=303, Location="/login")
+        return app.default_error_handler(error)
+
+    def setup(self, app: Bottle):
+        for status in (404, 405):
+            app.error(status)(self.handle_unknown)
 
     def apply(self, callback, context):
-        rule = context["rule"]
+        rule = context.rule
 
         def wrapper(*args, **kwargs):
             valid = self.is_valid(rule)
@@ -157,6 +239,21 @@ class AuthPlugin(object):
         return wrapper
 
 
+class MetricsPlugin(object):
+    "Latency of the requests by route, installed before AuthPlugin to include the auth and the redirects."
+
+    api = 2
+
+    def apply(self, callback, context):
+        labels = (context.method, context.rule)
+
+        def wrapper(*args, **kwargs):
+            with metrics.HTTP_LATENCY.time(*labels):
+                return callback(*args, **kwargs)
+
+        return wrapper
+
+
 @app.get("/")
 def index():
     # 1. console
@@ -202,7 +299,7 @@ button:hover{
 
 @app.get("/favicon.ico")
 def favico():
-    response.body = '<svg xmlns="http://www.w3.org/2000/svg"  viewBox="0 0 128 128" width="64px" height="64px"><path fill="#F7F7FB" d="M64 9A55 55 0 1 0 64 119A55 55 0 1 0 64 9Z"/><path fill="#DEDFE6" d="M64,9C33.6,9,9,33.6,9,64s24.6,55,55,55s55-24.6,55-55S94.4,9,64,9z M64,105.2c-22.8,0-41.2-18.5-41.2-41.2S41.2,22.8,64,22.8s41.2,18.5,41.2,41.2S86.8,105.2,64,105.2z"/><path fill="#D8D7D5" d="M64 59.4A4.6 4.6 0 1 0 64 68.6A4.6 4.6 0 1 0 64 59.4Z"/><path fill="#464C55" d="M64,122C32,122,6,96,6,64S32,6,64,6s58,26,58,58S96,122,64,122z M64,12c-28.7,0-52,23.3-52,52s23.3,52,52,52s52-23.3,52-52S92.7,12,64,12z"/><path fill="#464C55" d="M64.1,67.1c-0.8,0-1.5-0.3-2.1-0.9s-0.9-1.3-0.9-2.1L61,36.5c0-1.7,1.3-3,3-3l0,0c1.7,0,3,1.3,3,3l0.1,24.6L82.3,61l0,0c1.6,0,3,1.3,3,3c0,1.7-1.3,3-3,3L64.1,67.1L64.1,67.1z"/><path fill="#464C55" d="M64,71.6c-4.2,0-7.6-3.4-7.6-7.6s3.4-7.6,7.6-7.6s7.6,3.4,7.6,7.6S68.2,71.6,64,71.6z M64,62.4c-0.9,0-1.6,0.7-1.6,1.6c0,0.9,0.7,1.6,1.6,1.6c0.9,0,1.6-0.7,1.6-1.6S64.9,62.4,64,62.4z"/></svg>'
+    response.body = FAVICON
     _md5 = get_hash(response.body)
     response.headers["Cache-Control"] = "public, max-age=%s" % 3600 * 24
     response.add_header("ETag", _md5)
@@ -218,10 +315,7 @@ def login():
             placeholder = "Input the password"
         else:
             placeholder = "Reset the password"
-        return r"""
-    <form style="width: 100%;height: 100%;" action="/login" method="post">
-    <input autofocus style="text-align: center;font-size: 5em;width: 100%;height: 100%;" type="password" name="pwd" placeholder="{placeholder}">
-    </form>""".format(placeholder=placeholder)
+        return LOGIN_HTML.format(placeholder=placeholder)
 
 
 @app.get("/init/<dir_type>")
@@ -233,7 +327,12 @@ def init(dir_type):
     if not (target_dir.exists() and target_dir.is_relative_to(root)):
         return "path not found"
     if dir_type == "requirements":
-        return VenvDir.ensure_pip_install(target_dir)
+        if not VenvDir.is_valid(target_dir):
+            return HTTPError(400, "not a venv dir")
+        task, _ = Taska.install_venv(target_dir)
+        # follow the installer output
+        log_path = task.log_path.relative_to(root).as_posix()
+        return redirect(f"/view/{log_path}?tail=0&lines=1000")
     c = {i.__name__: i for i in [JobDir, PythonDir, VenvDir, WorkspaceDir]}[dir_type]
     if c is PythonDir:
         python = request.query.get("python", "")
@@ -244,7 +343,73 @@ def init(dir_type):
     return redirect(f"/view/{referer}")
 
 
-def get_list_html(path: Path):
+def get_list_args(query: typing.Mapping[str, str]):
+    """(scan_dir kwargs, page, per_page) of the listing query.
+
+    page / per_page, sort=name|mtime|size, order=asc|desc, q=filter of the names (substring or glob)."""
+    try:
+        page = max(int(query.get("page") or 1), 1)
+        per_page = int(query.get("per_page") or Config.page_size)
+    except ValueError:
+        page, per_page = 1, Config.page_size
+    per_page = min(max(per_page, 1), Config.max_page_size)
+    sort = query.get("sort") or "name"
+    kwargs = {
+        "sort": sort if sort in {"name", "mtime", "size"} else "name",
+        "reverse": query.get("order") == "desc",
+        "pattern": query.get("q") or "",
+        "offset": (page - 1) * per_page,
+        "limit": per_page,
+    }
+    return kwargs, page, per_page
+
+
+def get_list_json(path: Path, query: typing.Mapping[str, str]) -> dict:
+    "The JSON variant of the dir listing, for scripts."
+    kwargs, page, per_page = get_list_args(query)
+    total, items = scan_dir(path, **kwargs)
+    return {
+        "path": "/".join(path.relative_to(Config.root_path).parts),
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": max((total + per_page - 1) // per_page, 1),
+        "items": [item._asdict() for item in items],
+    }
+
+
+def get_pager_html(
+    query: typing.Mapping[str, str], page: int, per_page: int, total: int
+) -> str:
+    "The filter / sort form and the page links of a dir listing."
+    keys = ("q", "sort", "order", "per_page")
+    params = {k: query[k] for k in keys if query.get(k)}
+    pages = max((total + per_page - 1) // per_page, 1)
+    q = html.escape(params.get("q", ""), quote=True)
+    selects = ""
+    for name, values in (("sort", ("name", "mtime", "size")), ("order", ("asc", "desc"))):
+        options = "".join(
+            f"<option{' selected' if params.get(name) == value else ''}>{value}</option>"
+            for value in values
+        )
+        selects += f" <select name='{name}'>{options}</select>"
+    form = f"<form method='get' style='display: inline;'><input name='q' value='{q}' placeholder='filter names, * ? for glob'>{selects}<input type='hidden' name='per_page' value='{per_page}'> <input type='submit' value='Filter'></form>"
+    links = []
+    if page > 1:
+        prev_url = urlencode(dict(params, page=page - 1))
+        links.append(f"<a href='?{prev_url}'>&lt;&lt; prev</a>")
+    links.append(f"page {page}/{pages}, {total} items")
+    if page < pages:
+        next_url = urlencode(dict(params, page=page + 1))
+        links.append(f"<a href='?{next_url}'>next &gt;&gt;</a>")
+    return f"{form} | {' | '.join(links)}<br>"
+
+
+def get_list_html(
+    path: Path, url: str, query: typing.Optional[typing.Mapping[str, str]] = None
+):
+    "The page of a dir or a file, url is the requested url of the page, query has the paging args of a dir."
+    url = url.split("?", 1)[0]
     html = "<a style='color: black' href='/'>Home</a> - "
     parts = path.relative_to(Config.root_path.parent).parts
     for index, part in enumerate(parts):
@@ -277,6 +442,9 @@ def get_list_html(path: Path):
         elif VenvDir.is_valid(path):
             "fresh requirements"
             html += f" | <a style='color:red' target='_blank' href='/init/requirements?referer={path_arg}'>PIP install</a>"
+            task = Taska.get_installer().get(path.resolve())
+            if task is not None:
+                html += f" (<a target='_blank' href='/view/{path_arg}/{task.LOG_NAME}?tail=0&lines=1000'>{task.state}</a>)"
         elif VenvDir.is_valid(path.parent) and path.name == "workspaces":
             "create workspace dir"
             html += f" | <form style='color:red' method='get' action='/init/{WorkspaceDir.__name__}'><input placeholder='dir name' name='name'><input style='display:none' name='referer' value='{path_arg}'><input type='submit' value='Create WorkspaceDir'></form>"
@@ -292,36 +460,36 @@ def get_list_html(path: Path):
     new_color = "#00c308"
     now = time.time()
     if path.is_dir():
-        path_list = sorted(
-            path.iterdir(), key=lambda i: f"-{i.name}" if i.is_dir() else i.name
-        )
-        for _path in path_list:
-            try:
-                p = _path.relative_to(Config.root_path).as_posix()
-                mtime = _path.stat().st_mtime
-                if _path.is_dir():
-                    color = "darkorange"
-                    icon = "&#128194;"
-                    size = " - "
-                    stat_color = old_color
+        # one scandir pass, the stat of the page items only
+        kwargs, page, per_page = get_list_args(query or {})
+        total, items = scan_dir(path, **kwargs)
+        pager = get_pager_html(query or {}, page, per_page, total)
+        html += pager
+        for item in items:
+            p = f"{path_arg}/{item.name}" if path_arg else item.name
+            mtime = item.mtime
+            if item.is_dir:
+                color = "darkorange"
+                icon = "&#128194;"
+                size = " - "
+                stat_color = old_color
+            else:
+                color = "black"
+                icon = "&#128196;"
+                size = read_size(item.size, 1, shorten=True)
+                if now - mtime < 5 * 60:
+                    stat_color = new_color
                 else:
-                    color = "black"
-                    icon = "&#128196;"
-                    size = read_size(_path.stat().st_size, 1, shorten=True)
-                    if now - mtime < 5 * 60:
-                        stat_color = new_color
-                    else:
-                        stat_color = old_color
-                time_stat = f"{ttime(mtime)}({read_time(now-mtime, shorten=True):->8})"
-                stat = f"<span style='color:{stat_color};width:260px;display: inline-block;font-size: 0.8em'> | {time_stat} | {size}</span>"
-                file_url = f"{request.url.rstrip('/')}/{quote_plus(_path.name)}"
-                dir_disabled = " disabled" if _path.is_dir() else ""
-                rename_html = f"<form action='/rename' method='get' style='display: inline;'><input style='display:none' name='old_path' value='{path_arg}/{_path.name}'><input type='text' name='name' value='{_path.name}'><input type='submit' value='Rename'></form> | "
-                html += f"{rename_html}<button onclick='delete_path(`{file_url}?action=delete`)'>Delete</button> | <a href='{file_url}?action=download'><button{dir_disabled}>Download</button></a> | <a href='{file_url}?action=view'><button{dir_disabled}>View</button></a> {stat} <a style='color:{color}' href='/view/{p}'>{icon} {_path.name}</a>"
-                # add rename form
-                html += "<br>"
-            except FileNotFoundError:
-                continue
+                    stat_color = old_color
+            time_stat = f"{ttime(mtime)}({read_time(now-mtime, shorten=True):->8})"
+            stat = f"<span style='color:{stat_color};width:260px;display: inline-block;font-size: 0.8em'> | {time_stat} | {size}</span>"
+            file_url = f"{url.rstrip('/')}/{quote_plus(item.name)}"
+            dir_disabled = " disabled" if item.is_dir else ""
+            rename_html = f"<form action='/rename' method='get' style='display: inline;'><input style='display:none' name='old_path' value='{path_arg}/{item.name}'><input type='text' name='name' value='{item.name}'><input type='submit' value='Rename'></form> | "
+            html += f"{rename_html}<button onclick='delete_path(`{file_url}?action=delete`)'>Delete</button> | <a href='{file_url}?action=download'><button{dir_disabled}>Download</button></a> | <a href='{file_url}?action=view'><button{dir_disabled}>View</button></a> {stat} <a style='color:{color}' href='/view/{p}'>{icon} {item.name}</a>"
+            html += "<br>"
+        if total > per_page:
+            html += pager
     else:
         file_name_arg = path.name
         p = path.relative_to(Config.root_path).as_posix()
@@ -333,7 +501,7 @@ def get_list_html(path: Path):
         _path = path
         time_stat = f"{ttime(mtime)}({read_time(now-mtime, shorten=True):->8})"
         stat = f"<span style='color:{stat_color};font-size: 0.8em;width:260px;display: inline-block;'> | {read_size(path.stat().st_size, 1)}|{time_stat}</span>"
-        html += f"<button onclick='delete_path(`{request.url}?action=delete`)'>Delete</button> | <a href='{request.url}?action=download'><button>Download</button></a> | <a href='{request.url}?action=view'><button>View</button></a> {stat} <br>"
+        html += f"<button onclick='delete_path(`{url}?action=delete`)'>Delete</button> | <a href='{url}?action=download'><button>Download</button></a> | <a href='{url}?action=view'><button>View</button></a> {stat} <br>"
         if path.stat().st_size < Config.max_file_size:
             text_arg = path.read_bytes().decode("utf-8", "replace")
     max_text_tip = f"preview text-only file_size < {read_size(Config.max_file_size)}"
@@ -426,92 +594,217 @@ def list_dir(path):
         elif real_path.is_dir():
             return HTTPError(400, "not support download dir")
         else:
-            content_type = "application/octet-stream"
-            file_content = static_file(
-                real_path.as_posix(), real_path.parent.as_posix(), content_type
+            return file_response(
+                real_path, "application/octet-stream", filename=real_path.name
             )
-            response.headers["Content-Disposition"] = (
-                f'attachment; filename="{real_path.name}"'
-            )
-            response.body = file_content
-            return response
     elif action == "view":
         grep = request.query.get("grep")
         if real_path.is_file():
             if grep:
-                encoding = request.query.get("encoding") or "utf-8"
-                with open(real_path, "r", encoding=encoding) as f:
-                    lines = []
-                    for line in f:
-                        if grep in line:
-                            lines.append(line)
-                    result = "".join(lines)
-                    return f"<pre>{result}</pre>"
+                return handle_grep(real_path)
             else:
                 ct = mimetypes.guess_type(real_path.as_posix())
-                if ct[0]:
-                    response.content_type = ct[0]
-                return real_path.read_bytes()
+                return file_response(real_path, ct[0] or response.content_type)
         else:
             return "not a file"
     elif "tail" in request.query:
-        return handle_tail(real_path, get_hash((time.time(), real_path.as_posix())))
+        return handle_tail(real_path)
+
+    else:
+        if request.query.get("format") == "json":
+            if not real_path.is_dir():
+                return HTTPError(400, "not a dir")
+            response.content_type = "application/json; charset=utf-8"
+            return json.dumps(get_list_json(real_path, request.query), ensure_ascii=False)
+        return get_list_html(real_path, request.url, request.query)
+
+
+def file_response(path: Path, content_type: str, filename=""):
+    """Stream the file with Range / If-Range, ETag / 304 and gzip for the text types, no whole file in memory.
 
+    The bodies to EOF are handed to the wsgi.file_wrapper of the server (waitress reads it by chunks)."""
+    stat = path.stat()
+    reply = prepare_file(stat, request.headers, content_type, filename=filename)
+    if reply.status not in {200, 206}:
+        return HTTPResponse(status=reply.status, headers=reply.headers)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper and not reply.gzip and reply.start + reply.length == stat.st_size:
+        # read to EOF
+        f = open(path, "rb")
+        f.seek(reply.start)
+        body = file_wrapper(f, CHUNK_SIZE)
     else:
-        return get_list_html(real_path)
+        body = iter_file_range(path, reply.start, reply.length, gzip=reply.gzip)
+    return HTTPResponse(body, status=reply.status, headers=reply.headers)
+
+
+@app.get("/grep/<path:path>")
+def grep_log(path):
+    root = Config.root_path
+    real_path: Path = root.joinpath(path).resolve()
+    if not (real_path.is_file() and real_path.is_relative_to(root)):
+        return HTTPError(404, "path not found")
+    return handle_grep(real_path)
 
 
-def handle_tail(path: Path, event_id):
+def handle_grep(path: Path):
+    """Stream the matched lines of the file and its rotated `.1` backup.
+
+    grep: the text, or the pattern with regex=1; ignore_case=1; context=N lines; max=N matched lines (default 1000);
+    order=desc for newest first; backup=0 to skip the backup."""
+    try:
+        regex, kwargs = get_grep_args(request.query)
+    except ValueError as e:
+        return HTTPError(400, str(e))
+    return iter_grep_html(
+        grep_lines(path, regex, **kwargs), request.query.get("encoding") or "utf-8"
+    )
+
+
+def get_grep_args(
+    query: typing.Mapping[str, str]
+) -> typing.Tuple["re.Pattern[bytes]", dict]:
+    "(regex, kwargs of grep_lines) from the query, raise ValueError for the bad args."
+    encoding = query.get("encoding") or "utf-8"
+    grep = query.get("grep") or ""
+    if not grep:
+        raise ValueError("grep is required")
+    pattern = grep.encode(encoding)
+    if query.get("regex") != "1":
+        pattern = re.escape(pattern)
+    flags = re.MULTILINE
+    if query.get("ignore_case") == "1":
+        flags |= re.IGNORECASE
+    try:
+        regex = re.compile(pattern, flags)
+        context = int(query.get("context") or 0)
+        max_matches = int(query.get("max") or 1000)
+    except (re.error, ValueError) as e:
+        raise ValueError(f"bad grep args: {e}")
+    return regex, {
+        "context": context,
+        "max_matches": max_matches,
+        "newest_first": query.get("order") == "desc",
+        "with_backup": query.get("backup") != "0",
+    }
+
+
+def iter_grep_html(items: typing.Iterable, encoding: str, chunk_size=65536):
+    yield "<pre>"
+    buffer: typing.List[str] = []
+    size = 0
+    for item in items:
+        if item is None:
+            text = "--\n"
+        else:
+            sep = ":" if item.matched else "-"
+            line = item.line.decode(encoding, errors="replace").rstrip("\r\n")
+            text = f"{item.path.name}{sep} {html.escape(line)}\n"
+        buffer.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+    buffer.append("</pre>")
+    yield "".join(buffer)
+
+
+def handle_tail(path: Path):
     if not path.is_file():
         raise ValueError("not a file")
     tail = int(request.query["tail"])
     encoding = request.query.get("encoding", "utf-8")
-    interval = int(request.query.get("interval", 1))
-    with open(path, "r", encoding=encoding) as f:
-        if tail:
-            for index, line in enumerate(f):
-                pass
-            min_index = index + 1 - tail
-            f.seek(0)
-            yield "<pre style='font-size: 1.5em;'>"
-            for index, line in enumerate(f):
-                if index >= min_index:
-                    yield line
-            yield "</pre>"
-        else:
-            keepalives[event_id] = int(time.time() + keepalive_timeout)
-            yield (
-                "<script> (function () { setInterval(() => document.readyState !== 'complete' && fetch('/keepalive?e=%s', { method: 'HEAD' }), %s); })()</script>"
-                % (event_id, (keepalive_timeout * 1000 // 2))
-            )
-            yield "<pre style='font-size: 1.5em;'>"
-            # tail -F
-            # end of file
-            f.seek(path.stat().st_size)
-            while True:
-                line = f.readline()
-                if line:
-                    yield line
-                else:
-                    if time.time() > keepalives.get(event_id, 0):
-                        keepalives.pop(event_id, None)
-                        break
-                    elif path.stat().st_size < f.tell():
-                        f.seek(0)
-                    time.sleep(interval)
-            yield "</pre>"
-
-
-@app.route("/keepalive", method="HEAD")
-def keepalive():
-    if request.query.get("d"):
-        keepalives.pop(request.query["e"], None)
-    else:
-        now = int(time.time())
-        keepalives[request.query["e"]] = now + keepalive_timeout
-    for k, v in list(keepalives.items()):
-        if now > v:
-            keepalives.pop(k, None)
+    if tail:
+        # O(N lines): read backwards from EOF, and from the rotated backup if not enough
+        yield "<pre style='font-size: 1.5em;'>"
+        for line in tail_lines(path, tail):
+            yield line.decode(encoding, errors="replace")
+        yield "</pre>"
+        return
+    # tail -F: the page follows /stream by EventSource
+    yield get_follow_html(path, encoding, request.query.get("lines", 0))
+
+
+def get_follow_html(path: Path, encoding: str, lines) -> str:
+    "The tail -F page of the log file, following /stream by EventSource."
+    url = "/stream/%s?%s" % (
+        quote(path.relative_to(Config.root_path).as_posix()),
+        urlencode({"encoding": encoding, "lines": lines}),
+    )
+    return f"""<pre id="log" style='font-size: 1.5em;'></pre><script>
+    const log = document.getElementById("log");
+    const source = new EventSource({json.dumps(url)});
+    const append = (text) => {{
+        const atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 10;
+        log.append(text);
+        if (atBottom) window.scrollTo(0, document.body.scrollHeight);
+    }};
+    source.onmessage = (e) => append(e.data);
+    source.addEventListener("rotate", () => append("\\n[rotated]\\n"));
+    source.addEventListener("truncate", () => append("\\n[truncated]\\n"));
+    </script>"""
+
+
+def sse_event(kind: str, text: str, event_id="") -> str:
+    "Server-Sent Events message, the newlines of text are kept by multiple data fields."
+    head = f"event: {kind}\n" if kind != "message" else ""
+    if event_id:
+        head += f"id: {event_id}\n"
+    return head + "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+
+
+@app.get("/stream/<path:path>")
+def stream_log(path):
+    """Follow the appended data of a log file as Server-Sent Events, shared by LogHub.
+
+    lines: send the last N lines first, skipped on reconnection (Last-Event-ID)."""
+    root = Config.root_path
+    real_path: Path = root.joinpath(path).resolve()
+    if not (real_path.is_file() and real_path.is_relative_to(root)):
+        return HTTPError(404, "path not found")
+    encoding = request.query.get("encoding") or "utf-8"
+    lines = 0 if request.get_header("Last-Event-ID") else int(request.query.get("lines") or 0)
+    response.content_type = "text/event-stream"
+    response.set_header("Cache-Control", "no-cache")
+    response.set_header("X-Accel-Buffering", "no")
+    return iter_log_events(real_path, lines, encoding)
+
+
+def iter_log_events(path: Path, lines: int, encoding: str):
+    # the WSGI server still holds one worker thread for each viewer, but no file polling
+    events: queue.Queue = queue.Queue(maxsize=1000)
+    overflow = threading.Event()
+
+    def callback(kind: str, data: bytes):
+        try:
+            events.put_nowait((kind, data))
+        except queue.Full:
+            overflow.set()
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    hub = LogHub.get_instance()
+    token = hub.subscribe(path, callback, tail=lines)
+    try:
+        yield "retry: 3000\n" + sse_event("open", "", event_id="1")
+        while not overflow.is_set():
+            try:
+                kind, data = events.get(timeout=15)
+            except queue.Empty:
+                # heartbeat, and the closed connection raises on writing
+                yield ": ping\n\n"
+                continue
+            if kind == "data":
+                text = decoder.decode(data)
+                if text:
+                    yield sse_event("message", text)
+            else:
+                decoder.reset()
+                yield sse_event(kind, "")
+        # too slow to consume, the client reconnects
+        yield sse_event("overflow", "")
+    finally:
+        hub.unsubscribe(token)
 
 
 @app.post("/upload")
@@ -548,54 +841,52 @@ def upload():
 
 @app.get("/console")
 def console():
-    root = Config.root_path
     kill = request.query.get("kill")
     if kill:
-        pid = int(kill)
-        if root.joinpath(f"pids/{pid}").is_file():
-            signal = int(request.query.get("signal") or 2)
-            proc = Process(pid)
-            if proc.is_running():
-                if signal == 9:
-                    proc.kill()
-                elif signal == 15:
-                    proc.terminate()
-                elif signal == 2:
-                    if sys.platform == "win32":
-                        proc.kill()
-                    else:
-                        proc.send_signal(2)
-                else:
-                    raise ValueError("bad signal")
-                proc.wait(5)
+        kill_run(int(kill), int(request.query.get("signal") or 2))
         redirect(request.headers.get("Referer") or "/console")
-    pids_dir = root.joinpath("pids")
-    pids = []
-    for pid_path in root.rglob("pid.txt"):
-        pid = None
-        try:
-            pid = int(pid_path.read_bytes())
-        except FileNotFoundError:
-            pass
-        finally:
-            if pid:
-                if is_running(pid):
-                    pids.append(pid)
-                else:
-                    pids_dir.joinpath(str(pid)).unlink(missing_ok=True)
-                    pid_path.unlink(missing_ok=True)
-    m_file = root.joinpath("max_workers")
-    if m_file.is_file():
-        max_workers = m_file.read_text().strip() or "-"
-    else:
-        max_workers = "-"
-    items: dict = Taska.get_pids_info(pids)
-    Taska.LATEST_PROC_CACHE.update(items)
+    snapshot = Taska.get_sampler().get()
+    if snapshot is None:
+        return HTTPError(503, "process sampler is not ready")
+    if request.get_header("If-None-Match") == snapshot.etag:
+        return HTTPResponse(status=304)
+    response.set_header("ETag", snapshot.etag)
+    return render_console(snapshot)
+
+
+def kill_run(pid: int, signal: int):
+    "Send the signal (2/15/9) to a running runner and wait for it to exit."
+    if pid not in Taska.get_running_pids():
+        return
+    proc = Process(pid)
+    if proc.is_running():
+        if signal == 9:
+            proc.kill()
+        elif signal == 15:
+            proc.terminate()
+        elif signal == 2:
+            if sys.platform == "win32":
+                proc.kill()
+            else:
+                proc.send_signal(2)
+        else:
+            raise ValueError("bad signal")
+        proc.wait(5)
+        Taska.get_sampler().wakeup()
+
+
+def render_console(snapshot: Snapshot):
+    "Rendered once for each snapshot."
+    if Config.console_cache and Config.console_cache[0] == snapshot.etag:
+        return Config.console_cache[1]
+    data = snapshot.data
+    stats = data["admission"]
+    max_workers = stats["max_workers"] or "-"
     # [{'pid': 10916, 'status': 'running', 'job_dir': 'default/venv1/workspaces/workspace1/jobs/job1', 'start_at': '2024-08-05 21:36:35', 'elapsed': '19 secs', 'memory': '17 MB'}]
     th_list = [
         f"<th>{k}</th>"
         for k in [
-            f"*/{max_workers} - <a style='color: #ffffff' href='/'>Home</a>",
+            f"{stats['running']}/{max_workers} - <a style='color: #ffffff' href='/'>Home</a> <a style='color: #ffffff' href='/console/usage'>Usage</a><br>queued: {stats['queued']}, oldest wait: {read_time(stats['oldest_wait'], shorten=True)}, avg wait: {read_time(stats['avg_wait'], shorten=True)}",
             "pid",
             "status",
             "start_at",
@@ -608,33 +899,100 @@ def console():
             "kill-9",
         ]
     ]
-    tr_list = []
-    rows = sorted(
-        Taska.LATEST_PROC_CACHE.items(),
-        key=lambda x: x[1]["start_at"],
-        reverse=True,
-    )
-    cache_length = Taska.CACHE_LENGTH
-    for row_id, (pid, item) in enumerate(rows, 1):
-        if pid in items:
-            tr_list.append(proc_info_to_tr(item, row_id, pid))
-        elif row_id < cache_length:
-            if item["status"] != "dead":
-                cache_item = Taska.LATEST_PROC_CACHE[pid]
-                cache_item["status"] = "dead"
-                cache_item["start_at"], cache_item["end_at"], cache_item["elapsed"] = (
-                    Taska.get_end_at(item)
-                )
-                item = cache_item
-            tr_list.append(proc_info_to_tr(item, row_id, pid))
-        else:
-            Taska.LATEST_PROC_CACHE.pop(pid, None)
+    tr_list = [proc_info_to_tr(item, "-", "-") for item in data["queued"]]
+    for row_id, item in enumerate(data["processes"], 1):
+        tr_list.append(proc_info_to_tr(item, row_id, item["pid"]))
     html = Config.console_template.substitute(
         th_list="\n".join(th_list), tr_list="\n".join(tr_list)
     )
+    Config.console_cache = (snapshot.etag, html)
     return html
 
 
+@lru_cache_ttl(ttl=30, maxsize=10)
+def get_usage_by_job(hours: float):
+    return Taska.get_store().usage_by_job(time.time() - hours * 3600)
+
+
+@app.get("/console/usage")
+def console_usage():
+    "Per-job aggregates of the recorded run usage in the last `hours`."
+    hours = float(request.query.get("hours") or 24)
+    try:
+        rows = get_usage_by_job(hours)
+    except sqlite3.Error as e:
+        return HTTPError(500, f"result store error: {e!r}")
+    if request.query.get("format") == "json":
+        response.content_type = "application/json; charset=utf-8"
+        return json.dumps(rows, ensure_ascii=False)
+    return render_usage(rows, hours)
+
+
+def render_usage(rows: typing.List[dict], hours: float):
+    th_list = [
+        f"<th>{k}</th>"
+        for k in [
+            f"last {hours:g} hours - <a style='color: #ffffff' href='/console'>Console</a>",
+            "job_dir",
+            "runs",
+            "duration",
+            "cpu (user/sys)",
+            "children cpu",
+            "max rss",
+            "children max rss",
+            "ctx switches (vol/invol)",
+            "io blocks",
+        ]
+    ]
+    tr_list = []
+    for row_id, row in enumerate(rows, 1):
+        job_dir = row["job_dir"]
+        cpu = (row["utime"] or 0) + (row["stime"] or 0)
+        tr_list.append(
+            f"""<tr><td>{row_id}</td><td><a target="_blank" href="/view/{job_dir}">{job_dir}</a></td><td>{row['runs']}</td><td>{read_time(row['duration'] or 0, shorten=True)}</td><td>{cpu:.2f}s ({row['utime'] or 0:.2f}/{row['stime'] or 0:.2f})</td><td>{row['children_cpu'] or 0:.2f}s</td><td>{read_size(row['maxrss'] or 0, 1, shorten=True)}</td><td>{read_size(row['children_maxrss'] or 0, 1, shorten=True)}</td><td>{row['nvcsw'] or 0}/{row['nivcsw'] or 0}</td><td>{row['io_blocks'] or 0}</td></tr>"""
+        )
+    return Config.console_template.substitute(
+        th_list="\n".join(th_list), tr_list="\n".join(tr_list)
+    )
+
+
+@app.get("/api/install")
+@app.get("/api/install/<path:path>")
+def api_install(path=""):
+    "Status of the background installs, all the venvs or one."
+    root = Config.root_path
+    if path:
+        task = Taska.get_installer().get(root.joinpath(path).resolve())
+        if task is None:
+            return HTTPError(404, "no install task")
+        data: typing.Any = task.to_dict()
+    else:
+        data = [task.to_dict() for task in Taska.get_installer().all()]
+    response.content_type = "application/json; charset=utf-8"
+    return json.dumps(data, ensure_ascii=False)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    "Prometheus text format, rendered from the in-memory counters."
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return metrics.REGISTRY.render()
+
+
+@app.get("/api/processes")
+def api_processes():
+    "The latest snapshot of the sampler as JSON, supports If-None-Match."
+    snapshot = Taska.get_sampler().get()
+    if snapshot is None:
+        return HTTPError(503, "process sampler is not ready")
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if request.get_header("If-None-Match") == snapshot.etag:
+        return HTTPResponse(status=304, **headers)
+    return HTTPResponse(
+        snapshot.body, content_type="application/json; charset=utf-8", **headers
+    )
+
+
 def proc_info_to_tr(item, row_id, pid):
     grep = "%s%s" % (quote_plus('"pid": '), item["pid"])
     href = f'<a target="_blank" href="/view/{item["job_dir"]}">{item["job_dir"]}</a>; <a target="_blank" href="/view/{item["job_dir"]}/result.jsonl?action=view&grep={grep}">result</a>'
@@ -650,9 +1008,16 @@ def handle_signal(sig, b):
     sys.exit()
 
 
-def main(root_path, host="127.0.0.1", port=8021, debug=False):
+def setup_app(root_path):
+    "Set the root path, and install the plugins once."
     Config.root_path = Path(root_path).resolve()
-    app.install(AuthPlugin())
+    if not any(isinstance(i, AuthPlugin) for i in app.plugins):
+        app.install(MetricsPlugin())
+        app.install(AuthPlugin())
+
+
+def main(root_path, host="127.0.0.1", port=8021, debug=False):
+    setup_app(root_path)
     logger.warning(
         f"start server: root_path: {Config.root_path}, debug={debug}, http://{host}:{port}"
     )
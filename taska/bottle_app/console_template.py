@@ -44,6 +44,9 @@ console_template = r"""<!DOCTYPE html>
         .dead{
             color: gray;
         }
+        .queued{
+            color: darkorange;
+        }
     </style>
     <script>
         function redirect(url) {
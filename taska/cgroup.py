@@ -0,0 +1,61 @@
+import sys
+import typing
+from pathlib import Path
+
+# keep in sync with templates/runner.py, checked by tests/test_runner.py
+CGROUP_MOUNT = Path("/sys/fs/cgroup")
+CGROUP_FILE = "cgroup"
+
+
+def get_base(root_dir: Path) -> typing.Optional[Path]:
+    """The delegated cgroup v2 dir of the runs, from the `cgroup` file of the root dir (absolute, or relative to
+    /sys/fs/cgroup). None if not set or not mounted."""
+    path = root_dir / CGROUP_FILE
+    if sys.platform != "linux" or not path.is_file():
+        return None
+    base = Path(path.read_text().strip())
+    if not base.is_absolute():
+        base = CGROUP_MOUNT / base
+    if not base.joinpath("cgroup.procs").is_file():
+        return None
+    return base
+
+
+def get_run_cgroup(base: Path, pid: int) -> Path:
+    return base / f"run-{pid}"
+
+
+def read_stats(cgroup: Path) -> dict:
+    "OOM / throttling stats of the cgroup: memory.events, cpu.stat, pids.events and the peaks."
+    stats = {}
+    for name, keys in (
+        ("memory.events", ("max", "oom", "oom_kill")),
+        ("cpu.stat", ("usage_usec", "nr_periods", "nr_throttled", "throttled_usec")),
+        ("pids.events", ("max",)),
+    ):
+        try:
+            text = cgroup.joinpath(name).read_text()
+        except OSError:
+            continue
+        prefix = name.split(".")[0]
+        for line in text.splitlines():
+            key, _, value = line.partition(" ")
+            if key in keys:
+                stats[f"{prefix}_{key}"] = int(value)
+    for name in ("memory.peak", "pids.peak"):
+        try:
+            stats[name.replace(".", "_")] = int(cgroup.joinpath(name).read_text())
+        except (OSError, ValueError):
+            pass
+    return stats
+
+
+def remove(cgroup: Path) -> bool:
+    "rmdir the cgroup, fails if any process is still inside."
+    try:
+        cgroup.rmdir()
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
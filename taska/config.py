@@ -8,6 +8,8 @@ class Config:
     LOG_STREAM = True
     LOG_DIR = None
     LOG_LEVEL = logging.DEBUG
+    # bearer token of the /metrics scrapes, disabled if empty
+    METRICS_TOKEN = ""
 
     @classmethod
     def init_logger(cls):
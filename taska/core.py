@@ -3,21 +3,42 @@ import json
 import logging
 import os
 import re
+import select
 import shutil
 import signal
+import sqlite3
 import subprocess
 import sys
+import threading
 import time
 import typing
 import venv
-from datetime import datetime, timedelta
+from concurrent.futures import Future
+from datetime import datetime
+from functools import partial
 from hashlib import md5
 from pathlib import Path
 
-from morebuiltins.date import Crontab
 from morebuiltins.utils import is_running, ptime, read_size, read_time, ttime
 from psutil import NoSuchProcess, Process
 
+from . import cgroup, metrics
+from .admission import Admission
+from .installer import Installer, InstallTask
+from .inotify import (
+    IN_DELETE_SELF,
+    IN_MOVE_SELF,
+    IN_Q_OVERFLOW,
+    Inotify,
+    InotifyEvent,
+)
+from .pkgstore import PackageStore
+from .sampler import ProcessSampler
+from .scheduler import CronMatcher, Scheduler
+from .store import ResultStore
+from .supervisor import Launcher, Run
+from .utils import run_with_output
+
 logger = logging.getLogger("taska")
 
 
@@ -30,12 +51,22 @@ class Job(typing.TypedDict):
     params: dict
     # enable = 1, 0; 1 = enable, 0 = disable
     enable: int
-    # crontab default = 0, format = '* * * * *'
+    # crontab default = 0, format = '* * * * *', or '*/5 * * * * *' with seconds
     crontab: str
+    # interval = 5, fire every 5 seconds instead of crontab, default = 0
+    interval: float
     # default = 60s
     timeout: int
-    # 1g/1gb/1GB == 1024**3
+    # async_worker = 1, run in the shared asyncio worker process of the workspace
+    async_worker: int
+    # priority = 10, the higher runs first when max_workers is saturated, default = 0
+    priority: int
+    # 1g/1gb/1GB == 1024**3, memory.max of the run cgroup, or RLIMIT_AS without cgroup
     mem_limit: str
+    # cpu_limit = 0.5, cpu.max cores of the run cgroup, default = 0 (unlimited)
+    cpu_limit: float
+    # pids_limit = 64, pids.max of the run cgroup, default = 0 (unlimited)
+    pids_limit: int
     result_limit: str
     stdout_limit: str
 
@@ -65,18 +96,27 @@ class RootDir(DirBase):
     def prepare_dir(cls, target_dir: Path, name: str = "root", force=False, **kwargs):
         root_dir = target_dir / name
         if not force and cls.is_valid(root_dir):
+            cls.ensure_templates(root_dir)
             return root_dir.resolve()
         logger.info(f"[Init] Creating root_dir: {root_dir.resolve().as_posix()}")
         root_dir.mkdir(parents=True, exist_ok=True)
         root_dir.joinpath("pids").mkdir(parents=True, exist_ok=True)
-        runner_code = Path(__file__).parent.joinpath("templates/runner.py").read_bytes()
-        root_dir.joinpath("runner.py").write_bytes(runner_code)
+        cls.ensure_templates(root_dir)
         root_dir.joinpath("max_workers").write_text(
             str(os.cpu_count()), encoding="utf-8"
         )
         assert cls.is_valid(root_dir)
         return root_dir.resolve()
 
+    @classmethod
+    def ensure_templates(cls, root_dir: Path):
+        "Copy the templates to the root_dir, if changed by upgrading."
+        for name in ("runner.py", "forkserver.py", "async_worker.py"):
+            code = Path(__file__).parent.joinpath("templates", name).read_bytes()
+            path = root_dir.joinpath(name)
+            if not path.is_file() or path.read_bytes() != code:
+                path.write_bytes(code)
+
     @classmethod
     def is_valid(cls, path: Path):
         for name in ("runner.py", "pids", "max_workers"):
@@ -126,7 +166,8 @@ class VenvDir(DirBase):
             clear=True,
             symlinks=False,
             upgrade=False,
-            with_pip=True,
+            # the packages are linked from the store, pip is installed only for the fallback
+            with_pip=PackageStore.from_venv(venv_dir) is None,
             prompt=None,
             upgrade_deps=False,
         )
@@ -143,7 +184,11 @@ class VenvDir(DirBase):
         return venv_dir.resolve()
 
     @classmethod
-    def pip_install(cls, venv_dir: Path):
+    def pip_install(
+        cls,
+        venv_dir: Path,
+        output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+    ):
         req_file = venv_dir / "requirements.txt"
         if sys.platform == "win32":
             executable = (venv_dir / "Scripts" / "python.exe").resolve().as_posix()
@@ -159,21 +204,48 @@ class VenvDir(DirBase):
         ]
         env = os.environ.copy()
         env["PIP_CONFIG_FILE"] = venv_dir.joinpath("pip.conf").resolve().as_posix()
-        proc = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            encoding="utf-8",
-            errors="replace",
-            env=env,
-        )
-        if proc.returncode != 0:
-            raise RuntimeError(f"pip install failed {proc.stderr}")
-        logger.debug(f"[PIP] {cmd}\n{proc.stdout}")
+        returncode, stdout = run_with_output(cmd, env=env, output=output)
+        if returncode != 0:
+            raise RuntimeError(f"pip install failed {stdout}")
+        logger.debug(f"[PIP] {cmd}\n{stdout}")
         return True
 
     @classmethod
-    def ensure_pip_install(cls, path: Path):
+    def store_install(
+        cls,
+        venv_dir: Path,
+        output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+    ) -> bool:
+        "Install from the package store if enabled, False if disabled or failed (fallback to pip)."
+        store = PackageStore.from_venv(venv_dir, output=output)
+        if store is None:
+            return False
+        try:
+            names = store.install(venv_dir)
+        except Exception as e:
+            logger.error(
+                f"[PkgStore] Store install failed, fallback to pip: {venv_dir.resolve().as_posix()}, {e!r}"
+            )
+            if output is not None:
+                output(f"[PkgStore] failed, fallback to pip: {e!r}")
+            return False
+        logger.info(f"[PkgStore] Linked {len(names)} packages: {venv_dir.resolve().as_posix()}")
+        return True
+
+    @classmethod
+    def ensure_venv_pip(cls, venv_dir: Path):
+        "The venvs of the package store are created without pip."
+        python = PackageStore.get_python(venv_dir).resolve().as_posix()
+        if subprocess.run([python, "-m", "pip", "--version"], capture_output=True).returncode:
+            subprocess.run([python, "-m", "ensurepip"], capture_output=True, check=True)
+
+    @classmethod
+    def ensure_pip_install(
+        cls,
+        path: Path,
+        output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+    ):
+        "Install requirements.txt if its md5 changed, `output` receives the installer output lines."
         r = path / "requirements.txt"
         m = path / "requirements.md5"
         old_md5 = m.read_text(encoding="utf-8") if m.is_file() else ""
@@ -185,10 +257,13 @@ class VenvDir(DirBase):
                 requirements = r.read_text(encoding="utf-8")
             else:
                 requirements = ""
-            if requirements:
+            if cls.store_install(path, output=output):
+                ok = True
+            elif requirements:
                 req_str = requirements.replace("\n", ", ")
                 logger.info(f"[Pip] Pip install: {r.resolve().as_posix()} {req_str}")
-                ok = cls.pip_install(path)
+                cls.ensure_venv_pip(path)
+                ok = cls.pip_install(path, output=output)
             else:
                 ok = True
             if ok:
@@ -230,8 +305,13 @@ class JobDir(DirBase):
         "params": {},
         "enable": 0,
         "crontab": "* * * * *",
+        "interval": 0,
         "timeout": 0,
+        "async_worker": 0,
+        "priority": 0,
         "mem_limit": "",
+        "cpu_limit": 0,
+        "pids_limit": 0,
         "result_limit": "",
         "stdout_limit": "",
     }
@@ -255,6 +335,290 @@ class JobDir(DirBase):
     def is_valid(cls, path: Path):
         return path.joinpath("meta.json").is_file()
 
+    @classmethod
+    def load_meta(cls, meta_path: Path) -> Job:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if not isinstance(meta, dict):
+            raise ValueError(f"meta should be a dict, not {type(meta).__name__}")
+        for key, value in cls.default_meta.items():
+            meta.setdefault(key, value)
+        if not isinstance(meta["params"], (dict, list)):
+            raise ValueError(f"invalid params type: {type(meta['params']).__name__}")
+        for key in ("enable", "timeout", "async_worker", "priority", "pids_limit"):
+            if not isinstance(meta[key], int):
+                raise ValueError(f"{key} should be int, not {meta[key]!r}")
+        if not isinstance(meta["interval"], (int, float)) or meta["interval"] < 0:
+            raise ValueError(f"interval should be a number >= 0, not {meta['interval']!r}")
+        if not isinstance(meta["cpu_limit"], (int, float)) or meta["cpu_limit"] < 0:
+            raise ValueError(f"cpu_limit should be a number >= 0, not {meta['cpu_limit']!r}")
+        for key in ("entrypoint", "crontab"):
+            if not isinstance(meta[key], str):
+                raise ValueError(f"{key} should be str, not {meta[key]!r}")
+        return typing.cast(Job, meta)
+
+
+class JobIndex:
+    """In-memory index of the job dirs: {job_dir: Job}.
+
+    Refreshed incrementally by inotify events, or by the directory mtime check if inotify is unavailable.
+    The meta.json is parsed only if its mtime changed. The events of the other files in the job dirs (logs, results,
+    pid.txt) are dropped without waking up the scheduler."""
+
+    # depth of container => (child dir type, sub-container of the child)
+    LEVELS: typing.List[typing.Tuple[typing.Type[DirBase], str]] = [
+        (PythonDir, ""),
+        (VenvDir, "workspaces"),
+        (WorkspaceDir, "jobs"),
+        (JobDir, ""),
+    ]
+
+    def __init__(self, root_dir: Path, use_inotify=True):
+        self.root_dir = root_dir
+        self.jobs: typing.Dict[Path, Job] = {}
+        self.lock = threading.RLock()
+        self.inotify = Inotify.create() if use_inotify else None
+        self.ready = False
+        # container => depth
+        self._containers: typing.Dict[Path, int] = {}
+        # container => (mtime_ns, sub dirs)
+        self._listings: typing.Dict[Path, typing.Tuple[int, typing.List[Path]]] = {}
+        # container => valid children (sub-containers or job dirs)
+        self._children: typing.Dict[Path, typing.Set[Path]] = {}
+        # job_dir => meta.json mtime_ns
+        self._meta_mtimes: typing.Dict[Path, int] = {}
+        # containers with invalid children, which may become valid without any event
+        self._pending: typing.Set[Path] = set()
+        self._changed: typing.Set[Path] = set()
+        self._subscribers: typing.List[typing.Set[Path]] = []
+        self._wakeup_event = threading.Event()
+        self._wakeup_pipe = os.pipe() if self.inotify else None
+        # relevant events read by `wait`, handled by the next refresh
+        self._events: typing.List[InotifyEvent] = []
+
+    def wait(self, timeout: float) -> bool:
+        "Sleep until timeout, return True if woken up early by the relevant inotify events or `wakeup()`."
+        timeout = max(timeout, 0)
+        deadline = time.time() + timeout
+        inotify, pipe = self.inotify, self._wakeup_pipe
+        if inotify and pipe:
+            while True:
+                try:
+                    readable, _, _ = select.select(
+                        [inotify, pipe[0]], [], [], max(deadline - time.time(), 0)
+                    )
+                except (OSError, ValueError):
+                    # inotify closed by fallback
+                    return True
+                if pipe[0] in readable:
+                    os.read(pipe[0], 1024)
+                    return True
+                if not readable:
+                    return False
+                if self._read_events():
+                    return True
+        woken = self._wakeup_event.wait(timeout)
+        self._wakeup_event.clear()
+        return woken
+
+    def wakeup(self):
+        self._wakeup_event.set()
+        if self._wakeup_pipe:
+            os.write(self._wakeup_pipe[1], b"\0")
+
+    def refresh(self, full=False) -> typing.Set[Path]:
+        "Refresh the index, return the changed job dirs."
+        with self.lock:
+            if full or not self.ready or not self.inotify:
+                self._walk(self.root_dir, 0)
+                self.ready = True
+            else:
+                self._handle_events()
+            changed, self._changed = self._changed, set()
+            for subscriber in self._subscribers:
+                subscriber.update(changed)
+            return changed
+
+    def subscribe(self) -> typing.Set[Path]:
+        "Return a set which collects the changed job dirs of every refresh, the consumer should pop it."
+        with self.lock:
+            changes: typing.Set[Path] = set()
+            self._subscribers.append(changes)
+            return changes
+
+    def get(self, job_dir: Path) -> typing.Optional[Job]:
+        "Get the fresh Job of a job dir, which is loaded into the index if not seen."
+        with self.lock:
+            if self.inotify and self.ready:
+                self._handle_events()
+            elif self.is_job_path(job_dir):
+                self._load_job(job_dir)
+            return self.jobs.get(job_dir)
+
+    def is_job_path(self, job_dir: Path):
+        "root/python/venv/workspaces/workspace/jobs/job"
+        try:
+            parts = job_dir.relative_to(self.root_dir).parts
+        except ValueError:
+            return False
+        return len(parts) == 6 and parts[2] == "workspaces" and parts[4] == "jobs"
+
+    def get_tree(self) -> dict:
+        "{python: {venv: {workspace: {job: None}}}}"
+        with self.lock:
+            result: dict = {}
+            for container, depth in sorted(self._containers.items()):
+                parts = container.relative_to(self.root_dir).parts
+                if depth == 1:
+                    result.setdefault(parts[0], {})
+                elif depth == 2:
+                    result.setdefault(parts[0], {}).setdefault(parts[1], {})
+                elif depth == 3:
+                    venv_result = result.setdefault(parts[0], {}).setdefault(parts[1], {})
+                    w_result = venv_result.setdefault(parts[3], {})
+                    for job_dir in sorted(self._children.get(container, ())):
+                        w_result[job_dir.name] = None
+            return result
+
+    def _is_relevant(self, event: InotifyEvent) -> bool:
+        "Events of the containers, and of the meta.json / the job dir itself."
+        if event.mask & IN_Q_OVERFLOW:
+            return True
+        path = Path(event.path)
+        if path in self._containers:
+            return True
+        return path in self._meta_mtimes and (
+            event.name == "meta.json" or bool(event.mask & (IN_DELETE_SELF | IN_MOVE_SELF))
+        )
+
+    def _read_events(self) -> bool:
+        "Keep the relevant events for the next refresh, return True if any."
+        with self.lock:
+            if not self.inotify:
+                return True
+            events = [i for i in self.inotify.read_events() if self._is_relevant(i)]
+            self._events.extend(events)
+            return bool(events)
+
+    def _handle_events(self):
+        containers: typing.Set[Path] = set(self._pending)
+        job_dirs: typing.Set[Path] = set()
+        events, self._events = self._events, []
+        events += self.inotify.read_events() if self.inotify else []
+        for event in events:
+            if not self._is_relevant(event):
+                continue
+            if event.mask & IN_Q_OVERFLOW:
+                return self._walk(self.root_dir, 0)
+            path = Path(event.path)
+            if path in self._containers:
+                containers.add(path)
+            else:
+                job_dirs.add(path)
+        for job_dir in job_dirs:
+            if not self._load_job(job_dir):
+                self._drop(job_dir)
+        for container in sorted(containers, key=lambda p: len(p.parts)):
+            if container in self._containers:
+                # known children have their own watches
+                self._walk(container, self._containers[container], recurse=False)
+
+    def _watch(self, path: Path):
+        if self.inotify:
+            try:
+                self.inotify.add_watch(path.as_posix())
+            except OSError as e:
+                # ENOSPC: fs.inotify.max_user_watches, fallback to mtime check
+                logger.warning(f"[Index] inotify disabled, fallback to mtime: {e!r}")
+                self.inotify.close()
+                self.inotify = None
+                self.wakeup()
+
+    def _unwatch(self, path: Path):
+        if self.inotify:
+            self.inotify.rm_watch(path.as_posix())
+
+    def _walk(self, container: Path, depth: int, recurse=True):
+        try:
+            mtime = container.stat().st_mtime_ns
+        except OSError:
+            return self._drop(container)
+        if container not in self._containers:
+            self._containers[container] = depth
+            self._watch(container)
+        cached = self._listings.get(container)
+        if not cached or cached[0] != mtime:
+            try:
+                with os.scandir(container) as it:
+                    sub_dirs = [Path(i.path) for i in it if i.is_dir()]
+            except OSError:
+                return self._drop(container)
+            cached = self._listings[container] = (mtime, sub_dirs)
+        dir_type, sub_name = self.LEVELS[depth]
+        children: typing.Set[Path] = set()
+        pending = False
+        for child in cached[1]:
+            if dir_type is JobDir:
+                if not recurse and child in self._meta_mtimes:
+                    children.add(child)
+                elif self._load_job(child):
+                    children.add(child)
+                else:
+                    pending = True
+            elif dir_type.is_valid(child):
+                sub_container = child.joinpath(sub_name) if sub_name else child
+                if sub_container.is_dir():
+                    children.add(sub_container)
+                    if recurse or sub_container not in self._containers:
+                        self._walk(sub_container, depth + 1)
+                else:
+                    pending = True
+            else:
+                pending = True
+        if pending:
+            self._pending.add(container)
+        else:
+            self._pending.discard(container)
+        for removed in self._children.get(container, set()) - children:
+            self._drop(removed)
+        self._children[container] = children
+
+    def _load_job(self, job_dir: Path) -> bool:
+        meta_path = job_dir / "meta.json"
+        try:
+            mtime = meta_path.stat().st_mtime_ns
+        except OSError:
+            return False
+        if self._meta_mtimes.get(job_dir) == mtime and job_dir in self.jobs:
+            return True
+        if job_dir not in self._meta_mtimes:
+            self._watch(job_dir)
+        self._meta_mtimes[job_dir] = mtime
+        try:
+            job = JobDir.load_meta(meta_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Index] invalid meta.json: {meta_path.as_posix()}, {e!r}")
+            if self.jobs.pop(job_dir, None) is not None:
+                self._changed.add(job_dir)
+            # keep the mtime to avoid parsing the bad file again
+            return True
+        self.jobs[job_dir] = job
+        self._changed.add(job_dir)
+        return True
+
+    def _drop(self, path: Path):
+        if path in self._meta_mtimes:
+            self._meta_mtimes.pop(path, None)
+            if self.jobs.pop(path, None) is not None:
+                self._changed.add(path)
+            self._unwatch(path)
+        if path in self._containers:
+            for child in self._children.pop(path, set()):
+                self._drop(child)
+            self._containers.pop(path, None)
+            self._listings.pop(path, None)
+            self._pending.discard(path)
+            self._unwatch(path)
+
 
 class Taska:
     SHUTDOWN = False
@@ -262,77 +626,130 @@ class Taska:
     TREE_LEVELS = [RootDir, PythonDir, VenvDir, WorkspaceDir, JobDir]
     LATEST_PROC_CACHE: dict = {}
     CACHE_LENGTH = 50
+    INDEX: typing.Optional[JobIndex] = None
+    INDEX_LOCK = threading.Lock()
+    LAUNCHER: typing.Optional[Launcher] = None
+    LAUNCH_WORKERS = 8
+    ADMISSION: typing.Optional[Admission] = None
+    QUEUE_LENGTH = 1000
+    STORE: typing.Optional[ResultStore] = None
+    SAMPLER: typing.Optional[ProcessSampler] = None
+    SAMPLE_INTERVAL = 2.0
+    INSTALLER: typing.Optional[Installer] = None
+    # queued job_dir => fire time, for the spawn lag
+    FIRE_TIMES: typing.Dict[Path, float] = {}
+    # run cgroups still holding the processes outliving the runner, removed later
+    STALE_CGROUPS: typing.Set[Path] = set()
 
     def __init__(self):
         if self.ROOT_PATH is None:
             raise ValueError("Taska.ROOT_PATH is not set")
         self.root_dir = self.ROOT_PATH
+        self.index = self.get_index()
+        self.scheduler = Scheduler()
         self.tree = self.init_dir_tree()
+        self.job_changes = self.index.subscribe()
+        now = datetime.now()
+        for job_dir, job in list(self.index.jobs.items()):
+            self.scheduler.update(job_dir, job, now)
         signal.signal(signalnum=signal.SIGINT, handler=self.handle_shutdown)
         signal.signal(signalnum=signal.SIGTERM, handler=self.handle_shutdown)
 
     def run_forever(self):
-        current_min = time.strftime("%M")
-        next_min = (datetime.now() + timedelta(minutes=1)).replace(
-            second=0, microsecond=0
-        )
         logger.warning(
             f"[Start] Program start, pid={os.getpid()}, root_dir={self.root_dir.resolve().as_posix()}"
         )
         while not self.SHUTDOWN:
-            _min = time.strftime("%M")
-            if _min != current_min:
-                current_min = _min
+            now = time.time()
+            # refresh the index at least once a minute, for the mtime fallback
+            wake_at = (now // 60 + 1) * 60
+            fire_at = self.scheduler.next_fire_at()
+            if fire_at is not None:
+                wake_at = min(wake_at, fire_at)
+            self.index.wait(wake_at - now)
+            if self.SHUTDOWN:
+                break
+            with metrics.SCHEDULER_TICK.time():
                 self.run_once()
-                next_min = (datetime.now() + timedelta(minutes=1)).replace(
-                    second=0, microsecond=0
-                )
-            timeleft = next_min.timestamp() - time.time()
-            interval = min((1, timeleft))
-            if interval > 0:
-                time.sleep(interval)
+        if self.LAUNCHER is not None:
+            self.LAUNCHER.shutdown(wait=False)
         logger.warning("[End] Program shutdown")
 
     def run_once(self):
-        for job, path in self.get_todos():
+        "Queue the due jobs, and submit the admitted ones to the launcher pool without waiting for the spawns."
+        admission = self.get_admission()
+        now = time.time()
+        for job, path, fire_at in self.get_todos():
+            metrics.SCHEDULER_DRIFT.observe(max(now - fire_at, 0))
+            if admission.push(path.parent, priority=job["priority"]):
+                self.FIRE_TIMES[path.parent] = fire_at
+        self.admit()
+        self.remove_stale_cgroups()
+
+    @classmethod
+    def admit(cls):
+        "Submit the queued runs which got the free slots."
+        admission = cls.get_admission()
+        for job_dir, wait in admission.pop_ready():
             logger.info(
-                f"[Launch] Launch job `{job['name']}`: {path.resolve().as_posix()}"
+                f"[Launch] Launch job (waited {wait:.3f}s): {job_dir.resolve().as_posix()}"
             )
-            self.launch_job(path)
+            metrics.QUEUE_WAIT.observe(wait)
+            cls.submit_job(job_dir, fire_at=cls.FIRE_TIMES.pop(job_dir, None))
+        stats = admission.stats()
+        metrics.RUNNING.set(stats["running"])
+        metrics.QUEUED.set(stats["queued"])
+        metrics.MAX_WORKERS.set(stats["max_workers"])
+        metrics.QUEUE_DROPPED.set(stats["dropped"])
+
+    @classmethod
+    def shutdown(cls):
+        cls.SHUTDOWN = True
+        if cls.SAMPLER is not None:
+            cls.SAMPLER.stop()
+        if cls.INDEX is not None:
+            cls.INDEX.wakeup()
 
     def handle_shutdown(self, *args):
-        self.__class__.SHUTDOWN = True
+        self.shutdown()
         logger.warning(f"[Shutdown] received shutdown signal: {args[0]}")
 
     def need_run(self, now, cron):
-        for _ in Crontab.iter_datetimes(cron, start_date=now, max_tries=1):
-            return True
-        return False
+        return CronMatcher.compile(cron).match(now)
+
+    def sync_jobs(self, now: typing.Optional[datetime] = None):
+        "Refresh the index, and update the scheduler with the changed jobs."
+        now = now or datetime.now()
+        self.index.refresh()
+        with self.index.lock:
+            changes = list(self.job_changes)
+            self.job_changes.clear()
+        for job_dir in changes:
+            self.scheduler.update(job_dir, self.index.jobs.get(job_dir), now)
 
     def get_todos(
         self, now: typing.Optional[datetime] = None
-    ) -> typing.Iterator[typing.Tuple[Job, Path]]:
+    ) -> typing.Iterator[typing.Tuple[Job, Path, float]]:
+        "Pop the due jobs (job, meta.json path, fire_at timestamp) from the scheduler, each fire time is yielded only once."
         now = now or datetime.now()
-        for path in self.root_dir.rglob("meta.json"):
-            job = json.loads(path.read_text(encoding="utf-8"))
-            if job["enable"] and job["crontab"] and self.need_run(now, job["crontab"]):
-                yield job, path
+        self.sync_jobs(now)
+        for job_dir, fire_at in self.scheduler.pop_due(now):
+            job = self.index.jobs.get(job_dir)
+            if job:
+                yield job, job_dir / "meta.json", fire_at
 
     def init_dir_tree(self):
-        result = {}
-        for d in self.root_dir.iterdir():
-            if PythonDir.is_valid(d):
-                py_result = result.setdefault(d.name, {})
-                for v in d.iterdir():
-                    if VenvDir.is_valid(v):
-                        venv_result = py_result.setdefault(v.name, {})
-                        for w in v.joinpath("workspaces").iterdir():
-                            if WorkspaceDir.is_valid(w):
-                                w_result = venv_result.setdefault(w.name, {})
-                                for j in w.joinpath("jobs").iterdir():
-                                    if JobDir.is_valid(j):
-                                        w_result[j.name] = None
-        return result
+        self.index.refresh()
+        return self.index.get_tree()
+
+    @classmethod
+    def get_index(cls) -> JobIndex:
+        with cls.INDEX_LOCK:
+            if cls.INDEX is None or cls.INDEX.root_dir != cls.ROOT_PATH:
+                if cls.ROOT_PATH is None:
+                    raise ValueError("Taska.ROOT_PATH is not set")
+                cls.INDEX = JobIndex(cls.ROOT_PATH)
+            return cls.INDEX
 
     @classmethod
     def prepare_default_env(cls, root_dir: Path, force=False):
@@ -364,18 +781,125 @@ class Taska:
         return root_dir, python_dir, venv_dir, workspace_dir, job_dir
 
     @classmethod
-    def launch_job(cls, job_path_or_dir: typing.Union[Path, str], timeout=0) -> Path:
+    def get_launcher(cls) -> Launcher:
+        with cls.INDEX_LOCK:
+            if cls.LAUNCHER is None:
+                cls.LAUNCHER = Launcher(
+                    max_workers=cls.LAUNCH_WORKERS,
+                    on_start=cls.handle_run_start,
+                    on_exit=cls.handle_run_exit,
+                )
+            return cls.LAUNCHER
+
+    @classmethod
+    def get_admission(cls) -> Admission:
+        with cls.INDEX_LOCK:
+            if cls.ADMISSION is None or cls.ADMISSION.root_dir != cls.ROOT_PATH:
+                if cls.ROOT_PATH is None:
+                    raise ValueError("Taska.ROOT_PATH is not set")
+                cls.ADMISSION = Admission(cls.ROOT_PATH, max_length=cls.QUEUE_LENGTH)
+            return cls.ADMISSION
+
+    @classmethod
+    def get_installer(cls) -> Installer:
+        with cls.INDEX_LOCK:
+            if cls.INSTALLER is None:
+                cls.INSTALLER = Installer(
+                    VenvDir.ensure_pip_install,
+                    on_start=cls.handle_install_start,
+                    on_done=cls.handle_install_done,
+                )
+            return cls.INSTALLER
+
+    @classmethod
+    def install_venv(cls, venv_dir: Path) -> typing.Tuple[InstallTask, bool]:
+        "Install requirements.txt in background, the scheduled runs of the venv wait for it."
+        return cls.get_installer().submit(venv_dir.resolve())
+
+    @classmethod
+    def handle_install_start(cls, venv_dir: Path):
+        cls.get_admission().hold(venv_dir)
+
+    @classmethod
+    def handle_install_done(cls, task: InstallTask):
+        cls.get_admission().unhold(task.venv_dir)
+        if not cls.SHUTDOWN:
+            cls.admit()
+
+    @classmethod
+    def get_store(cls) -> ResultStore:
+        with cls.INDEX_LOCK:
+            if cls.STORE is None or cls.STORE.root_dir != cls.ROOT_PATH:
+                if cls.ROOT_PATH is None:
+                    raise ValueError("Taska.ROOT_PATH is not set")
+                cls.STORE = ResultStore(cls.ROOT_PATH)
+            return cls.STORE
+
+    @classmethod
+    def get_sampler(cls) -> ProcessSampler:
+        with cls.INDEX_LOCK:
+            if cls.SAMPLER is None:
+                cls.SAMPLER = ProcessSampler(
+                    cls.sample_processes, interval=cls.SAMPLE_INTERVAL
+                )
+            return cls.SAMPLER
+
+    @classmethod
+    def sample_processes(cls) -> dict:
+        "The process table of the console and /api/processes, refreshed by the sampler thread."
+        if cls.ROOT_PATH is None:
+            raise RuntimeError("Taska.ROOT_PATH is not set")
+        items: dict = cls.get_pids_info(cls.get_running_pids())
+        cache = cls.LATEST_PROC_CACHE
+        cache.update(items)
+        rows = sorted(cache.items(), key=lambda x: x[1]["start_at"], reverse=True)
+        processes = []
+        for row_id, (pid, item) in enumerate(rows, 1):
+            if pid in items:
+                processes.append(item)
+            elif row_id < cls.CACHE_LENGTH:
+                if item["status"] != "dead":
+                    item["status"] = "dead"
+                    item["start_at"], item["end_at"], item["elapsed"] = cls.get_end_at(
+                        item
+                    )
+                processes.append(item)
+            else:
+                cache.pop(pid, None)
+        admission = cls.get_admission()
+        now = time.time()
+        queued = [
+            {
+                "pid": "-",
+                "status": "queued",
+                "job_dir": pending.job_dir.relative_to(cls.ROOT_PATH).as_posix(),
+                "start_at": ttime(pending.queued_at),
+                "elapsed": read_time(now - pending.queued_at, shorten=True),
+                "memory": "-",
+                "priority": pending.priority,
+            }
+            for pending in admission.pending()
+        ]
+        return {
+            "admission": admission.stats(now),
+            "queued": queued,
+            "processes": [dict(item) for item in processes],
+        }
+
+    @classmethod
+    def get_job_dir(cls, job_path_or_dir: typing.Union[Path, str]) -> Path:
+        "job dir or meta.json path => job dir"
         job_path = Path(job_path_or_dir).resolve()
-        if job_path.is_dir() and job_path.joinpath("meta.json").is_file():
-            job_dir = job_path
-        elif job_path.is_file() and job_path.parent.joinpath("meta.json").is_file():
-            job_dir = job_path.parent
+        index = cls.get_index()
+        if index.get(job_path) is not None:
+            return job_path
+        elif index.get(job_path.parent) is not None:
+            return job_path.parent
         else:
             raise FileNotFoundError(job_path)
-        if not JobDir.is_valid(job_dir):
-            raise FileNotFoundError
-        # job dir -> job meta file
-        job_path = job_dir / "meta.json"
+
+    @classmethod
+    def get_runner_cmd(cls, job_dir: Path) -> typing.List[str]:
         workspace_dir = job_dir.parent.parent
         venv_dir = workspace_dir.parent.parent
         runner_path = venv_dir.parent.parent / "runner.py"
@@ -384,56 +908,207 @@ class Taska:
             executable = venv_dir / "Scripts" / "python.exe"
         else:
             executable = venv_dir / "bin" / "python"
-        cmd = [executable.as_posix(), runner_path.as_posix()]
-        if sys.platform == "win32":
-            proc = subprocess.Popen(
-                cmd,
-                creationflags=subprocess.DETACHED_PROCESS
-                | subprocess.CREATE_NEW_PROCESS_GROUP
-                | subprocess.CREATE_NO_WINDOW
-                | subprocess.CREATE_BREAKAWAY_FROM_JOB,
-                cwd=job_dir.as_posix(),
+        return [executable.as_posix(), runner_path.as_posix()]
+
+    @classmethod
+    def launch_job(cls, job_path_or_dir: typing.Union[Path, str], timeout=0) -> Path:
+        "Launch the job at once (counted by, but not limited by the admission), and wait `timeout or 1` seconds for it to finish."
+        job_dir = cls.get_job_dir(job_path_or_dir)
+        job = cls.get_index().get(job_dir) or {}
+        admission = cls.get_admission()
+        admission.acquire(job_dir, force=True)
+        try:
+            run = cls.get_launcher().spawn(
+                job_dir,
+                cls.get_runner_cmd(job_dir),
+                async_worker=bool(job.get("async_worker")),
             )
-        else:
-            proc = subprocess.Popen(cmd, start_new_session=True, cwd=job_dir.as_posix())
-        setattr(proc, "_child_created", False)
-        pid_path = job_dir / "pid.txt"
-        pid = None
-        for _ in range((timeout or 1) * 10):
-            try:
-                try:
-                    if not pid:
-                        pid = int(pid_path.read_bytes() or 0)
-                        items: dict = cls.get_pids_info([pid])
-                        cls.LATEST_PROC_CACHE.update(items)
-                        jobs = sorted(
-                            cls.LATEST_PROC_CACHE.items(),
-                            key=lambda x: x[1]["start_at"],
-                        )
-                        for k, v in jobs:
-                            if v["status"] == "running":
-                                try:
-                                    v["status"] = Process(k).status()
-                                except NoSuchProcess:
-                                    v["status"] = "dead"
-                            elif len(cls.LATEST_PROC_CACHE) > cls.CACHE_LENGTH:
-                                cls.LATEST_PROC_CACHE.pop(k, None)
-                except FileNotFoundError:
-                    pass
-                if proc.wait(0.1):
-                    if pid:
-                        item = Taska.LATEST_PROC_CACHE[pid]
-                        item["status"] = "dead"
-                        item["start_at"], item["end_at"], item["elapsed"] = (
-                            Taska.get_end_at(item)
-                        )
-                    break
-            except subprocess.TimeoutExpired:
-                pass
-
-        del proc
+        except BaseException:
+            admission.release(job_dir)
+            raise
+        run.wait(timeout or 1)
         return job_dir
 
+    @classmethod
+    def submit_job(
+        cls, job_dir: Path, fire_at: typing.Optional[float] = None
+    ) -> "Future[Run]":
+        "Launch the admitted job in the launcher pool without waiting, the slot is released when the run exits."
+        job = cls.get_index().get(job_dir) or {}
+        future = cls.get_launcher().submit(
+            job_dir,
+            cls.get_runner_cmd(job_dir),
+            async_worker=bool(job.get("async_worker")),
+        )
+        future.add_done_callback(
+            partial(cls.handle_spawn_done, job_dir, fire_at=fire_at)
+        )
+        return future
+
+    @classmethod
+    def handle_spawn_done(
+        cls,
+        job_dir: Path,
+        future: "Future[Run]",
+        fire_at: typing.Optional[float] = None,
+    ):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"[Launch] Launch failed: {job_dir.as_posix()}, {error!r}")
+            metrics.LAUNCH_FAILURES.inc(cls.get_job_label(job_dir))
+            cls.get_admission().release(job_dir)
+            cls.admit()
+        elif fire_at is not None:
+            metrics.SPAWN_LAG.observe(max(time.time() - fire_at, 0))
+
+    @classmethod
+    def handle_run_start(cls, run: Run):
+        metrics.LAUNCH_LATENCY.observe(time.time() - run.launched_at)
+        if run.shared:
+            # the pid of the shared async worker is not a job process
+            return
+        # short-lived runs may exit before the next sample
+        items: dict = cls.get_pids_info([run.pid])
+        cls.LATEST_PROC_CACHE.update(items)
+        if cls.SAMPLER is not None:
+            cls.SAMPLER.wakeup()
+
+    @classmethod
+    def handle_run_exit(cls, run: Run):
+        cls.get_admission().release(run.job_dir)
+        if not cls.SHUTDOWN:
+            cls.admit()
+        cls.handle_run_cgroup(run)
+        cls.record_run_metrics(run)
+        if run.shared:
+            return
+        item = cls.LATEST_PROC_CACHE.get(run.pid)
+        if item:
+            item["status"] = "dead"
+            if run.end_at and item["start_at"] != "-":
+                item["end_at"] = ttime(run.end_at)
+                item["elapsed"] = read_time(
+                    run.end_at - ptime(item["start_at"]), shorten=True
+                )
+            else:
+                item["start_at"], item["end_at"], item["elapsed"] = cls.get_end_at(
+                    item
+                )
+        if cls.SAMPLER is not None:
+            cls.SAMPLER.wakeup()
+
+    @classmethod
+    def get_job_label(cls, job_dir: Path) -> str:
+        if cls.ROOT_PATH is not None and job_dir.is_relative_to(cls.ROOT_PATH):
+            return job_dir.relative_to(cls.ROOT_PATH).as_posix()
+        return job_dir.as_posix()
+
+    @classmethod
+    def get_run_record(cls, run: Run) -> typing.Optional[dict]:
+        "The result record of the exited run, None if not written."
+        if not run.pid:
+            return None
+        try:
+            item = cls.get_store().get_by_pid(run.pid, run.job_dir)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"[Store] query failed: {e!r}")
+            return None
+        if item is not None and item.get("start_at", "") < ttime(run.launched_at):
+            # the record of an older run with the same pid
+            return None
+        return item
+
+    @classmethod
+    def handle_run_cgroup(cls, run: Run):
+        """Remove the cgroup of the exited run. If it was OOM-killed by memory.max before writing the result,
+        write the record for it."""
+        if run.shared or not run.pid or cls.ROOT_PATH is None:
+            return
+        base = cgroup.get_base(cls.ROOT_PATH)
+        if base is None:
+            return
+        path = cgroup.get_run_cgroup(base, run.pid)
+        if not path.is_dir():
+            return
+        stats = cgroup.read_stats(path)
+        if not cgroup.remove(path):
+            logger.info(f"[Cgroup] busy, remove later: {path.as_posix()}")
+            cls.STALE_CGROUPS.add(path)
+        if not stats.get("memory_oom_kill") or cls.get_run_record(run) is not None:
+            return
+        end_at = run.end_at or time.time()
+        item = {
+            "start_at": ttime(run.launched_at),
+            "end_at": ttime(end_at),
+            "duration": round(end_at - run.launched_at, 3),
+            "pid": run.pid,
+            "result": None,
+            "error": repr(MemoryError("killed by the cgroup memory.max (OOM)")),
+            "cgroup": stats,
+        }
+        logger.error(f"[Cgroup] OOM killed: {run.job_dir.as_posix()}, pid={run.pid}")
+        try:
+            with open(run.job_dir / "result.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            cls.get_store().add(run.job_dir, item, run.launched_at)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[Cgroup] failed to record the OOM kill: {e!r}")
+
+    @classmethod
+    def remove_stale_cgroups(cls):
+        "Retry removing the run cgroups left by the children outliving the runner."
+        for path in list(cls.STALE_CGROUPS):
+            if cgroup.remove(path):
+                cls.STALE_CGROUPS.discard(path)
+
+    @classmethod
+    def record_run_metrics(cls, run: Run):
+        "Count the exited run by its result record, or by the exit code if no record."
+        label = cls.get_job_label(run.job_dir)
+        item = cls.get_run_record(run)
+        metrics.RUNS.inc(label)
+        if item is not None:
+            error = item.get("error")
+            duration = item.get("duration")
+        else:
+            error = "" if run.returncode in (0, None) else f"returncode={run.returncode}"
+            duration = (run.end_at - run.launched_at) if run.end_at else None
+        if error:
+            metrics.RUN_FAILURES.inc(label)
+            if error.startswith("TimeoutError"):
+                metrics.RUN_TIMEOUTS.inc(label)
+        if duration is not None:
+            metrics.RUN_DURATION.observe(duration, label)
+        stats = (item or {}).get("cgroup") or {}
+        if stats.get("memory_oom_kill"):
+            metrics.RUN_OOM_KILLS.inc(label, amount=stats["memory_oom_kill"])
+        if stats.get("cpu_throttled_usec"):
+            metrics.RUN_THROTTLED.inc(label, amount=stats["cpu_throttled_usec"] / 1e6)
+
+    @classmethod
+    def get_running_pids(cls) -> typing.List[int]:
+        """Running runner pids: the in-memory runs of the launcher,
+        and the root/pids files of the runners launched by other processes (stale files are removed)."""
+        pids = set()
+        if cls.LAUNCHER is not None:
+            pids.update(run.pid for run in cls.LAUNCHER.running() if run.pid)
+        if cls.ROOT_PATH is None:
+            raise RuntimeError("Taska.ROOT_PATH is not set")
+        pids_dir = cls.ROOT_PATH.joinpath("pids")
+        try:
+            names = os.listdir(pids_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.isdigit() or int(name) in pids:
+                continue
+            pid = int(name)
+            if is_running(pid):
+                pids.add(pid)
+            else:
+                pids_dir.joinpath(name).unlink(missing_ok=True)
+        return sorted(pids)
+
     @classmethod
     def safe_rm_dir(cls, path: typing.Union[Path, str]):
         path = Path(path)
@@ -459,11 +1134,12 @@ class Taska:
         for pid in pids:
             try:
                 proc = Process(pid)
-                status = proc.status()
-                job_dir = Path(proc.cwd()).relative_to(root_path).as_posix()
-                start_at = ttime(proc.create_time())
-                elapsed = read_time(now - proc.create_time(), shorten=True)
-                memory = read_size(proc.memory_info().rss, shorten=True)
+                with proc.oneshot():
+                    status = proc.status()
+                    job_dir = Path(proc.cwd()).relative_to(root_path).as_posix()
+                    start_at = ttime(proc.create_time())
+                    elapsed = read_time(now - proc.create_time(), shorten=True)
+                    memory = read_size(proc.memory_info().rss, shorten=True)
             except NoSuchProcess:
                 proc = None
                 job_dir = status = start_at = elapsed = memory = "-"
@@ -482,8 +1158,26 @@ class Taska:
     def get_end_at(cls, item):
         if not cls.ROOT_PATH:
             raise ValueError("Taska.ROOT_PATH is not set")
-        result_path = cls.ROOT_PATH.joinpath(item["job_dir"]).joinpath("result.jsonl")
         result = (item["start_at"], "-", "-")
+        if item["job_dir"] == "-":
+            return result
+        store = cls.get_store()
+        try:
+            data = store.get_by_pid(item["pid"], item["job_dir"])
+            if data is None and store.latest(item["job_dir"], 1):
+                # indexed job without the record of this pid, no need to scan
+                return result
+        except sqlite3.Error as e:
+            logger.warning(f"[Store] query failed: {e!r}")
+            data = None
+        if data:
+            return (
+                data["start_at"],
+                data["end_at"],
+                read_time(data["duration"], shorten=True),
+            )
+        # the results before the store existed
+        result_path = cls.ROOT_PATH.joinpath(item["job_dir"]).joinpath("result.jsonl")
         if result_path.is_file():
             with open(result_path, "r", encoding="utf-8") as f:
                 pid = item["pid"]
@@ -508,9 +1202,8 @@ def test():
     Taska.prepare_default_env(Taska.ROOT_PATH, force=False)
     ta = Taska()
     print(ta.tree)
-    print(list(ta.get_todos()))
     print(datetime.now())
-    for job, path in ta.get_todos():
+    for job, path, _ in ta.get_todos():
         print(job, "launch")
         ta.launch_job(path)
 
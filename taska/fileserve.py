@@ -0,0 +1,172 @@
+import os
+import typing
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+# compressed on the fly if the client accepts gzip
+TEXT_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-ndjson",
+)
+GZIP_MIN_SIZE = 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileReply(typing.NamedTuple):
+    "The status / headers of a file response, the body is `length` bytes of the file from `start` (gzipped or not)."
+
+    status: int
+    headers: typing.Dict[str, str]
+    start: int = 0
+    length: int = 0
+    gzip: bool = False
+
+
+def get_etag(stat: os.stat_result) -> str:
+    "Strong ETag from the inode, mtime and size."
+    return '"%x-%x-%x"' % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def parse_http_date(value: str) -> typing.Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def parse_range(value: str, size: int) -> typing.Optional[typing.Tuple[int, int]]:
+    """(start, end) of a single `bytes=` range, end excluded. None for the unsupported ranges (served in full), raise
+    ValueError if not satisfiable."""
+    unit, _, ranges = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, sep, last = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # the last N bytes
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise ValueError(f"range not satisfiable: {value}")
+    return start, end
+
+
+def is_text(content_type: str) -> bool:
+    return content_type.startswith(TEXT_TYPES)
+
+
+def is_not_modified(
+    headers: typing.Mapping[str, str], etag: str, mtime: float
+) -> bool:
+    "If-None-Match (weak comparison) first, or If-Modified-Since."
+    if_none_match = headers.get("if-none-match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [i.strip() for i in if_none_match.split(",")]
+        return etag in [i[2:] if i.startswith("W/") else i for i in tags]
+    since = parse_http_date(headers.get("if-modified-since") or "")
+    return since is not None and int(mtime) <= since
+
+
+def check_if_range(
+    headers: typing.Mapping[str, str], etag: str, mtime: float
+) -> bool:
+    "The Range applies only if If-Range matches the current file (strong ETag or the Last-Modified)."
+    if_range = headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = parse_http_date(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def prepare_file(
+    stat: os.stat_result,
+    headers: typing.Mapping[str, str],
+    content_type: str,
+    gzip=True,
+    filename="",
+) -> FileReply:
+    """The reply of a file GET by the request headers (lowercase names): 304 for the repeated pollers, 206 for Range,
+    416 for the unsatisfiable Range, or 200 with the whole file, gzipped for the text types if accepted.
+
+    filename: sent as an attachment."""
+    size = stat.st_size
+    etag = get_etag(stat)
+    text = is_text(content_type)
+    range_header = headers.get("range")
+    use_gzip = (
+        gzip
+        and text
+        and not range_header
+        and size >= GZIP_MIN_SIZE
+        and "gzip" in (headers.get("accept-encoding") or "")
+    )
+    if use_gzip:
+        # another representation, another strong ETag
+        etag = f'{etag[:-1]}-gz"'
+    reply_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if text and gzip:
+        reply_headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(headers, etag, stat.st_mtime):
+        return FileReply(304, reply_headers)
+    reply_headers["Content-Type"] = content_type
+    if filename:
+        reply_headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if range_header and check_if_range(headers, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return FileReply(
+                416,
+                {"Content-Range": f"bytes */{size}", "Content-Type": "text/plain"},
+            )
+        if byte_range:
+            start, end = byte_range
+            reply_headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            reply_headers["Content-Length"] = str(end - start)
+            return FileReply(206, reply_headers, start, end - start)
+    if use_gzip:
+        reply_headers["Content-Encoding"] = "gzip"
+        return FileReply(200, reply_headers, 0, size, True)
+    reply_headers["Content-Length"] = str(size)
+    return FileReply(200, reply_headers, 0, size)
+
+
+def iter_file_range(
+    path: Path, start: int, length: int, gzip=False, chunk_size=CHUNK_SIZE
+) -> typing.Iterator[bytes]:
+    "Read `length` bytes from `start` by chunks, the memory is bounded by chunk_size. gzip: compressed on the fly."
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    with open(path, "rb") as f:
+        f.seek(start)
+        remain = length
+        while remain > 0:
+            chunk = f.read(min(chunk_size, remain))
+            if not chunk:
+                break
+            remain -= len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
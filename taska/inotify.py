@@ -0,0 +1,128 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import typing
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+IN_DIR_CHANGES = (
+    IN_CREATE
+    | IN_DELETE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CLOSE_WRITE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyEvent(typing.NamedTuple):
+    path: str
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify:
+    """Minimal ctypes binding of linux inotify, use `Inotify.create()` to get None on unsupported platforms."""
+
+    _libc = None
+
+    def __init__(self):
+        libc = self.get_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        self.wd_paths: typing.Dict[int, str] = {}
+        self.path_wds: typing.Dict[str, int] = {}
+
+    @classmethod
+    def get_libc(cls):
+        if cls._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            cls._libc = libc
+        return cls._libc
+
+    @classmethod
+    def create(cls) -> typing.Optional["Inotify"]:
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path: str, mask: int = IN_DIR_CHANGES) -> int:
+        if path in self.path_wds:
+            return self.path_wds[path]
+        wd = self.get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        self.wd_paths[wd] = path
+        self.path_wds[path] = wd
+        return wd
+
+    def rm_watch(self, path: str):
+        wd = self.path_wds.pop(path, None)
+        if wd is not None:
+            self.wd_paths.pop(wd, None)
+            self.get_libc().inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> typing.List[InotifyEvent]:
+        "Read all pending events without blocking, IN_Q_OVERFLOW is yielded with an empty path."
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset : offset + length].rstrip(b"\0")
+                offset += length
+                path = self.wd_paths.get(wd, "")
+                if mask & IN_IGNORED:
+                    self.wd_paths.pop(wd, None)
+                    self.path_wds.pop(path, None)
+                events.append(InotifyEvent(path, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.wd_paths.clear()
+            self.path_wds.clear()
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+import traceback
+import typing
+from pathlib import Path
+
+logger = logging.getLogger("taska")
+
+
+class InstallTask:
+    "One background install of a venv, the output is written to `venv_dir/pip.log`."
+
+    LOG_NAME = "pip.log"
+
+    def __init__(self, venv_dir: Path):
+        self.venv_dir = venv_dir
+        self.log_path = venv_dir / self.LOG_NAME
+        # running / done / failed
+        self.state = "running"
+        self.started_at = time.time()
+        self.ended_at: typing.Optional[float] = None
+        self.error: typing.Optional[str] = None
+        self.lines = 0
+        self.last_line = ""
+        self.done = threading.Event()
+        self._log: typing.Optional[typing.TextIO] = None
+
+    def open(self):
+        self._log = open(self.log_path, "w", encoding="utf-8", errors="replace")
+
+    def write(self, line: str):
+        "The output callback of the install."
+        line = line.rstrip("\r\n")
+        self.lines += 1
+        if line.strip():
+            self.last_line = line
+        if self._log is not None:
+            self._log.write(f"{line}\n")
+            self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def to_dict(self) -> dict:
+        end = self.ended_at or time.time()
+        return {
+            "venv_dir": self.venv_dir.as_posix(),
+            "state": self.state,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "elapsed": round(end - self.started_at, 3),
+            "lines": self.lines,
+            "last_line": self.last_line,
+            "error": self.error,
+            "log": self.log_path.as_posix(),
+        }
+
+
+class Installer:
+    """Run the venv installs in background threads, at most one for each venv: submitting a venv which is installing
+    returns the running task.
+
+    on_start(venv_dir) / on_done(task) are called in the install thread, to hold the runs of the venv meanwhile."""
+
+    def __init__(
+        self,
+        install: typing.Callable[[Path, typing.Callable[[str], typing.Any]], typing.Any],
+        on_start: typing.Optional[typing.Callable[[Path], typing.Any]] = None,
+        on_done: typing.Optional[typing.Callable[[InstallTask], typing.Any]] = None,
+    ):
+        self.install = install
+        self.on_start = on_start
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        # venv_dir => the latest task
+        self.tasks: typing.Dict[Path, InstallTask] = {}
+
+    def submit(self, venv_dir: Path) -> typing.Tuple[InstallTask, bool]:
+        "Return (task, created), created is False if the venv is installing."
+        with self.lock:
+            task = self.tasks.get(venv_dir)
+            if task is not None and task.state == "running":
+                return task, False
+            task = InstallTask(venv_dir)
+            task.open()
+            self.tasks[venv_dir] = task
+        if self.on_start:
+            self.on_start(venv_dir)
+        threading.Thread(
+            target=self.run_task,
+            args=(task,),
+            name=f"taska-install-{venv_dir.name}",
+            daemon=True,
+        ).start()
+        return task, True
+
+    def run_task(self, task: InstallTask):
+        logger.info(f"[Install] Start: {task.venv_dir.as_posix()}")
+        try:
+            task.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] install start")
+            result = self.install(task.venv_dir, task.write)
+            task.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] install end: {result}")
+            task.state = "done"
+        except Exception as e:
+            task.write(traceback.format_exc())
+            task.error = repr(e)
+            task.state = "failed"
+            logger.error(f"[Install] Failed: {task.venv_dir.as_posix()}, {e!r}")
+        finally:
+            task.ended_at = time.time()
+            task.close()
+            task.done.set()
+            logger.info(
+                f"[Install] {task.state}: {task.venv_dir.as_posix()}, {task.ended_at - task.started_at:.1f}s"
+            )
+            if self.on_done:
+                try:
+                    self.on_done(task)
+                except Exception:
+                    logger.exception("[Install] on_done failed")
+
+    def get(self, venv_dir: Path) -> typing.Optional[InstallTask]:
+        with self.lock:
+            return self.tasks.get(venv_dir)
+
+    def is_installing(self, venv_dir: Path) -> bool:
+        task = self.get(venv_dir)
+        return task is not None and task.state == "running"
+
+    def all(self) -> typing.List[InstallTask]:
+        with self.lock:
+            return list(self.tasks.values())
@@ -0,0 +1,214 @@
+import itertools
+import logging
+import os
+import select
+import threading
+import typing
+from pathlib import Path
+
+from .inotify import (
+    IN_CREATE,
+    IN_DELETE,
+    IN_MODIFY,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    Inotify,
+)
+from .utils import tail_lines
+
+logger = logging.getLogger("taska")
+
+IN_FILE_CHANGES = IN_MODIFY | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+# callback(kind, data), kind: "data" / "rotate" / "truncate"
+Callback = typing.Callable[[str, bytes], typing.Any]
+
+
+class LogFollower:
+    "Follows one file from its end, the appended data is delivered to all the subscribers."
+
+    def __init__(self, path: Path, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.subscribers: typing.Dict[int, Callback] = {}
+        self.file: typing.Optional[typing.BinaryIO] = None
+        self.inode = 0
+        self.pos = 0
+        self.open(from_end=True)
+
+    def open(self, from_end=False) -> bool:
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return False
+        self.close()
+        self.file = f
+        stat = os.fstat(f.fileno())
+        self.inode = stat.st_ino
+        self.pos = stat.st_size if from_end else 0
+        f.seek(self.pos)
+        return True
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def dispatch(self, kind: str, data: bytes = b""):
+        for callback in list(self.subscribers.values()):
+            try:
+                callback(kind, data)
+            except Exception:
+                logger.exception(f"[LogStream] callback failed: {self.path}")
+
+    def drain(self):
+        "Deliver the data appended after `pos`."
+        f = self.file
+        if f is None:
+            return
+        if os.fstat(f.fileno()).st_size < self.pos:
+            f.seek(0)
+            self.pos = 0
+            self.dispatch("truncate")
+        while True:
+            data = f.read(self.chunk_size)
+            if not data:
+                break
+            self.pos += len(data)
+            self.dispatch("data", data)
+
+    def check(self):
+        "Handle the appended data, the truncation and the rotation (the path is a new file)."
+        self.drain()
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            # renamed to the backup, but the new file is not created yet
+            return
+        if self.file is None or inode != self.inode:
+            # the rest of the old file has been drained
+            if self.open():
+                self.dispatch("rotate")
+                self.drain()
+
+
+class LogHub:
+    """Live log streaming: one watcher thread for all the followed files, each file has one LogFollower shared by its
+    subscribers, so no thread is parked for each viewer by the hub.
+
+    The parent dirs are watched by inotify, then the RotatingFileHandler rotation (rename + create) and the truncation
+    are handled. Without inotify, the followed files are checked every `poll_interval` seconds."""
+
+    INSTANCE: typing.Optional["LogHub"] = None
+    INSTANCE_LOCK = threading.Lock()
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.lock = threading.RLock()
+        self.followers: typing.Dict[Path, LogFollower] = {}
+        # token => path
+        self.tokens: typing.Dict[int, Path] = {}
+        self.inotify = Inotify.create()
+        self._seq = itertools.count(1)
+        self._thread: typing.Optional[threading.Thread] = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    @classmethod
+    def get_instance(cls) -> "LogHub":
+        with cls.INSTANCE_LOCK:
+            if cls.INSTANCE is None:
+                cls.INSTANCE = cls()
+            return cls.INSTANCE
+
+    def subscribe(self, path: Path, callback: Callback, tail=0) -> int:
+        """Start delivering the new data of path to the callback, return the token for `unsubscribe`.
+
+        tail: deliver the last N lines first, without overlapping the followed data."""
+        path = path.resolve()
+        with self.lock:
+            follower = self.followers.get(path)
+            if follower is None:
+                follower = self.followers[path] = LogFollower(path)
+                self.watch_dir(path.parent)
+            else:
+                follower.check()
+            if tail > 0:
+                lines = tail_lines(
+                    path, tail, end=follower.pos if follower.file else None
+                )
+                if lines:
+                    callback("data", b"".join(lines))
+            token = next(self._seq)
+            follower.subscribers[token] = callback
+            self.tokens[token] = path
+            self.ensure_thread()
+        return token
+
+    def unsubscribe(self, token: int):
+        with self.lock:
+            path = self.tokens.pop(token, None)
+            follower = self.followers.get(path) if path else None
+            if follower is None:
+                return
+            follower.subscribers.pop(token, None)
+            if not follower.subscribers:
+                self.followers.pop(follower.path, None)
+                follower.close()
+                if not any(i.parent == follower.path.parent for i in self.followers):
+                    self.unwatch_dir(follower.path.parent)
+
+    def watch_dir(self, dir_path: Path):
+        if self.inotify:
+            try:
+                self.inotify.add_watch(dir_path.as_posix(), IN_FILE_CHANGES)
+            except OSError as e:
+                logger.warning(f"[LogStream] inotify disabled, fallback to polling: {e!r}")
+                self.inotify.close()
+                self.inotify = None
+
+    def unwatch_dir(self, dir_path: Path):
+        if self.inotify:
+            self.inotify.rm_watch(dir_path.as_posix())
+
+    def ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self.run_forever, name="taska-logstream", daemon=True
+            )
+            self._thread.start()
+        else:
+            os.write(self._wakeup_w, b"\0")
+
+    def run_forever(self):
+        while True:
+            inotify = self.inotify
+            fds = [self._wakeup_r, inotify] if inotify else [self._wakeup_r]
+            try:
+                readable, _, _ = select.select(fds, [], [], self.poll_interval)
+            except (OSError, ValueError):
+                # inotify closed by fallback
+                readable = []
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 1024)
+            with self.lock:
+                if not self.followers:
+                    self._thread = None
+                    return
+                if inotify is not None and inotify is self.inotify:
+                    self.handle_events(inotify)
+                else:
+                    for follower in list(self.followers.values()):
+                        follower.check()
+
+    def handle_events(self, inotify: Inotify):
+        changed: typing.Set[Path] = set()
+        for event in inotify.read_events():
+            if event.mask & IN_Q_OVERFLOW:
+                changed.update(self.followers)
+                break
+            changed.add(Path(event.path, event.name))
+        for path in changed:
+            follower = self.followers.get(path)
+            if follower is not None:
+                follower.check()
@@ -0,0 +1,261 @@
+import bisect
+import threading
+import time
+import typing
+
+LabelValues = typing.Tuple[str, ...]
+
+# seconds, from the scheduler ticks to the long jobs
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    1800.0,
+    3600.0,
+)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: typing.Sequence[str], values: typing.Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{k}="{escape_label(v)}"' for k, v in zip(names, values))
+    return "{%s}" % pairs
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, doc: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def get_key(self, labels: typing.Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} labels should be {self.label_names}")
+        return tuple(str(i) for i in labels)
+
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.doc}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, doc: str, labels: typing.Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.values: typing.Dict[LabelValues, float] = {}
+        if not self.label_names:
+            self.values[()] = 0
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, *labels: str):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels => [bucket counts (not cumulative) + the +Inf count, sum]
+        self.values: typing.Dict[
+            LabelValues, typing.Tuple[typing.List[int], typing.List[float]]
+        ] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self.get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                item = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            item[0][index] += 1
+            item[1][0] += value
+
+    def time(self, *labels: str) -> "Timer":
+        "with histogram.time(): ..."
+        return Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            items = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self.values.items()
+            ]
+        names = self.label_names + ("le",)
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(names, key + (format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: typing.Sequence[str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """In-memory metrics of this process, rendered in the Prometheus text format (0.0.4).
+
+    The values are updated by the scheduler / launcher / web threads, `render` reads no file."""
+
+    def __init__(self):
+        self.metrics: typing.List[Metric] = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(
+        self, name: str, doc: str, labels: typing.Sequence[str] = ()
+    ) -> Counter:
+        return self.register(Counter(name, doc, labels))
+
+    def gauge(
+        self, name: str, doc: str, labels: typing.Sequence[str] = ()
+    ) -> Gauge:
+        return self.register(Gauge(name, doc, labels))
+
+    def histogram(
+        self,
+        name: str,
+        doc: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+SCHEDULER_TICK = REGISTRY.histogram(
+    "taska_scheduler_tick_seconds", "Duration of the scheduler ticks (run_once)."
+)
+SCHEDULER_DRIFT = REGISTRY.histogram(
+    "taska_scheduler_drift_seconds",
+    "Delay from the fire time to the scheduler tick which popped it.",
+)
+SPAWN_LAG = REGISTRY.histogram(
+    "taska_spawn_lag_seconds",
+    "Delay from the fire time (crontab/interval) to the spawned runner, including the admission queue wait.",
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "taska_queue_wait_seconds", "Wait of the admitted runs in the admission queue."
+)
+LAUNCH_LATENCY = REGISTRY.histogram(
+    "taska_launch_latency_seconds",
+    "Delay from the launch to the runner pid being reported.",
+)
+RUNNING = REGISTRY.gauge("taska_running", "Running runs counted by the admission.")
+QUEUED = REGISTRY.gauge("taska_queued", "Runs waiting in the admission queue.")
+MAX_WORKERS = REGISTRY.gauge(
+    "taska_max_workers", "The global max_workers, 0 means unlimited."
+)
+QUEUE_DROPPED = REGISTRY.gauge(
+    "taska_queue_dropped", "Runs dropped by the full admission queue."
+)
+LAUNCH_FAILURES = REGISTRY.counter(
+    "taska_launch_failures_total", "Runs failed to launch.", ["job"]
+)
+RUNS = REGISTRY.counter("taska_runs_total", "Exited runs.", ["job"])
+RUN_FAILURES = REGISTRY.counter(
+    "taska_run_failures_total",
+    "Exited runs with an error (timeouts included).",
+    ["job"],
+)
+RUN_TIMEOUTS = REGISTRY.counter(
+    "taska_run_timeouts_total", "Runs exceeded the job timeout.", ["job"]
+)
+RUN_OOM_KILLS = REGISTRY.counter(
+    "taska_run_oom_kills_total", "OOM kills in the run cgroups (memory.max).", ["job"]
+)
+RUN_THROTTLED = REGISTRY.counter(
+    "taska_run_throttled_seconds_total",
+    "CPU throttled time of the run cgroups (cpu.max).",
+    ["job"],
+)
+RUN_DURATION = REGISTRY.histogram(
+    "taska_run_duration_seconds", "Duration of the exited runs.", ["job"]
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "taska_http_request_seconds",
+    "Latency of the web requests until the handler returns (streamed bodies not included).",
+    ["method", "route"],
+)
@@ -0,0 +1,342 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import typing
+import uuid
+import zipfile
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+
+from .utils import run_with_output
+
+logger = logging.getLogger("taska")
+
+
+class PackageStore:
+    """Content-addressed package store of the root dir: root/pkgstore, enabled if the dir exists.
+
+    - wheels/: the wheelhouse, filled by `pip wheel`, or copied in by hand to work offline
+    - packages/{sha256 of the wheel}/: the unpacked wheel, shared by all the venvs
+    - resolved/{md5}.json: the wheels resolved from requirements.txt, by the requirements and the python
+    - index.json: {wheel name: [size, mtime_ns, sha256]}, to skip hashing the unchanged wheels
+
+    A venv is assembled by hardlinking the files of its packages into the site-packages (copied if the link fails),
+    and only the changed packages are relinked when requirements.txt changes. The venv keeps its manifest in
+    `pkgstore.json`.
+    A hardlink is the same file as the store copy: writing a linked file in place would change it for every venv, so
+    the unpacked files are read-only (`a-w`) and such writes fail with PermissionError (not for root). Replacing /
+    deleting the files of a venv (pip, unlink) is not affected.
+    The requirements are resolved from the wheelhouse offline first (`pip install --dry-run --no-index --report`),
+    the index is used (by `pip wheel`, with the venv pip.conf) only for the missing wheels. Pin the versions, or
+    remove the resolved/*.json, to pick the newer releases."""
+
+    DIR_NAME = "pkgstore"
+    MANIFEST = "pkgstore.json"
+
+    def __init__(
+        self,
+        store_dir: Path,
+        output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+    ):
+        self.store_dir = store_dir
+        # receives the pip output lines
+        self.output = output
+        self.wheels_dir = store_dir / "wheels"
+        self.packages_dir = store_dir / "packages"
+        self.resolved_dir = store_dir / "resolved"
+        self.index_path = store_dir / "index.json"
+
+    @classmethod
+    def from_venv(
+        cls,
+        venv_dir: Path,
+        output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+    ) -> typing.Optional["PackageStore"]:
+        # venv => python => root
+        store_dir = venv_dir.parent.parent / cls.DIR_NAME
+        return cls(store_dir, output=output) if store_dir.is_dir() else None
+
+    @staticmethod
+    def get_python(venv_dir: Path) -> Path:
+        if sys.platform == "win32":
+            return venv_dir / "Scripts" / "python.exe"
+        return venv_dir / "bin" / "python"
+
+    @staticmethod
+    def get_base_python(venv_dir: Path) -> str:
+        "The python of the PythonDir, which has pip even if the venv has not."
+        return venv_dir.parent.joinpath("python_path").read_text(encoding="utf-8").strip()
+
+    def run_pip(self, venv_dir: Path, args: typing.List[str]) -> str:
+        env = os.environ.copy()
+        env["PIP_CONFIG_FILE"] = venv_dir.joinpath("pip.conf").resolve().as_posix()
+        cmd = [self.get_base_python(venv_dir), "-m", "pip", *args]
+        returncode, stdout = run_with_output(cmd, env=env, output=self.output)
+        if returncode != 0:
+            raise RuntimeError(f"pip failed: {cmd}\n{stdout}")
+        return stdout
+
+    def get_resolve_key(self, venv_dir: Path, requirements: str) -> str:
+        python = Path(self.get_base_python(venv_dir)).resolve()
+        stat = python.stat()
+        text = f"{requirements}\n{python.as_posix()}\n{stat.st_size}\n{stat.st_mtime_ns}"
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def resolve_offline(self, venv_dir: Path, req_file: Path) -> typing.List[str]:
+        "The wheel names of the resolved requirements, from the wheelhouse only."
+        report_path = self.store_dir / f"report-{uuid.uuid4().hex}.json"
+        try:
+            self.run_pip(
+                venv_dir,
+                [
+                    "install",
+                    "--dry-run",
+                    "--ignore-installed",
+                    "--no-index",
+                    "--find-links",
+                    self.wheels_dir.as_posix(),
+                    "--report",
+                    report_path.as_posix(),
+                    "-r",
+                    req_file.as_posix(),
+                ],
+            )
+            report = json.loads(report_path.read_text(encoding="utf-8"))
+        finally:
+            report_path.unlink(missing_ok=True)
+        names = []
+        for item in report.get("install", []):
+            path = Path(url2pathname(unquote(urlparse(item["download_info"]["url"]).path)))
+            if path.suffix != ".whl" or path.parent.resolve() != self.wheels_dir.resolve():
+                raise ValueError(f"not a wheel of the wheelhouse: {path}")
+            names.append(path.name)
+        return sorted(names)
+
+    def resolve(self, venv_dir: Path, req_file: Path) -> typing.List[str]:
+        "Cached by the requirements and the python, `pip wheel` only if the wheelhouse can not resolve them."
+        requirements = req_file.read_text(encoding="utf-8")
+        cache_path = self.resolved_dir / f"{self.get_resolve_key(venv_dir, requirements)}.json"
+        if cache_path.is_file():
+            names = json.loads(cache_path.read_text(encoding="utf-8"))
+            if all(self.wheels_dir.joinpath(name).is_file() for name in names):
+                return names
+        self.wheels_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            names = self.resolve_offline(venv_dir, req_file)
+        except RuntimeError:
+            logger.info(f"[PkgStore] Fetching the wheels: {req_file.as_posix()}")
+            self.run_pip(
+                venv_dir,
+                [
+                    "wheel",
+                    "--wheel-dir",
+                    self.wheels_dir.as_posix(),
+                    "--find-links",
+                    self.wheels_dir.as_posix(),
+                    "-r",
+                    req_file.as_posix(),
+                ],
+            )
+            names = self.resolve_offline(venv_dir, req_file)
+        self.resolved_dir.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(names), encoding="utf-8")
+        return names
+
+    def load_index(self) -> dict:
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def get_hashes(self, names: typing.List[str]) -> typing.Dict[str, str]:
+        "{wheel name: sha256}"
+        index = self.load_index()
+        result = {}
+        changed = False
+        for name in names:
+            path = self.wheels_dir / name
+            stat = path.stat()
+            cached = index.get(name)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                result[name] = cached[2]
+                continue
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024**2), b""):
+                    sha.update(chunk)
+            result[name] = sha.hexdigest()
+            index[name] = [stat.st_size, stat.st_mtime_ns, result[name]]
+            changed = True
+        if changed:
+            tmp = self.index_path.with_name(f"index-{uuid.uuid4().hex}.json")
+            tmp.write_text(json.dumps(index), encoding="utf-8")
+            os.replace(tmp, self.index_path)
+        return result
+
+    def unpack(self, name: str, digest: str) -> Path:
+        """Unpack the wheel to packages/{digest} once: the files of site-packages, and the scripts of `*.data/scripts`
+        to `.scripts`, the other `*.data` dirs (headers / data) are skipped."""
+        target = self.packages_dir / digest
+        if target.is_dir():
+            return target
+        self.packages_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.packages_dir / f"tmp-{uuid.uuid4().hex}"
+        try:
+            with zipfile.ZipFile(self.wheels_dir / name) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    parts = info.filename.split("/")
+                    if info.filename.startswith("/") or ".." in parts:
+                        raise ValueError(f"bad path in {name}: {info.filename}")
+                    if parts[0].endswith(".data") and len(parts) > 2:
+                        if parts[1] in ("purelib", "platlib"):
+                            parts = parts[2:]
+                        elif parts[1] == "scripts":
+                            parts = [".scripts", *parts[2:]]
+                        else:
+                            continue
+                    path = tmp.joinpath(*parts)
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    with zf.open(info) as src, open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    mode = info.external_attr >> 16
+                    # shared by the hardlinks of all the venvs, never written in place
+                    path.chmod(0o555 if mode & 0o111 else 0o444)
+            try:
+                os.replace(tmp, target)
+            except OSError:
+                # unpacked by another process
+                if not target.is_dir():
+                    raise
+        finally:
+            if tmp.is_dir():
+                shutil.rmtree(tmp, ignore_errors=True)
+        return target
+
+    @staticmethod
+    def get_site_packages(python: Path) -> Path:
+        output = subprocess.check_output(
+            [python.as_posix(), "-c", "import sysconfig; print(sysconfig.get_path('purelib'))"],
+            encoding="utf-8",
+        )
+        return Path(output.strip())
+
+    @staticmethod
+    def link_file(src: Path, dst: Path):
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        try:
+            os.link(src, dst)
+        except OSError:
+            # cross device, or not supported: an own copy, writable
+            shutil.copy2(src, dst)
+            dst.chmod(dst.stat().st_mode | 0o200)
+
+    def link_package(self, package_dir: Path, site_dir: Path, bin_dir: Path, python: Path) -> list:
+        "Return the linked paths (relative to the venv dir)"
+        venv_dir = bin_dir.parent
+        files = []
+        for path in package_dir.rglob("*"):
+            if path.is_dir():
+                continue
+            rel = path.relative_to(package_dir)
+            if rel.parts[0] == ".scripts":
+                dst = bin_dir.joinpath(*rel.parts[1:])
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                self.write_script(path, dst, python)
+            else:
+                dst = site_dir / rel
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                self.link_file(path, dst)
+            files.append(dst.relative_to(venv_dir).as_posix())
+        for name, target in self.get_console_scripts(package_dir):
+            dst = bin_dir / name
+            module, _, attr = target.partition(":")
+            dst.write_text(
+                f"#!{python.as_posix()}\nimport sys\nfrom {module.strip()} import {attr.strip().split('.')[0]}\n"
+                f"if __name__ == '__main__':\n    sys.exit({attr.strip()}())\n",
+                encoding="utf-8",
+            )
+            dst.chmod(0o755)
+            files.append(dst.relative_to(venv_dir).as_posix())
+        return files
+
+    @staticmethod
+    def write_script(src: Path, dst: Path, python: Path):
+        "Copy the script, with the `#!python` shebang of the wheel replaced by the venv python."
+        data = src.read_bytes()
+        if data.startswith(b"#!python"):
+            data = b"#!" + python.as_posix().encode() + data[len(b"#!python") :]
+        if dst.exists():
+            dst.unlink()
+        dst.write_bytes(data)
+        dst.chmod(0o755)
+
+    @staticmethod
+    def get_console_scripts(package_dir: Path) -> typing.List[typing.Tuple[str, str]]:
+        result = []
+        for path in package_dir.glob("*.dist-info/entry_points.txt"):
+            section = ""
+            for line in path.read_text(encoding="utf-8").splitlines():
+                line = line.strip()
+                if line.startswith("["):
+                    section = line.strip("[]")
+                elif section == "console_scripts" and "=" in line:
+                    name, _, target = line.partition("=")
+                    if re.match(r"^[\w.-]+$", name.strip()):
+                        result.append((name.strip(), target.strip()))
+        return result
+
+    @staticmethod
+    def remove_files(venv_dir: Path, files: typing.List[str]):
+        dirs = set()
+        for rel in files:
+            path = venv_dir / rel
+            path.unlink(missing_ok=True)
+            dirs.add(path.parent)
+        # the deepest first, with the __pycache__ of the imports
+        for dir_path in sorted(dirs, key=lambda i: len(i.parts), reverse=True):
+            while dir_path != venv_dir and dir_path.is_dir():
+                shutil.rmtree(dir_path / "__pycache__", ignore_errors=True)
+                try:
+                    dir_path.rmdir()
+                except OSError:
+                    break
+                dir_path = dir_path.parent
+
+    def install(self, venv_dir: Path) -> typing.List[str]:
+        "Assemble the site-packages of the venv from the store by requirements.txt, return the wheel names."
+        req_file = venv_dir / "requirements.txt"
+        requirements = req_file.read_text(encoding="utf-8") if req_file.is_file() else ""
+        names = self.resolve(venv_dir, req_file) if requirements.strip() else []
+        if self.output is not None:
+            self.output(f"[PkgStore] resolved: {', '.join(names) or '-'}")
+        hashes = self.get_hashes(names)
+        manifest_path = venv_dir / self.MANIFEST
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            manifest = {}
+        python = self.get_python(venv_dir)
+        site_dir = Path(manifest.get("site_packages") or self.get_site_packages(python))
+        # {sha256: {"wheel": name, "files": [...]}}
+        packages: dict = manifest.get("packages", {})
+        for digest in list(packages):
+            if digest not in hashes.values():
+                self.remove_files(venv_dir, packages.pop(digest)["files"])
+        for name, digest in hashes.items():
+            if digest in packages:
+                continue
+            package_dir = self.unpack(name, digest)
+            files = self.link_package(package_dir, site_dir, python.parent, python)
+            packages[digest] = {"wheel": name, "files": files}
+        manifest = {"site_packages": site_dir.as_posix(), "packages": packages}
+        manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        return names
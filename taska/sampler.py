@@ -0,0 +1,87 @@
+import json
+import logging
+import threading
+import time
+import typing
+from hashlib import md5
+
+logger = logging.getLogger("taska")
+
+
+class Snapshot(typing.NamedTuple):
+    data: dict
+    # the JSON body of data
+    body: bytes
+    etag: str
+    sampled_at: float
+
+
+class ProcessSampler:
+    """Refresh the process stats in one background thread every `interval` seconds (or on `wakeup()`), the readers get
+    the latest Snapshot without any psutil call.
+
+    The etag is the hash of the body, so it is unchanged if nothing changed."""
+
+    def __init__(
+        self,
+        sample: typing.Callable[[], dict],
+        interval: float = 2.0,
+        min_interval: float = 0.2,
+    ):
+        self.sample = sample
+        self.interval = interval
+        # merge the wakeups of a burst of runs
+        self.min_interval = min(min_interval, interval)
+        self.snapshot: typing.Optional[Snapshot] = None
+        self.ready = threading.Event()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: typing.Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(
+                    target=self.run_forever, name="taska-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def wakeup(self):
+        "Sample at once, such as a run started or exited."
+        self._wakeup.set()
+
+    def get(self, timeout: float = 10) -> typing.Optional[Snapshot]:
+        "The latest snapshot, waits for the first one."
+        if self.snapshot is None:
+            self.start()
+            self.ready.wait(timeout)
+        return self.snapshot
+
+    def refresh(self):
+        data = self.sample()
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        old = self.snapshot
+        if old is not None and old.body == body:
+            etag = old.etag
+        else:
+            etag = '"%s"' % md5(body).hexdigest()
+        self.snapshot = Snapshot(data, body, etag, time.time())
+        self.ready.set()
+
+    def run_forever(self):
+        while not self._stopped:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("[Sampler] sample failed")
+            time.sleep(self.min_interval)
+            self._wakeup.wait(self.interval - self.min_interval)
+            self._wakeup.clear()
+        with self._lock:
+            self._thread = None
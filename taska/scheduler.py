@@ -0,0 +1,359 @@
+import logging
+import math
+import typing
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger("taska")
+
+
+class CronMatcher:
+    """Precompiled crontab, each field is a bitmask.
+
+    Same syntax as morebuiltins.date.Crontab: `*`, `*/2`, `1-5`, `1-5/2`, `1,3,5`,
+    weekday 0/7 is Sunday, and day / weekday should be both matched.
+    An optional leading seconds field is supported: `*/5 * * * * *` means every 5 seconds.
+
+    >>> m = CronMatcher.compile("*/15 * * * *")
+    >>> m.next_fire(datetime(2023, 2, 1, 0, 7, 30))
+    datetime.datetime(2023, 2, 1, 0, 15)
+    >>> CronMatcher.compile("0 0 1 11 *").next_fire(datetime(2023, 2, 1))
+    datetime.datetime(2023, 11, 1, 0, 0)
+    >>> CronMatcher.compile("*/10 * * * * *").next_fire(datetime(2023, 2, 1, 0, 0, 55))
+    datetime.datetime(2023, 2, 1, 0, 1)
+    """
+
+    # (min, max) of second, minute, hour, day, month, weekday
+    RANGES = [(0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    # stop searching after 8 years (leap day + weekday)
+    MAX_DAYS = 366 * 8
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        fields = pattern.split()
+        if len(fields) == len(self.RANGES) - 1:
+            fields.insert(0, "0")
+        if len(fields) != len(self.RANGES):
+            raise ValueError(f"Invalid crontab: {pattern!r}")
+        masks = [
+            self.parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self.RANGES)
+        ]
+        self.seconds, self.minutes, self.hours, self.days, self.months, weeks = masks
+        # crontab: 0, 7 is Sunday; python: Monday is 0 and Sunday is 6
+        self.weekdays = 0
+        for cron_weekday in range(8):
+            if weeks >> cron_weekday & 1:
+                self.weekdays |= 1 << (cron_weekday - 1) % 7
+        if not all(masks):
+            raise ValueError(f"Invalid crontab: {pattern!r}")
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def compile(cls, pattern: str) -> "CronMatcher":
+        return cls(pattern)
+
+    @staticmethod
+    def parse_field(value: str, low: int, high: int) -> int:
+        mask = 0
+        for item in value.split(","):
+            item, _, step_str = item.partition("/")
+            step = int(step_str) if step_str else 1
+            if step < 1:
+                raise ValueError(f"Invalid step: {value!r}")
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = map(int, item.split("-", 1))
+            else:
+                start = int(item)
+                end = high if step_str else start
+            for i in range(max(start, low), min(end, high) + 1, step):
+                mask |= 1 << i
+        return mask
+
+    def match(self, dt: datetime) -> bool:
+        return bool(
+            self.seconds >> dt.second & 1
+            and self.minutes >> dt.minute & 1
+            and self.hours >> dt.hour & 1
+            and self.days >> dt.day & 1
+            and self.months >> dt.month & 1
+            and self.weekdays >> dt.weekday() & 1
+        )
+
+    @staticmethod
+    def next_bit(mask: int, start: int) -> int:
+        "Index of the lowest set bit >= start, or -1."
+        rest = mask >> start
+        if not rest:
+            return -1
+        return start + (rest & -rest).bit_length() - 1
+
+    def next_fire(self, after: datetime) -> typing.Optional[datetime]:
+        "The first matched second strictly after `after`, None if never matched."
+        dt = after.replace(microsecond=0) + timedelta(seconds=1)
+        deadline = dt + timedelta(days=self.MAX_DAYS)
+        while dt < deadline:
+            if not self.months >> dt.month & 1:
+                dt = dt.replace(day=28, hour=0, minute=0, second=0) + timedelta(days=4)
+                dt = dt.replace(day=1)
+            elif not (self.days >> dt.day & 1 and self.weekdays >> dt.weekday() & 1):
+                dt = dt.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+            else:
+                hour = self.next_bit(self.hours, dt.hour)
+                if hour < 0:
+                    dt = dt.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+                    continue
+                if hour != dt.hour:
+                    dt = dt.replace(hour=hour, minute=0, second=0)
+                minute = self.next_bit(self.minutes, dt.minute)
+                if minute < 0:
+                    dt = dt.replace(minute=0, second=0) + timedelta(hours=1)
+                    continue
+                if minute != dt.minute:
+                    dt = dt.replace(minute=minute, second=0)
+                second = self.next_bit(self.seconds, dt.second)
+                if second >= 0:
+                    return dt.replace(second=second)
+                dt = dt.replace(second=0) + timedelta(minutes=1)
+        return None
+
+
+class IntervalMatcher:
+    """Fire every `interval` seconds, aligned to the epoch.
+
+    >>> IntervalMatcher(5).next_fire(datetime(2023, 2, 1, 0, 0, 3))
+    datetime.datetime(2023, 2, 1, 0, 0, 5)
+    """
+
+    def __init__(self, interval: float):
+        if interval <= 0:
+            raise ValueError(f"Invalid interval: {interval!r}")
+        self.interval = interval
+
+    def next_fire(self, after: datetime) -> datetime:
+        ts = (math.floor(after.timestamp() / self.interval) + 1) * self.interval
+        return datetime.fromtimestamp(ts)
+
+
+class TimerWheel:
+    """Hierarchical timer wheel, with O(1) add / remove.
+
+    4 levels * 256 slots, resolution 1ms: level 0 covers 0.256s, level 3 covers 49 days,
+    the later timers are kept in the overflow dict.
+    `advance` jumps over the empty slots, so it costs O(timers + non-empty slots)."""
+
+    SLOT_BITS = 8
+    SLOTS = 1 << SLOT_BITS
+    SLOT_MASK = SLOTS - 1
+    LEVELS = 4
+
+    def __init__(self, resolution=0.001, now: typing.Optional[float] = None):
+        self.resolution = resolution
+        # all ticks <= current have been processed
+        self.current = int((datetime.now().timestamp() if now is None else now) / resolution)
+        self.wheels: typing.List[typing.List[typing.Dict[typing.Hashable, int]]] = [
+            [{} for _ in range(self.SLOTS)] for _ in range(self.LEVELS)
+        ]
+        # bitmask of the non-empty slots of each level
+        self.masks = [0] * self.LEVELS
+        self.overflow: typing.Dict[typing.Hashable, int] = {}
+        self.expired: typing.Dict[typing.Hashable, int] = {}
+        # key => (level, slot), level -1 is overflow, -2 is expired
+        self.locations: typing.Dict[typing.Hashable, typing.Tuple[int, int]] = {}
+        self.deadlines: typing.Dict[typing.Hashable, float] = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def add(self, key: typing.Hashable, deadline: float):
+        self.remove(key)
+        self.deadlines[key] = deadline
+        # never fire before the deadline
+        self._place(key, math.ceil(round(deadline / self.resolution, 6)))
+
+    def remove(self, key: typing.Hashable):
+        location = self.locations.pop(key, None)
+        if location is None:
+            return
+        self.deadlines.pop(key, None)
+        level, slot = location
+        if level == -1:
+            self.overflow.pop(key, None)
+        elif level == -2:
+            self.expired.pop(key, None)
+        else:
+            bucket = self.wheels[level][slot]
+            bucket.pop(key, None)
+            if not bucket:
+                self.masks[level] &= ~(1 << slot)
+
+    def _place(self, key, expires: int):
+        delta = expires - self.current
+        if delta <= 0:
+            self.expired[key] = expires
+            self.locations[key] = (-2, 0)
+            return
+        for level in range(self.LEVELS):
+            if delta < 1 << (self.SLOT_BITS * (level + 1)):
+                slot = (expires >> (self.SLOT_BITS * level)) & self.SLOT_MASK
+                self.wheels[level][slot][key] = expires
+                self.masks[level] |= 1 << slot
+                self.locations[key] = (level, slot)
+                return
+        self.overflow[key] = expires
+        self.locations[key] = (-1, 0)
+
+    def next_tick(self) -> int:
+        "The next tick which has timers to fire or to cascade."
+        if self.expired:
+            return self.current
+        result = ((self.current >> (self.SLOT_BITS * self.LEVELS)) + 1) << (
+            self.SLOT_BITS * self.LEVELS
+        )
+        for level in range(self.LEVELS):
+            mask = self.masks[level]
+            if not mask:
+                continue
+            shift = self.SLOT_BITS * level
+            index = (self.current >> shift) & self.SLOT_MASK
+            block = self.current >> (shift + self.SLOT_BITS) << (shift + self.SLOT_BITS)
+            later = mask >> (index + 1)
+            if later:
+                slot = index + 1 + (later & -later).bit_length() - 1
+            else:
+                # wrapped to the next block
+                slot = (mask & -mask).bit_length() - 1
+                block += 1 << (shift + self.SLOT_BITS)
+            result = min(result, block + (slot << shift))
+        return result
+
+    def next_deadline(self) -> typing.Optional[float]:
+        "The time to wake up, it may be earlier than the real deadline for cascading."
+        if not self.locations:
+            return None
+        return self.next_tick() * self.resolution
+
+    def _cascade(self, tick: int):
+        top_shift = self.SLOT_BITS * self.LEVELS
+        if self.overflow and tick & ((1 << top_shift) - 1) == 0:
+            overflow, self.overflow = self.overflow, {}
+            for key, expires in overflow.items():
+                self._place(key, expires)
+        for level in range(self.LEVELS - 1, 0, -1):
+            shift = self.SLOT_BITS * level
+            if tick & ((1 << shift) - 1):
+                continue
+            slot = (tick >> shift) & self.SLOT_MASK
+            bucket = self.wheels[level][slot]
+            if bucket:
+                self.wheels[level][slot] = {}
+                self.masks[level] &= ~(1 << slot)
+                for key, expires in bucket.items():
+                    self._place(key, expires)
+
+    def advance(self, now: float) -> typing.List[typing.Tuple[typing.Hashable, float]]:
+        """Move to `now`, pop and return the expired (key, deadline).
+
+        The ticks are rounded like `add`, so advancing to `next_deadline` fires the due timer:
+
+        >>> wheel = TimerWheel(now=1024.5)
+        >>> wheel.add("job", 1024.512)
+        >>> wheel.advance(wheel.next_deadline())
+        [('job', 1024.512)]
+        """
+        target = int(round(now / self.resolution, 6))
+        due = list(self.expired)
+        self.expired.clear()
+        while True:
+            tick = self.next_tick()
+            if tick > target:
+                break
+            self.current = tick
+            self._cascade(tick)
+            slot = tick & self.SLOT_MASK
+            bucket = self.wheels[0][slot]
+            if bucket:
+                self.wheels[0][slot] = {}
+                self.masks[0] &= ~(1 << slot)
+                for key, expires in bucket.items():
+                    if expires <= tick:
+                        due.append(key)
+                    else:
+                        self._place(key, expires)
+            due.extend(self.expired)
+            self.expired.clear()
+        self.current = max(self.current, target)
+        result = []
+        for key in due:
+            self.locations.pop(key, None)
+            result.append((key, self.deadlines.pop(key)))
+        return result
+
+
+class Scheduler:
+    """Keep the next fire time of each job in a timer wheel, each tick only pops the due jobs."""
+
+    def __init__(self, now: typing.Optional[datetime] = None):
+        self.wheel = TimerWheel(now=(now or datetime.now()).timestamp())
+        # job_dir => (matcher, (crontab, interval, enable))
+        self.entries: typing.Dict[
+            Path,
+            typing.Tuple[typing.Union[CronMatcher, IntervalMatcher], tuple],
+        ] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def get_matcher(job: dict):
+        "interval (seconds) takes precedence over crontab."
+        if job.get("interval"):
+            return IntervalMatcher(job["interval"])
+        elif job["crontab"]:
+            return CronMatcher.compile(job["crontab"])
+        return None
+
+    def update(self, job_dir: Path, job: typing.Optional[dict], now: datetime):
+        "Add / update / remove the job, nothing changes if crontab, interval and enable are the same."
+        key = (job["crontab"], job.get("interval"), job["enable"]) if job else None
+        entry = self.entries.get(job_dir)
+        if entry and entry[1] == key:
+            return
+        self.entries.pop(job_dir, None)
+        self.wheel.remove(job_dir)
+        if not job or not job["enable"]:
+            return
+        try:
+            matcher = self.get_matcher(job)
+        except ValueError as e:
+            logger.warning(f"[Scheduler] {job_dir.as_posix()}: {e!r}")
+            return
+        if matcher is None:
+            return
+        self.entries[job_dir] = (matcher, key)
+        self.push(job_dir, matcher.next_fire(now))
+
+    def push(self, job_dir: Path, fire_at: typing.Optional[datetime]):
+        if fire_at is not None:
+            self.wheel.add(job_dir, fire_at.timestamp())
+
+    def next_fire_at(self) -> typing.Optional[float]:
+        return self.wheel.next_deadline()
+
+    def pop_due(self, now: datetime) -> typing.List[typing.Tuple[Path, float]]:
+        "Pop the (job_dir, fire_at timestamp) of fire_at <= now, and push their next fire time (missed runs are skipped)."
+        result = []
+        for job_dir, deadline in self.wheel.advance(now.timestamp()):
+            entry = self.entries.get(job_dir)
+            if not entry:
+                continue
+            result.append((job_dir, deadline))
+            fire_at = datetime.fromtimestamp(deadline)
+            self.push(job_dir, entry[0].next_fire(max(fire_at, now)))
+        return result
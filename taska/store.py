@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import threading
+import typing
+from pathlib import Path
+
+# keep in sync with `save_result_db` of templates/runner.py, checked by tests/test_runner.py
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    job_dir TEXT NOT NULL,
+    pid INTEGER,
+    start_ts REAL,
+    start_at TEXT,
+    end_at TEXT,
+    duration REAL,
+    error TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS results_pid ON results (pid, start_ts);
+CREATE INDEX IF NOT EXISTS results_job ON results (job_dir, start_ts);
+CREATE INDEX IF NOT EXISTS results_start ON results (start_ts);
+"""
+
+
+class ResultStore:
+    """Indexed copy of the result.jsonl records: root/results/results.db, SQLite in WAL mode.
+
+    The runners insert a row after writing result.jsonl (each job keeps the latest 1000 rows), `job_dir` is relative to
+    the root dir.
+    Lookups by pid, the latest N of a job and time ranges use the indexes instead of scanning the files."""
+
+    DB_PATH = "results/results.db"
+
+    def __init__(self, root_dir: Path):
+        self.root_dir = root_dir
+        self.db_path = root_dir / self.DB_PATH
+        self.local = threading.local()
+
+    def get_conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path.as_posix(), timeout=5)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def get_job_key(self, job_dir: typing.Union[Path, str]) -> str:
+        job_dir = Path(job_dir)
+        if job_dir.is_absolute():
+            job_dir = job_dir.relative_to(self.root_dir)
+        return job_dir.as_posix()
+
+    def to_dict(self, row: sqlite3.Row) -> dict:
+        return json.loads(row["data"])
+
+    def get_by_pid(
+        self, pid: int, job_dir: typing.Union[Path, str, None] = None
+    ) -> typing.Optional[dict]:
+        "The latest record of the pid, pids may be reused so job_dir is recommended."
+        if not self.db_path.is_file():
+            return None
+        if job_dir is None:
+            sql = "SELECT data FROM results WHERE pid = ? ORDER BY start_ts DESC LIMIT 1"
+            args: tuple = (pid,)
+        else:
+            sql = "SELECT data FROM results WHERE pid = ? AND job_dir = ? ORDER BY start_ts DESC LIMIT 1"
+            args = (pid, self.get_job_key(job_dir))
+        row = self.get_conn().execute(sql, args).fetchone()
+        return self.to_dict(row) if row else None
+
+    def latest(self, job_dir: typing.Union[Path, str], n=10) -> typing.List[dict]:
+        "The latest n records of the job, newest first."
+        if not self.db_path.is_file():
+            return []
+        rows = self.get_conn().execute(
+            "SELECT data FROM results WHERE job_dir = ? ORDER BY start_ts DESC LIMIT ?",
+            (self.get_job_key(job_dir), n),
+        )
+        return [self.to_dict(row) for row in rows]
+
+    def between(
+        self,
+        start_ts: float,
+        end_ts: float,
+        job_dir: typing.Union[Path, str, None] = None,
+        limit=1000,
+    ) -> typing.List[dict]:
+        "Records started in [start_ts, end_ts), of one job or all jobs, oldest first."
+        if not self.db_path.is_file():
+            return []
+        if job_dir is None:
+            sql = "SELECT data FROM results WHERE start_ts >= ? AND start_ts < ? ORDER BY start_ts LIMIT ?"
+            args: tuple = (start_ts, end_ts, limit)
+        else:
+            sql = "SELECT data FROM results WHERE job_dir = ? AND start_ts >= ? AND start_ts < ? ORDER BY start_ts LIMIT ?"
+            args = (self.get_job_key(job_dir), start_ts, end_ts, limit)
+        return [self.to_dict(row) for row in self.get_conn().execute(sql, args)]
+
+    def usage_by_job(self, since_ts: float, limit=100) -> typing.List[dict]:
+        "Per-job aggregates of the run usage (runner `getrusage`) since the time, the most CPU first."
+        if not self.db_path.is_file():
+            return []
+        sql = """
+        SELECT job_dir, runs, duration, utime, stime, children_cpu, maxrss, children_maxrss, nvcsw, nivcsw, io_blocks
+        FROM (
+            SELECT
+                job_dir,
+                count(*) AS runs,
+                sum(duration) AS duration,
+                sum(json_extract(data, '$.usage.utime')) AS utime,
+                sum(json_extract(data, '$.usage.stime')) AS stime,
+                sum(json_extract(data, '$.usage.children.utime') + json_extract(data, '$.usage.children.stime')) AS children_cpu,
+                max(json_extract(data, '$.usage.maxrss')) AS maxrss,
+                max(json_extract(data, '$.usage.children.maxrss')) AS children_maxrss,
+                sum(json_extract(data, '$.usage.nvcsw')) AS nvcsw,
+                sum(json_extract(data, '$.usage.nivcsw')) AS nivcsw,
+                sum(json_extract(data, '$.usage.inblock') + json_extract(data, '$.usage.oublock')) AS io_blocks
+            FROM results
+            WHERE start_ts >= ?
+            GROUP BY job_dir
+        )
+        ORDER BY coalesce(utime, 0) + coalesce(stime, 0) + coalesce(children_cpu, 0) DESC
+        LIMIT ?
+        """
+        rows = self.get_conn().execute(sql, (since_ts, limit))
+        return [dict(row) for row in rows]
+
+    def add(self, job_dir: typing.Union[Path, str], item: dict, start_ts: float):
+        "Insert a record written by the supervisor, such as the runs killed before writing their own."
+        with self.get_conn() as conn:
+            conn.execute(
+                "INSERT INTO results (job_dir, pid, start_ts, start_at, end_at, duration, error, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.get_job_key(job_dir),
+                    item.get("pid"),
+                    start_ts,
+                    item.get("start_at"),
+                    item.get("end_at"),
+                    item.get("duration"),
+                    item.get("error"),
+                    json.dumps(item, ensure_ascii=False),
+                ),
+            )
@@ -0,0 +1,548 @@
+import array
+import json
+import logging
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+import typing
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger("taska")
+
+# the runner writes its pid to this fd, and keeps it open until exit
+PID_FD_ENV = "TASKA_PID_FD"
+
+
+class Run:
+    "A launched runner process."
+
+    def __init__(
+        self,
+        job_dir: Path,
+        proc: typing.Optional[subprocess.Popen],
+        launched_at: float,
+    ):
+        self.job_dir = job_dir
+        self.proc = proc
+        self.launched_at = launched_at
+        # runner pid, may differ from proc.pid on windows (venv launcher),
+        # proc is None if forked by the forkserver
+        self.pid: typing.Optional[int] = None
+        # run in the shared async worker, pid is the worker pid
+        self.shared = False
+        self.returncode: typing.Optional[int] = None
+        self.end_at: typing.Optional[float] = None
+        # utime / stime / maxrss, only for the own children
+        self.rusage: typing.Optional[dict] = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self._buffer = b""
+        self._pipe_fd = -1
+        self._pidfd = -1
+        self._exiting = False
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def __repr__(self):
+        return f"Run(job_dir={self.job_dir.as_posix()!r}, pid={self.pid}, returncode={self.returncode})"
+
+
+class WorkerProcess:
+    """Client of a long-lived process started from a template script, which accepts jobs over a socketpair.
+
+    Request: {"cwd": job_dir} + the pid pipe fd (SCM_RIGHTS); Response: {"pid": pid} + the pidfd of the forked child
+    (SCM_RIGHTS, if supported) or {"error": "..."}.
+    It is restarted if the stamp changed, or the server asked for a restart."""
+
+    script_name = ""
+
+    def __init__(self, target_dir: Path, python: str, script: Path):
+        self.target_dir = target_dir
+        self.python = python
+        self.script = script
+        self.lock = threading.Lock()
+        self.proc: typing.Optional[subprocess.Popen] = None
+        self.sock: typing.Optional[socket.socket] = None
+        self.stamp: typing.Optional[tuple] = None
+
+    def start(self):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.proc = subprocess.Popen(
+                [
+                    self.python,
+                    self.script.as_posix(),
+                    str(child.fileno()),
+                    self.target_dir.as_posix(),
+                ],
+                start_new_session=True,
+                cwd=self.target_dir.as_posix(),
+                pass_fds=(child.fileno(),),
+            )
+        except BaseException:
+            parent.close()
+            raise
+        finally:
+            child.close()
+        self.sock = parent
+        logger.info(
+            f"[{self.__class__.__name__}] started pid={self.proc.pid}: {self.target_dir.as_posix()}"
+        )
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if self.proc:
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            self.proc = None
+
+    def submit(self, job_dir: Path, pid_fd: int, stamp: tuple) -> typing.Tuple[int, int]:
+        "Send the job_dir and the pid pipe, return (the pid which runs the job, its pidfd or -1)."
+        with self.lock:
+            for _ in range(2):
+                if self.stamp != stamp or not self.sock:
+                    self.stop()
+                    self.start()
+                    self.stamp = stamp
+                assert self.sock is not None
+                msg = json.dumps({"cwd": job_dir.as_posix()}).encode()
+                fds = array.array("i", [pid_fd])
+                try:
+                    self.sock.sendmsg(
+                        [msg], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)]
+                    )
+                    data, fds = self.recv()
+                except OSError:
+                    data, fds = b"", []
+                response = json.loads(data) if data else {"error": "closed"}
+                for fd in fds[1:]:
+                    os.close(fd)
+                pidfd = fds[0] if fds else -1
+                if "pid" in response:
+                    return response["pid"], pidfd
+                if pidfd >= 0:
+                    os.close(pidfd)
+                # stale or dead server, restart and retry once
+                logger.info(
+                    f"[{self.__class__.__name__}] restart {self.target_dir.as_posix()}: {response}"
+                )
+                self.stamp = None
+            raise RuntimeError(f"{self.script_name} failed: {response}")
+
+
+    def recv(self) -> typing.Tuple[bytes, typing.List[int]]:
+        assert self.sock is not None
+        fds = array.array("i")
+        data, ancdata, _, _ = self.sock.recvmsg(65536, socket.CMSG_LEN(fds.itemsize))
+        for level, _type, cmsg in ancdata:
+            if level == socket.SOL_SOCKET and _type == socket.SCM_RIGHTS:
+                fds.frombytes(cmsg[: len(cmsg) - (len(cmsg) % fds.itemsize)])
+        return data, list(fds)
+
+
+class ForkServer(WorkerProcess):
+    """The warm `forkserver.py` process of a venv, opt-in by `venv_dir/forkserver.json`:
+
+    {"enable": 1, "preload": ["requests", "workspace1:mycode"]}
+
+    The server has imported runner.py and the preload modules, each job is forked from it,
+    and the runner semantics (singleton, max_workers, rlimit, result logging) are unchanged.
+    It is restarted if the config / requirements.md5 / preloaded workspace modules changed."""
+
+    CONFIG_NAME = "forkserver.json"
+    script_name = "forkserver.py"
+
+    @classmethod
+    def get_stamp(cls, venv_dir: Path) -> typing.Optional[tuple]:
+        "None if not enabled, else the mtimes of the files which need a restart."
+        if sys.platform == "win32":
+            return None
+        config_path = venv_dir / cls.CONFIG_NAME
+        try:
+            config_mtime = config_path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return (config_mtime, get_mtime(venv_dir / "requirements.md5"))
+
+    @classmethod
+    def is_enabled(cls, venv_dir: Path) -> bool:
+        try:
+            config = json.loads(
+                venv_dir.joinpath(cls.CONFIG_NAME).read_text(encoding="utf-8")
+            )
+            return bool(config.get("enable"))
+        except (OSError, ValueError, AttributeError):
+            return False
+
+
+class AsyncWorker(WorkerProcess):
+    """The shared `async_worker.py` process of a workspace, for the jobs with meta `async_worker`=1.
+
+    Coroutine entrypoints run as tasks of one event loop, each with its own timeout, result record and stdout capture.
+    It is restarted if the requirements.md5 changed."""
+
+    script_name = "async_worker.py"
+
+    @classmethod
+    def get_stamp(cls, workspace_dir: Path) -> tuple:
+        return (get_mtime(workspace_dir.parent.parent / "requirements.md5"),)
+
+
+def get_mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+class Launcher:
+    """Spawn runners concurrently with a bounded thread pool, and track them in memory.
+
+    The runner reports its pid through an inherited pipe (env TASKA_PID_FD).
+    The exit is notified by the pidfd on linux, or by the EOF of the pipe, then the own children are reaped with wait4 for
+    the exit code and rusage (WNOHANG, retried by a timer). One watcher thread handles all the events without polling
+    pid.txt / os.kill, on_exit is called by another thread so a slow exit never stalls the others.
+    On windows the pipe can not be inherited, the pid.txt is polled instead."""
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        finished_length: int = 100,
+        on_start: typing.Optional[typing.Callable[[Run], typing.Any]] = None,
+        on_exit: typing.Optional[typing.Callable[[Run], typing.Any]] = None,
+    ):
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="taska-launcher"
+        )
+        # on_exit runs here in the exit order, never on the watcher thread
+        self.exit_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="taska-on-exit"
+        )
+        self.on_start = on_start
+        self.on_exit = on_exit
+        # pid => running Run
+        self.runs: typing.Dict[int, Run] = {}
+        # the latest exited runs
+        self.finished: typing.Deque[Run] = deque(maxlen=finished_length)
+        self.lock = threading.Lock()
+        self.use_pipe = sys.platform != "win32"
+        self.use_pidfd = hasattr(os, "pidfd_open")
+        self._selector: typing.Optional[selectors.BaseSelector] = None
+        self._new_runs: typing.List[Run] = []
+        self._wakeup_r = self._wakeup_w = -1
+        self._watcher: typing.Optional[threading.Thread] = None
+        self.forkservers: typing.Dict[Path, ForkServer] = {}
+        self.async_workers: typing.Dict[Path, AsyncWorker] = {}
+
+    def submit(
+        self, job_dir: Path, cmd: typing.List[str], async_worker=False
+    ) -> "Future[Run]":
+        "Spawn in the pool, return at once."
+        return self.pool.submit(self.spawn, job_dir, cmd, async_worker)
+
+    def get_forkserver(
+        self, job_dir: Path, cmd: typing.List[str]
+    ) -> typing.Tuple[typing.Optional[ForkServer], typing.Optional[tuple]]:
+        # job_dir => jobs => workspace => workspaces => venv_dir
+        venv_dir = job_dir.parents[3]
+        stamp = ForkServer.get_stamp(venv_dir)
+        with self.lock:
+            server = self.forkservers.get(venv_dir)
+        if stamp is None or (
+            (server is None or server.stamp != stamp)
+            and not ForkServer.is_enabled(venv_dir)
+        ):
+            if server:
+                with self.lock:
+                    self.forkservers.pop(venv_dir, None)
+                server.stop()
+            return None, None
+        if server is None:
+            script = Path(cmd[1]).with_name(ForkServer.script_name)
+            with self.lock:
+                server = self.forkservers.setdefault(
+                    venv_dir, ForkServer(venv_dir, cmd[0], script)
+                )
+        return server, stamp
+
+    def get_async_worker(self, job_dir: Path, cmd: typing.List[str]):
+        # job_dir => jobs => workspace_dir
+        workspace_dir = job_dir.parents[1]
+        with self.lock:
+            worker = self.async_workers.get(workspace_dir)
+            if worker is None:
+                script = Path(cmd[1]).with_name(AsyncWorker.script_name)
+                worker = AsyncWorker(workspace_dir, cmd[0], script)
+                self.async_workers[workspace_dir] = worker
+        return worker, AsyncWorker.get_stamp(workspace_dir)
+
+    def spawn(self, job_dir: Path, cmd: typing.List[str], async_worker=False) -> Run:
+        "async_worker: run in the shared asyncio worker process of the workspace."
+        launched_at = time.time()
+        server: typing.Optional[WorkerProcess] = None
+        stamp = None
+        if not self.use_pipe:
+            pass
+        elif async_worker:
+            server, stamp = self.get_async_worker(job_dir, cmd)
+        else:
+            server, stamp = self.get_forkserver(job_dir, cmd)
+        if server and stamp:
+            r, w = os.pipe()
+            try:
+                pid, pidfd = server.submit(job_dir, w, stamp)
+            except Exception:
+                logger.exception(f"[{server.script_name}] failed, fallback to popen: {job_dir}")
+                os.close(r)
+            else:
+                run = Run(job_dir, None, launched_at)
+                run.pid = pid
+                run.shared = async_worker
+                if pidfd >= 0 and (async_worker or not self.use_pidfd):
+                    os.close(pidfd)
+                    pidfd = -1
+                # opened by the forkserver right after the fork, before the pid could be reused
+                run._pidfd = pidfd
+                self._watch(r, run)
+                return run
+            finally:
+                os.close(w)
+        if self.use_pipe:
+            r, w = os.pipe()
+            env = os.environ.copy()
+            env[PID_FD_ENV] = str(w)
+            try:
+                proc = subprocess.Popen(
+                    cmd,
+                    start_new_session=True,
+                    cwd=job_dir.as_posix(),
+                    pass_fds=(w,),
+                    env=env,
+                )
+            except BaseException:
+                os.close(r)
+                raise
+            finally:
+                os.close(w)
+            run = Run(job_dir, proc, launched_at)
+            self._watch(r, run)
+        else:
+            proc = subprocess.Popen(
+                cmd,
+                creationflags=subprocess.DETACHED_PROCESS
+                | subprocess.CREATE_NEW_PROCESS_GROUP
+                | subprocess.CREATE_NO_WINDOW
+                | subprocess.CREATE_BREAKAWAY_FROM_JOB,
+                cwd=job_dir.as_posix(),
+            )
+            run = Run(job_dir, proc, launched_at)
+            threading.Thread(
+                target=self._poll_pid_file, args=(run,), daemon=True
+            ).start()
+        return run
+
+    def running(self) -> typing.List[Run]:
+        "Snapshot of the running runs (started and not exited)."
+        with self.lock:
+            return list(self.runs.values())
+
+    def _open_pidfd(self, pid: int) -> int:
+        "pidfd is readable when the process exited, -1 if not supported."
+        if not self.use_pidfd:
+            return -1
+        try:
+            return os.pidfd_open(pid)  # type: ignore[attr-defined]
+        except OSError:
+            # ENOSYS: kernel < 5.3, ESRCH: already exited
+            return -1
+
+    def _watch(self, pipe_fd: int, run: Run):
+        os.set_blocking(pipe_fd, False)
+        if not run.shared and run._pidfd < 0:
+            pid = run.proc.pid if run.proc is not None else run.pid
+            if pid:
+                run._pidfd = self._open_pidfd(pid)
+        with self.lock:
+            if self._watcher is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup_r, self._wakeup_w = os.pipe()
+                self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+                self._watcher = threading.Thread(
+                    target=self._watch_forever, name="taska-watcher", daemon=True
+                )
+                self._watcher.start()
+            run._pipe_fd = pipe_fd
+            self._new_runs.append(run)
+        os.write(self._wakeup_w, b"\0")
+
+    def _watch_forever(self):
+        selector = self._selector
+        assert selector is not None
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    os.read(self._wakeup_r, 1024)
+                    with self.lock:
+                        new_runs, self._new_runs = self._new_runs, []
+                    for run in new_runs:
+                        selector.register(run._pipe_fd, selectors.EVENT_READ, run)
+                        if run._pidfd >= 0:
+                            selector.register(run._pidfd, selectors.EVENT_READ, run)
+                    continue
+                run: Run = key.data
+                if key.fd == run._pidfd:
+                    # process exited, the pipe may still hold the pid line
+                    self._read_pipe(selector, run)
+                    # a forked child may hold the pipe after the runner, its EOF is not another exit
+                    if run._pipe_fd >= 0:
+                        self._close_fd(selector, run._pipe_fd)
+                        run._pipe_fd = -1
+                    self._close_fd(selector, run._pidfd)
+                    run._pidfd = -1
+                    self._handle_exit(run)
+                elif not self._read_pipe(selector, run) and run._pidfd < 0:
+                    # no pidfd: the EOF of the pipe means exited
+                    self._handle_exit(run)
+
+    @staticmethod
+    def _close_fd(selector: selectors.BaseSelector, fd: int):
+        try:
+            selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        os.close(fd)
+
+    def _read_pipe(self, selector: selectors.BaseSelector, run: Run) -> bool:
+        "Read the available data of the pipe, return False if EOF."
+        if run._pipe_fd < 0:
+            return False
+        while True:
+            try:
+                data = os.read(run._pipe_fd, 1024)
+            except BlockingIOError:
+                return True
+            except OSError:
+                data = b""
+            if not data:
+                self._close_fd(selector, run._pipe_fd)
+                run._pipe_fd = -1
+                return False
+            self._handle_data(run, data)
+
+    def _handle_data(self, run: Run, data: bytes):
+        run._buffer += data
+        while b"\n" in run._buffer:
+            line, _, run._buffer = run._buffer.partition(b"\n")
+            if not run.started.is_set() and line.strip().isdigit():
+                run.pid = int(line)
+                self._handle_start(run)
+
+    def _handle_start(self, run: Run):
+        if run.pid is None:
+            return
+        if not run.shared:
+            with self.lock:
+                self.runs[run.pid] = run
+        run.started.set()
+        if self.on_start:
+            try:
+                self.on_start(run)
+            except Exception:
+                logger.exception(f"[Launcher] on_start failed: {run}")
+
+    def _reap(self, run: Run) -> bool:
+        "Get the exit code and rusage of the own child by WNOHANG, False if it is still exiting."
+        if run.proc is None or run.proc.returncode is not None:
+            return True
+        try:
+            pid, status, rusage = os.wait4(run.proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            run.returncode = run.proc.poll()
+            return True
+        if not pid:
+            return False
+        run.returncode = run.proc.returncode = os.waitstatus_to_exitcode(status)
+        run.rusage = {
+            "utime": round(rusage.ru_utime, 3),
+            "stime": round(rusage.ru_stime, 3),
+            "maxrss": rusage.ru_maxrss,
+        }
+        return True
+
+    def _handle_exit(self, run: Run):
+        if run._exiting:
+            # handled already, never release the slot twice
+            return
+        run._exiting = True
+        run.end_at = time.time()
+        self._finish_exit(run)
+
+    def _finish_exit(self, run: Run, retries=50):
+        if sys.platform == "win32":
+            run.returncode = run.proc.poll() if run.proc else None
+        elif not self._reap(run) and retries > 0:
+            # the pipe is closed, but the process is still exiting: retry later, not to block the watcher
+            timer = threading.Timer(0.1, self._finish_exit, (run, retries - 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self.lock:
+            if run.pid is not None and not run.shared:
+                self.runs.pop(run.pid, None)
+            self.finished.append(run)
+        try:
+            self.exit_pool.submit(self._call_on_exit, run)
+        except RuntimeError:
+            # shutdown
+            self._call_on_exit(run)
+
+    def _call_on_exit(self, run: Run):
+        if self.on_exit:
+            try:
+                self.on_exit(run)
+            except Exception:
+                logger.exception(f"[Launcher] on_exit failed: {run}")
+        run.started.set()
+        run.done.set()
+
+    def _poll_pid_file(self, run: Run, timeout=10):
+        assert run.proc is not None
+        pid_path = run.job_dir / "pid.txt"
+        for _ in range(timeout * 10):
+            if run.pid is None:
+                try:
+                    run.pid = int(pid_path.read_bytes() or 0) or None
+                    self._handle_start(run)
+                except (FileNotFoundError, ValueError):
+                    pass
+            try:
+                run.proc.wait(0.1)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+        # the exit should always be handled, to release the slot
+        run.proc.wait()
+        self._handle_exit(run)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+        self.exit_pool.shutdown(wait=wait)
+        with self.lock:
+            servers: typing.List[WorkerProcess] = [
+                *self.forkservers.values(),
+                *self.async_workers.values(),
+            ]
+            self.forkservers, self.async_workers = {}, {}
+        for server in servers:
+            server.stop()
@@ -0,0 +1,225 @@
+import asyncio
+import contextvars
+import importlib
+import json
+import os
+import re
+import socket
+import sys
+import time
+import traceback
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import runner
+from forkserver import recv_with_fds
+
+# (stdout, stderr) of the current job task
+current_streams: contextvars.ContextVar = contextvars.ContextVar(
+    "current_streams", default=None
+)
+
+
+class ContextStream:
+    "sys.stdout / sys.stderr proxy, writes to the LoggerStream of the current job task."
+
+    def __init__(self, index: int, fallback):
+        self.index = index
+        self.fallback = fallback
+
+    def write(self, buf):
+        streams = current_streams.get()
+        if streams:
+            return streams[self.index].write(buf)
+        return self.fallback.write(buf)
+
+    def flush(self):
+        streams = current_streams.get()
+        if streams:
+            return streams[self.index].flush()
+        return self.fallback.flush()
+
+
+class AsyncWorker:
+    """Long-lived asyncio process of a workspace, each job (meta `async_worker`=1) runs as a task.
+
+    Each run has its own timeout, result record and stdout/stderr capture,
+    the pid in result.jsonl is the worker pid. mem_limit / cpu_limit / pids_limit are not applied, warned in stderr.log.
+    A sync entrypoint runs in a thread which can not be cancelled: after its timeout the job is still running, and its
+    pid pipe (the launcher slot) is held, until the thread returns."""
+
+    LIMIT_KEYS = ("mem_limit", "cpu_limit", "pids_limit")
+
+    def __init__(self, sock: socket.socket, workspace_dir: Path):
+        self.sock = sock
+        self.workspace_dir = workspace_dir
+        self.running: set = set()
+        # cwd => the thread of the sync entrypoint
+        self.threads: dict = {}
+        self.executor = ThreadPoolExecutor(thread_name_prefix="taska-async-sync")
+        # module name => file mtime, reload the module if changed
+        self.mtimes: dict = {}
+        self.closed: asyncio.Future
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock.fileno(), self.handle_request)
+        await self.closed
+        loop.remove_reader(self.sock.fileno())
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def handle_request(self):
+        try:
+            msg, fds = recv_with_fds(self.sock)
+        except BlockingIOError:
+            return
+        except OSError:
+            msg, fds = b"", []
+        if not msg:
+            if not self.closed.done():
+                self.closed.set_result(None)
+            return
+        request = json.loads(msg)
+        pid_fd = fds[0] if fds else -1
+        if pid_fd >= 0:
+            os.set_inheritable(pid_fd, False)
+        asyncio.ensure_future(self.run_job(Path(request["cwd"]), pid_fd))
+        self.sock.send(json.dumps({"pid": os.getpid()}).encode())
+
+    def load_function(self, entrypoint: str):
+        if not re.match(r"^\w+(\.\w+)?(:\w+)?$", entrypoint):
+            raise ValueError("Invalid entrypoint: %s" % entrypoint)
+        module_name, _, function = entrypoint.partition(":")
+        if not module_name or not function:
+            raise ValueError("Invalid entrypoint: %s" % entrypoint)
+        module_path = self.workspace_dir / module_name
+        if module_path.is_file():
+            module_name = module_path.stem
+        module = importlib.import_module(module_name)
+        path = getattr(module, "__file__", None)
+        if path:
+            mtime = os.stat(path).st_mtime_ns
+            if module_name in self.mtimes and self.mtimes[module_name] != mtime:
+                module = importlib.reload(module)
+            self.mtimes[module_name] = mtime
+        return getattr(module, function)
+
+    async def call(self, function, params, cwd: Path):
+        if isinstance(params, dict):
+            args, kwargs = [], params
+        elif isinstance(params, list):
+            args, kwargs = params, {}
+        else:
+            raise TypeError(
+                "Invalid params type: %s. only support list/dict" % type(params)
+            )
+        if asyncio.iscoroutinefunction(function):
+            return await function(*args, **kwargs)
+        # sync function runs in a thread, with the copied context (stdout capture)
+        ctx = contextvars.copy_context()
+        future = self.executor.submit(ctx.run, function, *args, **kwargs)
+        self.threads[cwd] = future
+        result = await asyncio.wrap_future(future)
+        if hasattr(result, "__await__"):
+            result = await result
+        return result
+
+    async def run_job(self, cwd: Path, pid_fd: int):
+        start_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        start_ts = time.time()
+        pid_str = str(os.getpid())
+        result_item = {
+            "start_at": start_at,
+            "end_at": None,
+            "duration": None,
+            "pid": os.getpid(),
+            "result": None,
+            "error": None,
+        }
+        default_log_size = 5 * 1024**2
+        result_limit = default_log_size
+        added = False
+        try:
+            meta = json.loads(cwd.joinpath("meta.json").read_text(encoding="utf-8"))
+            result_limit = runner.read_size(meta["result_limit"] or default_log_size)
+            stdout_limit = runner.read_size(meta["stdout_limit"] or default_log_size)
+            if cwd in self.running:
+                raise runner.SingletonError(f"Job already running in async worker: {pid_str}")
+            self.running.add(cwd)
+            added = True
+            streams = tuple(
+                runner.LoggerStream(
+                    runner.LoggerStream.get_writer(std_type, cwd, stdout_limit)
+                )
+                for std_type in ("stdout", "stderr")
+            )
+            current_streams.set(streams)
+            if pid_fd >= 0:
+                os.write(pid_fd, f"{pid_str}\n".encode())
+            print(f"[INFO] Job start. pid: {pid_str}", flush=True, file=sys.stderr)
+            for key in self.LIMIT_KEYS:
+                if meta.get(key):
+                    print(
+                        f"[WARNING] {key}={meta[key]} is not applied in the async worker",
+                        flush=True,
+                        file=sys.stderr,
+                    )
+            function = self.load_function(meta["entrypoint"])
+            timeout = meta.get("timeout") or None
+            try:
+                result_item["result"] = await asyncio.wait_for(
+                    self.call(function, meta["params"], cwd), timeout
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"timeout={timeout}")
+        except Exception as e:
+            print(
+                f"[ERROR] Job fail. pid: {pid_str}, start_at: {start_at}, error: {traceback.format_exc()}",
+                flush=True,
+                file=sys.stderr,
+            )
+            result_item["error"] = repr(e)
+        finally:
+            try:
+                runner.log_result(result_limit, result_item, start_ts, cwd)
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+            print(
+                f"[INFO] Job end. pid: {pid_str}, start_at: {start_at}",
+                flush=True,
+                file=sys.stderr,
+            )
+            future: typing.Optional[Future] = self.threads.pop(cwd, None) if added else None
+            if future is not None and not future.done():
+                # timed out, the thread is still running the job
+                loop = asyncio.get_running_loop()
+                future.add_done_callback(
+                    lambda _: loop.call_soon_threadsafe(self.release, cwd, pid_fd)
+                )
+            else:
+                self.release(cwd if added else None, pid_fd)
+
+    def release(self, cwd: typing.Optional[Path], pid_fd: int):
+        "The job is not running: clear the guard, close the pid pipe (the launcher handles the exit)."
+        if cwd is not None:
+            self.running.discard(cwd)
+        if pid_fd >= 0:
+            os.close(pid_fd)
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    workspace_dir = Path(sys.argv[2]).resolve()
+    sys.path.insert(0, workspace_dir.as_posix())
+    sys.stdout = ContextStream(0, sys.stdout)
+    sys.stderr = ContextStream(1, sys.stderr)
+    asyncio.run(AsyncWorker(sock, workspace_dir).serve())
+
+
+if __name__ == "__main__":
+    main()
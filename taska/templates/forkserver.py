@@ -0,0 +1,161 @@
+import array
+import importlib
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+import runner
+
+MAX_FDS = 4
+
+
+def recv_with_fds(sock: socket.socket, bufsize=65536):
+    fds = array.array("i")
+    msg, ancdata, _, _ = sock.recvmsg(bufsize, socket.CMSG_LEN(MAX_FDS * fds.itemsize))
+    for level, _type, data in ancdata:
+        if level == socket.SOL_SOCKET and _type == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    return msg, list(fds)
+
+
+def preload(venv_dir: Path, names: list):
+    """names: ["requests", "workspace1:mycode"], return ({module_file: mtime}, [workspace_dir])"""
+    files = {}
+    workspaces = []
+    for name in names:
+        workspace, _, module = name.rpartition(":")
+        try:
+            if workspace:
+                workspace_dir = venv_dir.joinpath("workspaces", workspace).resolve()
+                workspaces.append(workspace_dir)
+                sys.path.insert(0, workspace_dir.as_posix())
+            mod = importlib.import_module(module)
+            path = getattr(mod, "__file__", None)
+            if workspace and path:
+                files[path] = os.stat(path).st_mtime_ns
+        except Exception:
+            print(
+                f"[WARNING] forkserver preload {name} failed: {traceback.format_exc()}",
+                file=sys.stderr,
+                flush=True,
+            )
+    for workspace_dir in workspaces:
+        while workspace_dir.as_posix() in sys.path:
+            sys.path.remove(workspace_dir.as_posix())
+    return files, workspaces
+
+
+def is_stale(files: dict):
+    for path, mtime in files.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def purge_modules(workspaces: list, cwd: Path):
+    # the preloaded modules of other workspaces should not be visible to this job
+    workspace_dir = cwd.parent.parent.resolve()
+    others = [i.as_posix() + "/" for i in workspaces if i != workspace_dir]
+    if not others:
+        return
+    for name, mod in list(sys.modules.items()):
+        path = getattr(mod, "__file__", None)
+        if path and Path(os.path.realpath(path)).as_posix().startswith(tuple(others)):
+            sys.modules.pop(name, None)
+
+
+def open_pidfd(pid: int) -> int:
+    "-1 if not supported."
+    try:
+        return os.pidfd_open(pid)  # type: ignore[attr-defined]
+    except (AttributeError, OSError):
+        return -1
+
+
+def run_child(sock: socket.socket, request: dict, pid_fd: int, workspaces: list, ready_fd: int):
+    code = 1
+    try:
+        # hold until the server got the pidfd: SIGCHLD is ignored, an exited child is reaped at once and its pid reused
+        os.read(ready_fd, 1)
+        os.close(ready_fd)
+        sock.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        cwd = Path(request["cwd"])
+        os.chdir(cwd.as_posix())
+        if pid_fd >= 0:
+            os.environ["TASKA_PID_FD"] = str(pid_fd)
+        random.seed()
+        purge_modules(workspaces, cwd)
+        runner.main()
+        code = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        logging.shutdown()
+        # os._exit skips the atexit flush of the buffered stdout / stderr
+        runner.CaptureWriter.flush_all()
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code)
+
+
+def main():
+    """Warm process of a venv: runner.py and the preload modules are imported only once, each job is forked from here.
+
+    Request: {"cwd": job_dir} + the pid pipe fd (SCM_RIGHTS); Response: {"pid": pid} + the pidfd of the child
+    (SCM_RIGHTS, linux >= 5.3), or {"error": "stale"}.
+    Exits when the client closed the socket, or the preloaded workspace modules changed."""
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    venv_dir = Path(sys.argv[2]).resolve()
+    config = json.loads(venv_dir.joinpath("forkserver.json").read_text(encoding="utf-8"))
+    files, workspaces = preload(venv_dir, config.get("preload") or [])
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            msg, fds = recv_with_fds(sock)
+        except OSError:
+            break
+        if not msg:
+            break
+        pid_fd = fds[0] if fds else -1
+        if is_stale(files):
+            for fd in fds:
+                os.close(fd)
+            sock.sendall(json.dumps({"error": "stale"}).encode())
+            break
+        request = json.loads(msg)
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_w)
+            run_child(sock, request, pid_fd, workspaces, ready_r)
+        os.close(ready_r)
+        pidfd = open_pidfd(pid)
+        os.close(ready_w)
+        for fd in fds:
+            os.close(fd)
+        response = json.dumps({"pid": pid}).encode()
+        if pidfd >= 0:
+            rights = array.array("i", [pidfd])
+            sock.sendmsg([response], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, rights)])
+            os.close(pidfd)
+        else:
+            sock.sendall(response)
+
+
+if __name__ == "__main__":
+    main()
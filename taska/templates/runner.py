@@ -1,7 +1,10 @@
+import atexit
+import io
 import json
 import logging
 import os
 import re
+import select
 import signal
 import sys
 import time
@@ -11,46 +14,332 @@ from concurrent.futures import Future
 from functools import partial
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from threading import Thread, Timer
+from threading import Lock, Thread, Timer
+
+
+class CaptureWriter:
+    """Timestamped, buffered writer of stdout.log / stderr.log, one for each file of the process.
+
+    - the `[%Y-%m-%d %H:%M:%S] ` prefix (formatted once per second) starts each write after a newline, the format of
+      the older versions; `every_line` prefixes each line of the data, for the chunks of the fd capture
+    - buffered, written by FLUSH_SIZE or by the flusher thread every FLUSH_INTERVAL seconds, and at exit
+    - rotated like RotatingFileHandler(maxBytes=stdout_limit * 1.1, backupCount=1), checked by a byte counter"""
+
+    FLUSH_SIZE = 64 * 1024
+    FLUSH_INTERVAL = 0.5
+    # path => writer
+    WRITERS: typing.Dict[str, "CaptureWriter"] = {}
+    LOCK = Lock()
+    # the flusher thread is not inherited by the forked process
+    FLUSHER_PID = 0
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.chunks: typing.List[bytes] = []
+        self.buffered = 0
+        self.newline = True
+        self.second = 0
+        self.prefix = b""
+        self.fd = self.open()
+        self.size = os.fstat(self.fd).st_size
+
+    @classmethod
+    def get_writer(cls, path: Path, stdout_limit) -> "CaptureWriter":
+        path = path.resolve()
+        with cls.LOCK:
+            writer = cls.WRITERS.get(path.as_posix())
+            if writer is None:
+                writer = cls(path, int(stdout_limit * 1.1))
+                cls.WRITERS[path.as_posix()] = writer
+            if cls.FLUSHER_PID != os.getpid():
+                cls.FLUSHER_PID = os.getpid()
+                Thread(target=cls.flush_forever, daemon=True).start()
+                atexit.register(cls.flush_all)
+        return writer
+
+    @classmethod
+    def flush_forever(cls):
+        while True:
+            time.sleep(cls.FLUSH_INTERVAL)
+            cls.flush_all()
+
+    @classmethod
+    def flush_all(cls):
+        with cls.LOCK:
+            writers = list(cls.WRITERS.values())
+        for writer in writers:
+            try:
+                writer.flush()
+            except OSError:
+                pass
+
+    def open(self) -> int:
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, data: bytes, every_line=False):
+        if not data:
+            return
+        with self.lock:
+            now = int(time.time())
+            if now != self.second:
+                self.second = now
+                self.prefix = time.strftime(
+                    "[%Y-%m-%d %H:%M:%S] ", time.localtime(now)
+                ).encode()
+            prefix = self.prefix
+            ends_with_newline = data.endswith(b"\n")
+            if not every_line:
+                body = data
+            elif ends_with_newline:
+                body = data[:-1].replace(b"\n", b"\n" + prefix) + b"\n"
+            else:
+                body = data.replace(b"\n", b"\n" + prefix)
+            if self.newline:
+                body = prefix + body
+            self.newline = ends_with_newline
+            self.chunks.append(body)
+            self.buffered += len(body)
+            if self.buffered >= self.FLUSH_SIZE:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.chunks:
+            return
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.buffered = 0
+        if self.max_bytes > 0 and self.size and self.size + len(data) >= self.max_bytes:
+            self.rotate()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view) :]
+        self.size += len(data)
+
+    def rotate(self):
+        "stdout.log => stdout.log.1, the old backup is replaced."
+        os.close(self.fd)
+        try:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        except FileNotFoundError:
+            pass
+        self.fd = self.open()
+        self.size = 0
+
+
+def libc_fflush():
+    "Flush the C stdio buffers (printf of the extensions)."
+    import ctypes
+
+    ctypes.CDLL(None).fflush(None)
+
+
+class FdCapture:
+    """fd 1 / 2 of the process redirected into a pipe, a thread drains it by large reads into the CaptureWriter,
+    so the output of the C extensions, os.system and the child processes is logged too.
+
+    The children outliving the runner (nohup, start_new_session) still hold the pipe, it is handed off to a detached
+    drainer process at exit, so they never get SIGPIPE and their output is logged until they close it."""
+
+    READ_SIZE = 1024 * 1024
+    PIPE_SIZE = 1024 * 1024
+    CAPTURES: typing.List["FdCapture"] = []
+
+    def __init__(self, fd: int, writer: CaptureWriter):
+        self.fd = fd
+        self.writer = writer
+        self.read_fd, write_fd = os.pipe()
+        if sys.platform == "linux":
+            import fcntl
+
+            try:
+                # fewer wakeups for the chatty writers
+                set_size = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+                fcntl.fcntl(write_fd, set_size, self.PIPE_SIZE)
+            except OSError:
+                pass
+        self.saved_fd = os.dup(fd)
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+        self.lock = Lock()
+        # a poll object is not for concurrent calls: the blocking wait of the drain thread / the checks in sync
+        self.poller = self.ready_poller = None
+        if hasattr(select, "poll"):
+            self.poller, self.ready_poller = select.poll(), select.poll()
+            self.poller.register(self.read_fd, select.POLLIN)
+            self.ready_poller.register(self.read_fd, select.POLLIN)
+            # wakes the drain thread to stop, the read_fd is kept for the handoff
+            self.wakeup_r, self.wakeup_w = os.pipe()
+            self.poller.register(self.wakeup_r, select.POLLIN)
+        self.closed = False
+        self.stopping = False
+        self.thread = Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def setup(cls, fd: int, writer: CaptureWriter) -> typing.Optional["FdCapture"]:
+        try:
+            capture = cls(fd, writer)
+        except OSError:
+            return None
+        cls.CAPTURES.append(capture)
+        return capture
+
+    @classmethod
+    def close_all(cls, timeout=0.1):
+        while cls.CAPTURES:
+            cls.CAPTURES.pop().close(timeout)
+
+    def drain(self):
+        try:
+            while not self.closed:
+                if self.poller is None:
+                    data = os.read(self.read_fd, self.READ_SIZE)
+                    if not data:
+                        break
+                    self.writer.write(data, every_line=True)
+                else:
+                    self.poller.poll()
+                    if not self.sync():
+                        break
+                    if self.stopping:
+                        return
+        except OSError:
+            pass
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                os.close(self.read_fd)
+
+    def sync(self) -> bool:
+        """Write the pending data of the pipe, before a python write to keep the order after the fd writes.
+
+        Return False on EOF."""
+        with self.lock:
+            while not self.closed and self.ready_poller.poll(0):
+                data = os.read(self.read_fd, self.READ_SIZE)
+                if not data:
+                    return False
+                self.writer.write(data, every_line=True)
+        return True
+
+    def close(self, timeout=0.1):
+        "Restore the fd, the pipe gets EOF unless the child processes still hold it, then it is handed off."
+        try:
+            libc_fflush()
+        except Exception:
+            pass
+        os.dup2(self.saved_fd, self.fd)
+        os.close(self.saved_fd)
+        self.thread.join(timeout)
+        if self.poller is None:
+            return
+        if self.thread.is_alive():
+            self.stopping = True
+            os.write(self.wakeup_w, b"\0")
+            self.thread.join()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.handoff()
+            finally:
+                os.close(self.read_fd)
+
+    def handoff(self):
+        """Fork a detached drainer for the read end, it writes into the log file until the last child closes the pipe.
+
+        >>> import subprocess, sys, tempfile, time
+        >>> log = Path(tempfile.mkdtemp()) / "stdout.log"
+        >>> code = "import runner, subprocess; w = runner.CaptureWriter.get_writer(runner.Path(%r), 10 ** 6); "
+        >>> code += "runner.FdCapture.setup(1, w); subprocess.Popen('sleep 1; echo late; echo done', shell=True, "
+        >>> code += "start_new_session=True); runner.FdCapture.close_all(); runner.CaptureWriter.flush_all()"
+        >>> start = time.time()
+        >>> subprocess.run([sys.executable, "-c", code % str(log)], cwd=Path(__file__).parent).returncode
+        0
+        >>> time.time() - start < 1
+        True
+        >>> time.sleep(1.5)
+        >>> [line[22:] for line in log.read_text().splitlines()]
+        ['late', 'done']
+        """
+        self.writer.flush()
+        pid = os.fork()
+        if pid:
+            return
+        try:
+            leave_run_cgroup()
+            os.setsid()
+            os.dup2(self.read_fd, 0)
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            # not to hold the pid pipe / the sockets of the runner
+            os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+            writer = CaptureWriter(self.writer.path, self.writer.max_bytes)
+            while True:
+                data = os.read(0, self.READ_SIZE)
+                if not data:
+                    break
+                writer.write(data, every_line=True)
+                writer.flush()
+        finally:
+            os._exit(0)
 
 
 class LoggerStream:
-    def __init__(self, logger):
-        self.logger = logger
-        self.linebuf = ""
-        self.newline = True
+    "sys.stdout / sys.stderr of the job, the text is written by the CaptureWriter."
+
+    encoding = "utf-8"
+    errors = "replace"
+
+    def __init__(self, writer: CaptureWriter, capture: typing.Optional[FdCapture] = None):
+        self.writer = writer
+        self.capture = capture if capture and capture.poller else None
+        # fd 1 / 2 if captured, for subprocess(stdout=sys.stdout) / faulthandler
+        self.fd = capture.fd if capture else None
 
     @classmethod
-    def setup(cls, std_type: str, dir_path: Path, stdout_limit):
-        logger = logging.getLogger(f"{std_type}_log")
-        logger.setLevel(logging.DEBUG)
-        if not logger.hasHandlers():
-            handler = RotatingFileHandler(
-                dir_path.joinpath(f"{std_type}.log").resolve().as_posix(),
-                maxBytes=stdout_limit * 1.1,
-                backupCount=1,
-                encoding="utf-8",
-                errors="replace",
-            )
-            handler.terminator = ""
-            handler.setLevel(logging.DEBUG)
-            formatter = logging.Formatter("%(message)s")
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
-        setattr(sys, std_type, LoggerStream(logger))
-
-    def write(self, buf):
-        if self.newline:
-            buf = f'[{time.strftime("%Y-%m-%d %H:%M:%S")}] {buf}'
-        if buf.endswith("\n"):
-            self.newline = True
-        else:
-            self.newline = False
-        self.logger.info(buf)
+    def get_writer(cls, std_type: str, dir_path: Path, stdout_limit) -> CaptureWriter:
+        return CaptureWriter.get_writer(dir_path / f"{std_type}.log", stdout_limit)
+
+    @classmethod
+    def setup(cls, std_type: str, dir_path: Path, stdout_limit, capture_fd=False):
+        writer = cls.get_writer(std_type, dir_path, stdout_limit)
+        capture = None
+        if capture_fd:
+            capture = FdCapture.setup({"stdout": 1, "stderr": 2}[std_type], writer)
+        setattr(sys, std_type, LoggerStream(writer, capture))
+
+    def write(self, buf: str):
+        if self.capture is not None:
+            self.capture.sync()
+        self.writer.write(buf.encode("utf-8", "replace"))
+        return len(buf)
 
     def flush(self):
+        # written by the flusher thread in FLUSH_INTERVAL seconds, no syscall for each print(flush=True)
         pass
 
+    def fileno(self):
+        if self.fd is None:
+            raise io.UnsupportedOperation("fileno")
+        return self.fd
+
+    def isatty(self):
+        return False
+
+    def writable(self):
+        return True
+
 
 class SingletonError(RuntimeError):
     pass
@@ -109,13 +398,111 @@ def ensure_singleton(current_pid, pid_file: Path):
         raise SingletonError(f"Job already running, running_pid: {old_pid}")
 
 
-def log_result(result_limit, result_item: dict, start_ts):
+def report_pid(pid_str: str):
+    # the launcher reads the pid from the pipe, and the EOF means this process exited
+    fd = os.environ.pop("TASKA_PID_FD", None)
+    if fd:
+        try:
+            os.set_inheritable(int(fd), False)
+            os.write(int(fd), f"{pid_str}\n".encode())
+        except OSError:
+            pass
+
+
+# keep in sync with taska/store.py, checked by tests/test_runner.py
+RESULT_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    job_dir TEXT NOT NULL,
+    pid INTEGER,
+    start_ts REAL,
+    start_at TEXT,
+    end_at TEXT,
+    duration REAL,
+    error TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS results_pid ON results (pid, start_ts);
+CREATE INDEX IF NOT EXISTS results_job ON results (job_dir, start_ts);
+CREATE INDEX IF NOT EXISTS results_start ON results (start_ts);
+"""
+# rows kept for each job
+RESULT_DB_KEEP = 1000
+
+
+def save_result_db(dir_path: Path, result_item: dict, line: str, start_ts):
+    "Insert into root/results/results.db, the indexed copy of result.jsonl"
+    import sqlite3
+
+    # job_dir => jobs => workspace => workspaces => venv => python => root
+    root_dir = dir_path.parents[5]
+    job_key = dir_path.relative_to(root_dir).as_posix()
+    db_path = root_dir.joinpath("results", "results.db")
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path.as_posix(), timeout=5)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(RESULT_DB_SCHEMA)
+        with conn:
+            conn.execute(
+                "INSERT INTO results (job_dir, pid, start_ts, start_at, end_at, duration, error, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_key,
+                    result_item["pid"],
+                    start_ts,
+                    result_item["start_at"],
+                    result_item["end_at"],
+                    result_item["duration"],
+                    result_item["error"],
+                    line,
+                ),
+            )
+            conn.execute(
+                "DELETE FROM results WHERE job_dir = ? AND start_ts < (SELECT start_ts FROM results WHERE job_dir = ? ORDER BY start_ts DESC LIMIT 1 OFFSET ?)",
+                (job_key, job_key, RESULT_DB_KEEP - 1),
+            )
+    finally:
+        conn.close()
+
+
+def get_usage():
+    "Resource usage of this process, and its waited children, None if not supported."
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss: bytes on macOS, KB on linux
+    unit = 1 if sys.platform == "darwin" else 1024
+    usage: dict = {}
+    for key, who in (
+        ("self", resource.RUSAGE_SELF),
+        ("children", resource.RUSAGE_CHILDREN),
+    ):
+        ru = resource.getrusage(who)
+        usage[key] = {
+            "utime": round(ru.ru_utime, 3),
+            "stime": round(ru.ru_stime, 3),
+            "maxrss": ru.ru_maxrss * unit,
+            "nvcsw": ru.ru_nvcsw,
+            "nivcsw": ru.ru_nivcsw,
+            "inblock": ru.ru_inblock,
+            "oublock": ru.ru_oublock,
+        }
+    result = usage["self"]
+    result["children"] = usage["children"]
+    return result
+
+
+def log_result(result_limit, result_item: dict, start_ts, dir_path=None):
     result_item["end_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
     result_item["duration"] = round(time.time() - start_ts, 3)
+    dir_path = Path(dir_path or os.getcwd()).resolve()
+    line = json.dumps(result_item, ensure_ascii=False, default=repr)
     result_logger = logging.getLogger("result_logger")
     result_logger.setLevel(logging.DEBUG)
     handler = RotatingFileHandler(
-        Path(os.getcwd()).joinpath("result.jsonl").resolve().as_posix(),
+        dir_path.joinpath("result.jsonl").as_posix(),
         maxBytes=result_limit * 1.1,
         backupCount=1,
         encoding="utf-8",
@@ -125,17 +512,43 @@ def log_result(result_limit, result_item: dict, start_ts):
     formatter = logging.Formatter("%(message)s")
     handler.setFormatter(formatter)
     result_logger.addHandler(handler)
-    result_logger.info(json.dumps(result_item, ensure_ascii=False, default=repr))
+    result_logger.info(line)
     handler.flush()
     result_logger.removeHandler(handler)
+    handler.close()
+    try:
+        save_result_db(dir_path, result_item, line, start_ts)
+    except Exception:
+        print(
+            f"[WARNING] save result db failed: {traceback.format_exc()}",
+            flush=True,
+            file=sys.stderr,
+        )
 
 
 def setup_stdout_logger(cwd_path, stdout_limit):
-    LoggerStream.setup("stdout", cwd_path, stdout_limit)
-    LoggerStream.setup("stderr", cwd_path, stdout_limit)
+    # the python writes go to the writer directly, the fd writes through the pipe
+    LoggerStream.setup("stdout", cwd_path, stdout_limit, capture_fd=True)
+    LoggerStream.setup("stderr", cwd_path, stdout_limit, capture_fd=True)
+
+
+def get_vm_size() -> int:
+    "VmSize of the process in bytes, 0 if unknown."
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
 
 
 def setup_mem_limit(mem_limit: str):
+    """The fallback without cgroup: RLIMIT_AS (RLIMIT_RSS is ignored by linux).
+
+    RLIMIT_AS caps the virtual memory, the runner's threads have reserved their stacks / malloc arenas already, so the
+    cap is the current VmSize plus mem_limit: the job may map mem_limit more bytes, its new threads count too."""
     if mem_limit:
         if sys.platform == "win32":
             raise ValueError(f"mem_limit={mem_limit} is not supported on windows")
@@ -143,7 +556,140 @@ def setup_mem_limit(mem_limit: str):
         if mem_limit:
             import resource
 
-            resource.setrlimit(resource.RLIMIT_RSS, (mem_limit, mem_limit))
+            limit = get_vm_size() + mem_limit
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# keep in sync with taska/cgroup.py, checked by tests/test_runner.py
+CGROUP_MOUNT = Path("/sys/fs/cgroup")
+CGROUP_CONTROLLERS = "+memory +cpu +pids"
+# cpu.max period, microseconds
+CPU_PERIOD = 100000
+
+
+def get_cgroup_base(root_dir: Path) -> typing.Optional[Path]:
+    "The delegated cgroup v2 dir of the runs, from the `cgroup` file of the root dir."
+    path = root_dir / "cgroup"
+    if sys.platform != "linux" or not path.is_file():
+        return None
+    base = Path(path.read_text().strip())
+    if not base.is_absolute():
+        base = CGROUP_MOUNT / base
+    if not base.joinpath("cgroup.procs").is_file():
+        return None
+    return base
+
+
+def leave_run_cgroup():
+    "Move this process from the `run-{pid}` cgroup into the `drainers` sibling, so the run cgroup can be removed."
+    if sys.platform != "linux":
+        return
+    try:
+        with open("/proc/self/cgroup", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    cgroup = CGROUP_MOUNT / line[3:].strip().lstrip("/")
+                    break
+            else:
+                return
+        if not cgroup.name.startswith("run-"):
+            return
+        target = cgroup.parent / "drainers"
+        target.mkdir(exist_ok=True)
+        target.joinpath("cgroup.procs").write_text(str(os.getpid()))
+    except OSError:
+        pass
+
+
+def get_cgroup_limits(meta: dict) -> typing.Dict[str, str]:
+    limits = {}
+    mem_limit = read_size(meta.get("mem_limit") or 0)
+    if mem_limit:
+        limits["memory.max"] = str(mem_limit)
+    if meta.get("cpu_limit"):
+        quota = max(int(float(meta["cpu_limit"]) * CPU_PERIOD), 1000)
+        limits["cpu.max"] = f"{quota} {CPU_PERIOD}"
+    if meta.get("pids_limit"):
+        limits["pids.max"] = str(int(meta["pids_limit"]))
+    return limits
+
+
+def setup_cgroup(
+    root_dir: Path, pid_str: str, meta: dict
+) -> typing.Optional[Path]:
+    """Move this process into a new cgroup `run-{pid}` under the delegated dir, with memory.max / cpu.max / pids.max.
+    Return None if not available, the cgroup is removed by the launcher after the exit."""
+    base = get_cgroup_base(root_dir)
+    if base is None:
+        return None
+    cgroup = base / f"run-{pid_str}"
+    try:
+        try:
+            # only the controllers of cgroup.subtree_control are available to the children
+            base.joinpath("cgroup.subtree_control").write_text(CGROUP_CONTROLLERS)
+        except OSError:
+            pass
+        if cgroup.is_dir():
+            # left by an old run of the same pid
+            cgroup.rmdir()
+        cgroup.mkdir()
+        for name, value in get_cgroup_limits(meta).items():
+            cgroup.joinpath(name).write_text(value)
+            if name == "memory.max":
+                try:
+                    cgroup.joinpath("memory.swap.max").write_text("0")
+                except OSError:
+                    pass
+        cgroup.joinpath("cgroup.procs").write_text(pid_str)
+    except OSError as e:
+        print(
+            f"[WARNING] cgroup {cgroup.as_posix()} not available, fallback to rlimit: {e!r}",
+            flush=True,
+            file=sys.stderr,
+        )
+        try:
+            cgroup.rmdir()
+        except OSError:
+            pass
+        return None
+    return cgroup
+
+
+def read_cgroup_stats(cgroup: Path) -> dict:
+    "OOM / throttling stats of the cgroup: memory.events, cpu.stat, pids.events and the peaks."
+    stats = {}
+    for name, keys in (
+        ("memory.events", ("max", "oom", "oom_kill")),
+        ("cpu.stat", ("usage_usec", "nr_periods", "nr_throttled", "throttled_usec")),
+        ("pids.events", ("max",)),
+    ):
+        try:
+            text = cgroup.joinpath(name).read_text()
+        except OSError:
+            continue
+        prefix = name.split(".")[0]
+        for line in text.splitlines():
+            key, _, value = line.partition(" ")
+            if key in keys:
+                stats[f"{prefix}_{key}"] = int(value)
+    for name in ("memory.peak", "pids.peak"):
+        try:
+            stats[name.replace(".", "_")] = int(cgroup.joinpath(name).read_text())
+        except (OSError, ValueError):
+            pass
+    return stats
+
+
+def await_result(result):
+    # async def entrypoint returns a coroutine, run it to complete in this thread
+    if hasattr(result, "__await__"):
+        import asyncio
+
+        async def _await():
+            return await result
+
+        return asyncio.run(_await())
+    return result
 
 
 def start_job(entrypoint, params, workspace_dir, EXEC_GLOBAL_FUTURE: Future):
@@ -167,7 +713,7 @@ def start_job(entrypoint, params, workspace_dir, EXEC_GLOBAL_FUTURE: Future):
             else:
                 raise TypeError("Invalid params type: %s. only support list/dict" % type(params))
             if function:
-                code += f"; EXEC_GLOBAL_FUTURE.set_result({module}.{function}(*ARGS, **KWS))"
+                code += f"; EXEC_GLOBAL_FUTURE.set_result(await_result({module}.{function}(*ARGS, **KWS)))"
             else:
                 code += "; EXEC_GLOBAL_FUTURE.set_result('no result')"
             try:
@@ -175,6 +721,7 @@ def start_job(entrypoint, params, workspace_dir, EXEC_GLOBAL_FUTURE: Future):
                     code,
                     {
                         "EXEC_GLOBAL_FUTURE": EXEC_GLOBAL_FUTURE,
+                        "await_result": await_result,
                         "ARGS": ARGS,
                         "KWS": KWS,
                     },
@@ -218,6 +765,8 @@ def main():
         "crontab": "",
         "timeout": 0,
         "mem_limit": "",
+        "cpu_limit": 0,
+        "pids_limit": 0,
         "result_limit": "",
         "stdout_limit": ""
     }"""
@@ -243,20 +792,26 @@ def main():
     pid_file = cwd_path / "pid.txt"
     global_pid_file = root_dir / "pids" / pid_str
     global_pid_file.parent.mkdir(parents=True, exist_ok=True)
+    cgroup = None
     try:
         thread = None
         ensure_singleton(pid_str, pid_file)
-        ensure_max_workers(root_dir)
+        if "TASKA_PID_FD" not in os.environ:
+            # the launcher admits its runs by the admission queue of the supervisor
+            ensure_max_workers(root_dir)
         global_pid_file.touch()
         # start job
         pid_file.write_text(pid_str)
+        report_pid(pid_str)
         cwd_path.joinpath("result.jsonl").touch()
         setup_stdout_logger(cwd_path, stdout_limit)
         EXEC_GLOBAL_FUTURE: Future = Future()
         print(f"[INFO] Job start. pid: {pid_str}", flush=True, file=sys.stderr)
         signal.signal(signal.SIGINT, partial(handle_signal, future=EXEC_GLOBAL_FUTURE))
         signal.signal(signal.SIGTERM, partial(handle_signal, future=EXEC_GLOBAL_FUTURE))
-        setup_mem_limit(meta["mem_limit"])
+        cgroup = setup_cgroup(root_dir, pid_str, meta)
+        if cgroup is None:
+            setup_mem_limit(meta["mem_limit"])
         thread = Thread(
             target=start_job,
             args=(
@@ -287,12 +842,20 @@ def main():
         )
         result_item["error"] = repr(e)
     finally:
+        try:
+            result_item["usage"] = get_usage()
+        except Exception:
+            result_item["usage"] = None
+        if cgroup is not None:
+            result_item["cgroup"] = read_cgroup_stats(cgroup)
         log_result(result_limit, result_item, start_ts)
         print(
             f"[INFO] Job end. pid: {pid_str}, start_at: {start_at}",
             flush=True,
             file=sys.stderr,
         )
+        FdCapture.close_all()
+        CaptureWriter.flush_all()
         if pid_file.is_file() and pid_file.read_text() == pid_str:
             pid_file.unlink(missing_ok=True)
         global_pid_file.unlink(missing_ok=True)
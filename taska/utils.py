@@ -0,0 +1,299 @@
+import fnmatch
+import mmap
+import os
+import re
+import subprocess
+import typing
+from pathlib import Path
+
+
+def get_backup_path(path: Path) -> Path:
+    "The rotated backup of RotatingFileHandler(backupCount=1): stdout.log => stdout.log.1"
+    return path.with_name(f"{path.name}.1")
+
+
+def tail_file(
+    path: Path, n: int, block_size=65536, end: typing.Optional[int] = None
+) -> typing.List[bytes]:
+    """The last n lines of a file, reading fixed-size blocks backwards from EOF until n newlines are found.
+
+    end: read the lines before this offset instead of EOF."""
+    if n <= 0:
+        return []
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        if end is not None:
+            pos = min(pos, end)
+        blocks: typing.List[bytes] = []
+        newlines = 0
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            block = f.read(size)
+            newlines += block.count(b"\n")
+            if not blocks and block.endswith(b"\n"):
+                # the newline of the last line
+                newlines -= 1
+            blocks.append(block)
+            if newlines >= n:
+                break
+    lines = b"".join(reversed(blocks)).splitlines(keepends=True)
+    return lines[-n:]
+
+
+def tail_lines(
+    path: Path, n: int, with_backup=True, end: typing.Optional[int] = None
+) -> typing.List[bytes]:
+    "The last n lines of a log file (before the offset `end`), continued from the rotated `.1` backup if not enough."
+    lines: typing.List[bytes] = []
+    paths = [path, get_backup_path(path)] if with_backup else [path]
+    for file_path in paths:
+        if len(lines) >= n:
+            break
+        try:
+            # one more line, in case the last one is merged
+            older = tail_file(
+                file_path, n - len(lines) + 1, end=end if file_path == path else None
+            )
+        except FileNotFoundError:
+            continue
+        if older and lines and not older[-1].endswith(b"\n"):
+            # the line was split by the rotation
+            lines[0] = older.pop() + lines[0]
+        lines = older + lines
+    return lines[-n:] if n > 0 else []
+
+
+class GrepLine(typing.NamedTuple):
+    path: Path
+    line: bytes
+    # False for the context lines
+    matched: bool
+
+
+def iter_windows(size: int, chunk_size: int, reverse=False):
+    "[start, end) offsets of the chunks, from the head or from the tail"
+    if reverse:
+        end = size
+        while end > 0:
+            yield max(end - chunk_size, 0), end
+            end -= chunk_size
+    else:
+        for start in range(0, size, chunk_size):
+            yield start, min(start + chunk_size, size)
+
+
+def iter_matched_lines(
+    buffer, pattern: "re.Pattern[bytes]", start: int, end: int
+) -> typing.Iterator[typing.Tuple[int, int]]:
+    "[line_start, line_end) of the matched lines in buffer[start:end]"
+    pos = start
+    while pos < end:
+        match = pattern.search(buffer, pos, end)
+        if not match:
+            break
+        line_start = buffer.rfind(b"\n", 0, match.start()) + 1
+        line_end = buffer.find(b"\n", match.start(), end)
+        line_end = end if line_end < 0 else line_end + 1
+        yield line_start, line_end
+        pos = line_end
+
+
+def grep_file(
+    path: Path,
+    pattern: "re.Pattern[bytes]",
+    context=0,
+    max_matches=0,
+    newest_first=False,
+    chunk_size=1024**2,
+) -> typing.Iterator[typing.Optional[GrepLine]]:
+    """Yield the matched lines (and `context` lines around them) of a file as they are found, None as the separator of
+    the discontinuous groups. Stops after the group which reaches `max_matches` matched lines.
+
+    The file is mmapped and searched in chunks aligned to the lines, newest_first searches the chunks from the tail and
+    yields the matches of each chunk in reverse."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count = 0
+            # the emitted range, to merge the overlapped context
+            emitted: typing.Optional[typing.Tuple[int, int]] = None
+            for start, end in iter_windows(size, chunk_size, reverse=newest_first):
+                # align to the line start / end
+                if start > 0:
+                    start = mm.rfind(b"\n", 0, start) + 1
+                if end < size:
+                    newline = mm.find(b"\n", end)
+                    end = size if newline < 0 else newline + 1
+                lines = iter_matched_lines(mm, pattern, start, end)
+                if newest_first:
+                    lines = reversed(list(lines))
+                for line_start, line_end in lines:
+                    group_start, group_end = line_start, line_end
+                    for _ in range(context):
+                        if group_start > 0:
+                            group_start = mm.rfind(b"\n", 0, group_start - 1) + 1
+                        if group_end < size:
+                            newline = mm.find(b"\n", group_end)
+                            group_end = size if newline < 0 else newline + 1
+                    if emitted:
+                        if newest_first:
+                            group_end = min(group_end, emitted[0])
+                            adjacent = group_end == emitted[0]
+                        else:
+                            group_start = max(group_start, emitted[1])
+                            adjacent = group_start == emitted[1]
+                        if group_start >= group_end:
+                            # emitted as the context already
+                            continue
+                        if not adjacent:
+                            yield None
+                    group = []
+                    offset = group_start
+                    while offset < group_end:
+                        newline = mm.find(b"\n", offset, group_end)
+                        next_offset = group_end if newline < 0 else newline + 1
+                        if line_start <= offset < line_end:
+                            matched = True
+                        else:
+                            # a context line may match too
+                            matched = bool(pattern.search(mm, offset, next_offset))
+                        group.append(GrepLine(path, mm[offset:next_offset], matched))
+                        count += matched
+                        offset = next_offset
+                    yield from (reversed(group) if newest_first else group)
+                    if emitted is None:
+                        emitted = (group_start, group_end)
+                    else:
+                        emitted = (
+                            min(emitted[0], group_start),
+                            max(emitted[1], group_end),
+                        )
+                    if max_matches and count >= max_matches:
+                        return
+
+
+def grep_lines(
+    path: Path,
+    pattern: "re.Pattern[bytes]",
+    context=0,
+    max_matches=0,
+    newest_first=False,
+    with_backup=True,
+) -> typing.Iterator[typing.Optional[GrepLine]]:
+    "grep_file over the log file and its rotated `.1` backup, oldest first or newest first."
+    paths = [get_backup_path(path), path] if with_backup else [path]
+    if newest_first:
+        paths.reverse()
+    count = 0
+    for file_path in paths:
+        remain = max_matches - count if max_matches else 0
+        first = True
+        try:
+            for item in grep_file(file_path, pattern, context, remain, newest_first):
+                if first and count:
+                    yield None
+                first = False
+                if item is not None and item.matched:
+                    count += 1
+                yield item
+        except FileNotFoundError:
+            continue
+        if max_matches and count >= max_matches:
+            return
+
+
+def run_with_output(
+    cmd: typing.List[str],
+    env: typing.Optional[dict] = None,
+    output: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+) -> typing.Tuple[int, str]:
+    "Run the command with stderr merged into stdout, each line is passed to `output` as it comes. Return (returncode, stdout)."
+    lines = []
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        errors="replace",
+        env=env,
+    ) as proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            lines.append(line)
+            if output is not None:
+                output(line)
+    return proc.returncode, "".join(lines)
+
+
+class DirItem(typing.NamedTuple):
+    name: str
+    is_dir: bool
+    # None for the dirs
+    size: typing.Optional[int]
+    mtime: float
+
+
+def scan_dir(
+    path: Path,
+    sort="name",
+    reverse=False,
+    pattern="",
+    offset=0,
+    limit=0,
+) -> typing.Tuple[int, typing.List[DirItem]]:
+    """One os.scandir pass over the dir, dirs first, return (total matched, the items of the page).
+
+    sort: name / mtime / size, only the items of the page are stat-ed if sorted by name.
+    pattern: case-insensitive substring of the name, or a glob if it has any of `*?[`."""
+    with os.scandir(path) as it:
+        entries = list(it)
+    if pattern:
+        pattern = pattern.lower()
+        if any(i in pattern for i in "*?["):
+            entries = [i for i in entries if fnmatch.fnmatchcase(i.name.lower(), pattern)]
+        else:
+            entries = [i for i in entries if pattern in i.name.lower()]
+    dir_flags = {}
+    for entry in entries:
+        try:
+            # d_type of the readdir, no stat unless it is a symlink
+            dir_flags[entry.name] = entry.is_dir()
+        except OSError:
+            dir_flags[entry.name] = False
+    if sort in {"mtime", "size"}:
+        stats = {}
+        for entry in entries:
+            try:
+                stats[entry.name] = entry.stat()
+            except OSError:
+                continue
+        entries = [i for i in entries if i.name in stats]
+        if sort == "mtime":
+            entries.sort(key=lambda i: stats[i.name].st_mtime, reverse=reverse)
+        else:
+            entries.sort(
+                key=lambda i: 0 if dir_flags[i.name] else stats[i.name].st_size,
+                reverse=reverse,
+            )
+    else:
+        entries.sort(key=lambda i: i.name, reverse=reverse)
+    # stable
+    entries.sort(key=lambda i: not dir_flags[i.name])
+    total = len(entries)
+    page = entries[offset : offset + limit] if limit else entries[offset:]
+    items = []
+    for entry in page:
+        try:
+            # cached by the DirEntry
+            stat = entry.stat()
+        except OSError:
+            continue
+        is_dir = dir_flags[entry.name]
+        items.append(
+            DirItem(entry.name, is_dir, None if is_dir else stat.st_size, stat.st_mtime)
+        )
+    return total, items
@@ -0,0 +1,148 @@
+import asyncio
+import io
+import typing
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from taska.asgi_app import app as asgi_app
+from taska.config import Config
+from taska.bottle_app import app as bottle_app
+
+PWD = "secret"
+
+
+class Reply(typing.NamedTuple):
+    status: int
+    headers: typing.List[typing.Tuple[str, str]]
+    body: bytes
+
+    def header(self, name: str) -> str:
+        return next((v for k, v in self.headers if k.lower() == name), "")
+
+    def cookie(self, name: str) -> str:
+        for k, v in self.headers:
+            if k.lower() == "set-cookie" and v.startswith(f"{name}="):
+                return v.split(";")[0]
+        return ""
+
+
+def call_bottle(method, path, query="", body=b"", cookie="", headers=()) -> Reply:
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "REMOTE_ADDR": "127.0.0.1",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.input": io.BytesIO(body),
+        "CONTENT_LENGTH": str(len(body)),
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+    }
+    if cookie:
+        environ["HTTP_COOKIE"] = cookie
+    for name, value in headers:
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    setup_testing_defaults(environ)
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result["status"], result["headers"] = int(status.split()[0]), headers
+
+    chunks = bottle_app.app(environ, start_response)
+    data = b"".join(chunks)
+    return Reply(result["status"], result["headers"], data)
+
+
+def call_asgi(method, path, query="", body=b"", cookie="", headers=()) -> Reply:
+    raw_headers = [(b"content-type", b"application/x-www-form-urlencoded")]
+    if cookie:
+        raw_headers.append((b"cookie", cookie.encode()))
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in headers]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query.encode(),
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 10000),
+        "server": ("127.0.0.1", 80),
+        "scheme": "http",
+    }
+    messages = []
+
+    async def run():
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi_app.app(scope, receive, send)
+
+    asyncio.run(run())
+    start = messages[0]
+    reply_headers = [(k.decode(), v.decode()) for k, v in start["headers"]]
+    data = b"".join(m.get("body", b"") for m in messages[1:])
+    return Reply(start["status"], reply_headers, data)
+
+
+@pytest.fixture(params=["bottle", "asgi"])
+def call(request, tmp_path):
+    bottle_app.setup_app(tmp_path)
+    bottle_app.Config.pwd = ""
+    bottle_app.AuthPlugin.blacklist.clear()
+    asgi_app.app.auth.check_cookie.cache.clear()
+    return {"bottle": call_bottle, "asgi": call_asgi}[request.param]
+
+
+def login(call, pwd=PWD) -> Reply:
+    return call("POST", "/login", body=urlencode({"pwd": pwd}).encode())
+
+
+def test_unauthenticated_paths_look_the_same(call):
+    for method, path in (("GET", "/view//"), ("GET", "/no/such/path"), ("POST", "/view//")):
+        reply = call(method, path)
+        assert reply.status == 303, (method, path)
+        assert reply.header("location").endswith("/login")
+
+
+def test_login(call):
+    reply = login(call)
+    assert reply.status == 303
+    cookie = reply.cookie("sign")
+    assert cookie
+    reply = call("GET", "/view//", cookie=cookie)
+    assert reply.status == 200
+    assert reply.header("s") == bottle_app.AuthPlugin().get_params_s("/view/<path:path>")
+    assert call("GET", "/no/such/path", cookie=cookie).status == 404
+
+
+def test_wrong_password(call):
+    login(call)
+    assert login(call, "wrong").status == 401
+    assert login(call, "wrong").status == 429
+
+
+def test_params_s(call):
+    s = bottle_app.AuthPlugin().get_params_s("/view/<path:path>")
+    assert call("GET", "/view//", query=f"s={s}").status == 200
+    assert call("GET", "/view//", query="s=bad").status == 303
+
+
+def test_metrics_bearer_token(call, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_TOKEN", "token1")
+    reply = call("GET", "/metrics", headers=[("Authorization", "Bearer token1")])
+    assert reply.status == 200
+    assert b"# TYPE" in reply.body
+    assert call("GET", "/metrics", headers=[("Authorization", "Bearer bad")]).status == 401
+    # only for the metrics
+    assert call("GET", "/view//", headers=[("Authorization", "Bearer token1")]).status == 303
+    monkeypatch.setattr(Config, "METRICS_TOKEN", "")
+    assert call("GET", "/metrics", headers=[("Authorization", "Bearer ")]).status == 401
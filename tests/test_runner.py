@@ -0,0 +1,94 @@
+import importlib.util
+import inspect
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from taska import cgroup, store
+
+RUNNER = Path(__file__).resolve().parent.parent / "taska" / "templates" / "runner.py"
+
+
+def load_runner():
+    spec = importlib.util.spec_from_file_location("runner", RUNNER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_job(root: Path, code: str, **meta) -> dict:
+    "Run the runner template on a job of `code`, return the last result."
+    job_dir = root / "python" / "venv" / "workspaces" / "workspace" / "jobs" / "job"
+    job_dir.mkdir(parents=True)
+    root.joinpath("max_workers").write_text("0")
+    job_dir.parents[1].joinpath("job_code.py").write_text(code)
+    job_meta = {
+        "entrypoint": "job_code:main",
+        "params": {},
+        "timeout": 30,
+        "mem_limit": "",
+        "result_limit": "",
+        "stdout_limit": "",
+    }
+    job_meta.update(meta)
+    job_dir.joinpath("meta.json").write_text(json.dumps(job_meta))
+    subprocess.run([sys.executable, RUNNER.as_posix()], cwd=job_dir, timeout=60)
+    lines = job_dir.joinpath("result.jsonl").read_text().splitlines()
+    return json.loads(lines[-1])
+
+
+def test_small_mem_limit(tmp_path):
+    code = "def main():\n    return len(bytearray(10 * 1024 ** 2))\n"
+    result = run_job(tmp_path, code, mem_limit="100m")
+    assert result["error"] is None
+    assert result["result"] == 10 * 1024**2
+
+
+def test_mem_limit_exceeded(tmp_path):
+    code = "def main():\n    return len(bytearray(500 * 1024 ** 2))\n"
+    result = run_job(tmp_path, code, mem_limit="100m")
+    assert "MemoryError" in result["error"]
+
+
+def get_body(function) -> str:
+    "The source without the def line."
+    return inspect.getsource(function).split("\n", 1)[1]
+
+
+def test_copies_in_sync():
+    # the runner runs in the venv python without taska, it keeps copies of these
+    runner = load_runner()
+    assert runner.RESULT_DB_SCHEMA == store.SCHEMA
+    assert runner.CGROUP_MOUNT == cgroup.CGROUP_MOUNT
+    assert get_body(runner.read_cgroup_stats) == get_body(cgroup.read_stats)
+
+
+def test_read_cgroup_stats(tmp_path):
+    tmp_path.joinpath("memory.events").write_text("low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n")
+    tmp_path.joinpath("cpu.stat").write_text("usage_usec 100\nnr_periods 5\nnr_throttled 2\nthrottled_usec 40\n")
+    tmp_path.joinpath("memory.peak").write_text("4096\n")
+    stats = cgroup.read_stats(tmp_path)
+    assert stats == load_runner().read_cgroup_stats(tmp_path)
+    assert stats["memory_oom_kill"] == 1 and stats["cpu_nr_throttled"] == 2
+    assert stats["memory_peak"] == 4096
+
+
+def test_stdout_format(tmp_path):
+    code = (
+        "import os\n"
+        "def main():\n"
+        "    print('line1\\nline2')\n"
+        "    print('a', end='')\n"
+        "    print('b')\n"
+        "    os.system('printf \"native1\\\\nnative2\\\\n\"')\n"
+        "    print('after')\n"
+    )
+    result = run_job(tmp_path, code)
+    assert result["error"] is None
+    log_path = next(tmp_path.rglob("stdout.log"))
+    lines = log_path.read_text().splitlines()
+    # the prefix starts each write after a newline, every line of the fd output
+    stripped = [line[22:] if line.startswith("[") else line for line in lines]
+    assert stripped == ["line1", "line2", "ab", "native1", "native2", "after"]
+    assert [line.startswith("[") for line in lines] == [True, False, True, True, True, True]